@@ -0,0 +1,148 @@
+"""
+Measures the per-frame cost of motion detection at different settings.
+
+Decodes frames from the test videos once, then runs the motion pipeline of
+DetectionSource (background subtraction, denoising, blobs) over them at
+each motion resolution, in color or grayscale, with and without the parallel
+background subtractor, and with the batched motion backend. Reports the mean
+and p99 time per frame.
+
+Usage: python -m benchmarks.motion_cost [--frames 300] [--cameras 4] [--idle 0]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from typing import Dict, List, Tuple
+
+import config
+import cv2 as cv
+import numpy as np
+from camera import DetectionSource, VideoSource
+from camera.detection_pool import default_num_threads
+from camera.motion import BatchedMotionEngine
+
+
+def load_frames(video_path: str, num_frames: int) -> List[np.ndarray]:
+    capture = cv.VideoCapture(video_path)
+    frames: List[np.ndarray] = []
+    while len(frames) < num_frames:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(cv.resize(frame, config.FRAME_SIZE))
+    capture.release()
+    return frames
+
+
+def run(
+    videos: List[Tuple[VideoSource, List[np.ndarray]]],
+    motion_frame_size: Tuple[int, int] | None,
+    grayscale: bool,
+    parallel: bool,
+    batched: bool = False,
+) -> Dict[str, float]:
+    sources = [
+        (
+            DetectionSource(
+                f"camera-{index}",
+                video_source,
+                motion_frame_size=motion_frame_size,
+                grayscale_motion=grayscale,
+                parallel_motion=parallel,
+            ),
+            frames,
+        )
+        for index, (video_source, frames) in enumerate(videos)
+    ]
+    motion_engine = BatchedMotionEngine() if batched else None
+    for source, _ in sources:
+        source.motion_engine = motion_engine
+
+    # Frames of every camera are handled one after the other, like the
+    # detection loop does
+    frame_times: List[float] = []
+    for index in range(min(len(frames) for _, frames in sources)):
+        if motion_engine is not None:
+            start = time.perf_counter()
+            motion_engine.process(
+                {
+                    source.name: source.get_motion_frame(frames[index])
+                    for source, frames in sources
+                }
+            )
+            # Shared by the cameras of the batch
+            batch_time = (time.perf_counter() - start) / len(sources)
+        for source, frames in sources:
+            start = time.perf_counter()
+            foreground_mask = source.get_foreground_mask(frames[index])
+            source.update_motion_energy(foreground_mask)
+            source.get_motion_boxes(source.find_blobs(foreground_mask))
+            frame_times.append(time.perf_counter() - start)
+            if motion_engine is not None:
+                frame_times[-1] += batch_time
+
+    return {
+        "mean (ms)": float(np.mean(frame_times)) * 1000,
+        "p99 (ms)": float(np.percentile(frame_times, 99)) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--videos", default=config.TEST_VID_DIRECTORY)
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument(
+        "--idle", type=int, default=0, help="cameras that only see a still frame"
+    )
+    args = parser.parse_args()
+
+    video_paths = [f"{args.videos}/{name}" for name in sorted(os.listdir(args.videos))]
+    # Videos are reused if there are more cameras than videos
+    video_paths = [video_paths[i % len(video_paths)] for i in range(args.cameras)]
+    video_sources = {path: VideoSource(path) for path in set(video_paths)}
+    videos = [
+        (video_sources[path], load_frames(path, args.frames)) for path in video_paths
+    ]
+    # Idle cameras see the first frame of a video over and over
+    for index in range(args.idle):
+        video_source, frames = videos[index % args.cameras]
+        videos.append((video_source, [frames[0]] * len(frames)))
+
+    num_threads = default_num_threads(len(videos))
+    print(
+        f"{args.cameras} cameras and {args.idle} idle cameras, "
+        f"{num_threads} OpenCV threads when parallel"
+    )
+    # Motion frame size, grayscale, parallel, batched
+    settings = [
+        (None, False, False, False),
+        (None, True, False, False),
+        ((320, 180), False, False, False),
+        ((320, 180), True, False, False),
+        ((320, 180), True, True, False),
+        ((160, 90), True, False, False),
+        ((320, 180), True, False, True),
+    ]
+    for motion_frame_size, grayscale, parallel, batched in settings:
+        cv.setNumThreads(num_threads if parallel else 1)
+        stats = run(videos, motion_frame_size, grayscale, parallel, batched)
+
+        width, height = motion_frame_size or config.FRAME_SIZE
+        name = f"{width}x{height} {'gray' if grayscale else 'color'}"
+        if parallel:
+            name += " parallel"
+        elif batched:
+            name += " batched"
+        values = "".join(f"{key} {value:>7.2f}    " for key, value in stats.items())
+        print(f"    {name:<28}{values}")
+
+    for video_source in video_sources.values():
+        video_source.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Measures the throughput of the whole detection pipeline on synthetic cameras.
+
+Generates synthetic videos (moving shapes on noisy backgrounds, lighting ramps,
+dark noisy scenes) and drives VideoSource -> DetectionSource ->
+IntruderDetector -> IntruderRecorder over them for 1, 4, 16 and 32 cameras.
+Videos are decoded as fast as possible unless --realtime is given. Motion
+detection runs in the detection thread unless --processes is given, which runs
+it in a pool of worker processes. Every camera count runs in a process of its
+own so that peak memory is measured separately.
+
+For each camera count it reports the frames per second of each stage and per
+camera, the p50/p99 latency from a frame being decoded to it being processed, peak RSS and
+CPU per camera. Results are written to a JSON file, which can be compared with
+the results of another commit using --compare.
+
+Usage: python -m benchmarks.pipeline [--cameras 1 4 16 32] [--seconds 20]
+    [--processes 0] [--output pipeline.json] [--compare old.json] [--realtime]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from threading import Thread
+from typing import Dict, List
+
+import config
+import cv2 as cv
+import numpy as np
+from camera import DetectionSource, IntruderDetector, VideoSource
+
+SCENES = ("shapes", "lighting", "night")
+
+
+def make_frame(scene: str, index: int, background: np.ndarray, rng) -> np.ndarray:
+    """
+    Draws frame `index` of a synthetic scene
+    """
+    seconds = index / config.FPS
+    frame = background.astype(np.int16)
+    if scene == "lighting":
+        # Slow brightness ramp, like clouds or dusk
+        frame += int(60 * np.sin(seconds / 4))
+    elif scene == "night":
+        frame = frame // 3
+
+    noise_level = 25 if scene == "night" else 6
+    frame += rng.normal(0, noise_level, frame.shape).astype(np.int16)
+
+    width, height = config.FRAME_SIZE
+    # Objects move through the scene for 4 seconds out of every 10
+    phase = seconds % 10
+    if phase < 4:
+        x_coord = int(phase / 4 * (width + 160)) - 80
+        y_coord = height // 2 + int(40 * np.sin(seconds * 2))
+        cv.rectangle(
+            frame, (x_coord, y_coord - 60), (x_coord + 50, y_coord + 60), (200,) * 3, -1
+        )
+        if scene == "shapes":
+            cv.circle(frame, (width - x_coord, height // 3), 30, (30, 30, 220), -1)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def make_video(path: str, scene: str, num_frames: int, seed: int) -> None:
+    """
+    Writes a synthetic video of `num_frames` frames at FRAME_SIZE
+    """
+    rng = np.random.default_rng(seed)
+    width, height = config.FRAME_SIZE
+    # Textured background so that noise and lighting changes aren't uniform
+    background = cv.GaussianBlur(
+        rng.integers(40, 200, (height, width, 3), dtype=np.uint8), (0, 0), 8
+    )
+    background = cv.normalize(background, None, 40, 200, cv.NORM_MINMAX)
+    writer = cv.VideoWriter(
+        path, cv.VideoWriter_fourcc(*"mp4v"), config.FPS, config.FRAME_SIZE
+    )
+    for index in range(num_frames):
+        writer.write(make_frame(scene, index, background, rng))
+    writer.release()
+
+
+class BenchmarkDetector(IntruderDetector):
+    """
+    IntruderDetector that times each stage. Recordings are saved but not
+    analyzed, so the benchmark doesn't depend on the object detection model
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.motion_times: List[float] = []
+        self.record_times: List[float] = []
+        self.save_times: List[float] = []
+        self.frame_latencies: List[float] = []
+        self.recordings_saved = 0
+
+    def detect_motion_in_frame(
+        self, frame: np.ndarray, source: DetectionSource
+    ) -> None:
+        start = time.perf_counter()
+        super().detect_motion_in_frame(frame, source)
+        self.motion_times.append(time.perf_counter() - start)
+
+    def check_for_intruders(
+        self, frame: np.ndarray, source: DetectionSource, min_conseq_frames: int
+    ) -> None:
+        start = time.perf_counter()
+        super().check_for_intruders(frame, source, min_conseq_frames)
+        self.record_times.append(time.perf_counter() - start)
+        self.frame_latencies.append(time.time() - source.frame_cursor.last_timestamp)
+
+    def _save_all_recordings(self, sources: List[DetectionSource]) -> None:
+        start = time.perf_counter()
+        self._recorder.save_all(sources, thumb=True, analyze=False)
+        self.save_times.append(time.perf_counter() - start)
+        self.recordings_saved += len(sources)
+
+
+def percentile(values: List[float], pct: float) -> float | None:
+    if not values:
+        return None
+    return float(np.percentile(values, pct))
+
+
+def stage_stats(times: List[float]) -> Dict[str, float | None]:
+    """
+    Frames per second a stage could sustain on its own and its time per frame
+    """
+    total = sum(times)
+    return {
+        "frames": len(times),
+        "fps": len(times) / total if total > 0 else None,
+        "p50_ms": None if not times else percentile(times, 50) * 1000,
+        "p99_ms": None if not times else percentile(times, 99) * 1000,
+    }
+
+
+def run(
+    video_paths: List[str],
+    num_cameras: int,
+    realtime: bool,
+    idle_fps: float,
+    num_processes: int = 0,
+) -> Dict[str, object]:
+    """
+    Runs the pipeline with `num_cameras` cameras until every video has ended.
+    `num_processes` is the number of motion detection processes, see
+    config.DETECTION_PROCESSES
+    """
+    video_sources = [
+        VideoSource(video_paths[index % len(video_paths)], realtime=realtime)
+        for index in range(num_cameras)
+    ]
+    sources = [
+        DetectionSource(f"camera-{index}", video_source)
+        for index, video_source in enumerate(video_sources)
+    ]
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with tempfile.TemporaryDirectory() as recording_directory:
+        detector = BenchmarkDetector(
+            sources,
+            recording_directory,
+            None,
+            None,
+            num_processes=num_processes,
+            idle_fps=idle_fps,
+        )
+        start = time.perf_counter()
+        detect_thread = Thread(target=detector.detect)
+        detect_thread.start()
+        detect_thread.join()
+        wall_time = time.perf_counter() - start
+        for source in sources:
+            source.stop()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu_time = (
+        usage.ru_utime
+        - usage_before.ru_utime
+        + usage.ru_stime
+        - usage_before.ru_stime
+        # Video writers run in ffmpeg processes, motion detection in the
+        # worker processes of the pool
+        + children.ru_utime
+        - children_before.ru_utime
+        + children.ru_stime
+        - children_before.ru_stime
+    )
+    latencies_ms = [latency * 1000 for latency in detector.frame_latencies]
+    frames_decoded = sum(source.frames.last_seq for source in sources)
+    frames_read = sum(source.frame_cursor.frames_read for source in sources)
+    return {
+        "cameras": num_cameras,
+        "wall_s": wall_time,
+        "stages": {
+            "decode": {
+                "frames": frames_decoded,
+                "fps": frames_decoded / wall_time,
+            },
+            "detect": {
+                "frames": frames_read,
+                "fps": frames_read / wall_time,
+                "fps_per_camera": frames_read / wall_time / num_cameras,
+                # Frames replaced by a newer one before detection got to them
+                "dropped": frames_decoded - frames_read,
+            },
+            "motion": stage_stats(detector.motion_times),
+            "record": stage_stats(detector.record_times),
+            "save": stage_stats(detector.save_times),
+        },
+        "recordings": detector.recordings_saved,
+        "latency_p50_ms": percentile(latencies_ms, 50),
+        "latency_p99_ms": percentile(latencies_ms, 99),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "cpu_percent_per_camera": cpu_time / wall_time / num_cameras * 100,
+    }
+
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: List[Dict[str, object]]) -> None:
+
+    for result in results:
+        stages = result["stages"]
+        print(f"{result['cameras']} cameras, {result['wall_s']:.1f} s")
+        print(
+            f"    decode {stages['decode']['fps']:7.1f} fps    "
+            f"detect {stages['detect']['fps']:7.1f} fps "
+            f"({stages['detect']['fps_per_camera']:.1f} per camera)    "
+            f"dropped {stages['detect']['dropped']}"
+        )
+        for stage in ("motion", "record", "save"):
+            stats = stages[stage]
+            if stats["frames"]:
+                print(
+                    f"    {stage:<8}{stats['fps']:9.1f} fps    "
+                    f"p50 {stats['p50_ms']:7.2f} ms    p99 {stats['p99_ms']:7.2f} ms"
+                )
+        if result["latency_p50_ms"] is not None:
+            print(
+                f"    latency p50 {result['latency_p50_ms']:.1f} ms    "
+                f"p99 {result['latency_p99_ms']:.1f} ms"
+            )
+        print(
+            f"    peak RSS {result['peak_rss_mb']:.0f} MB    "
+            f"CPU {result['cpu_percent_per_camera']:.1f} % per camera"
+        )
+
+
+def compare(results: List[Dict[str, object]], baseline_path: str) -> None:
+    """
+    Prints how the main metrics changed since the results in `baseline_path`
+    """
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    old_results = {result["cameras"]: result for result in baseline["results"]}
+
+    print(f"Compared with {baseline.get('commit') or baseline_path}")
+    for result in results:
+        old = old_results.get(result["cameras"])
+        if old is None:
+            continue
+        metrics = {
+            "detect fps": (
+                old["stages"]["detect"]["fps"],
+                result["stages"]["detect"]["fps"],
+            ),
+            "latency p99": (old["latency_p99_ms"], result["latency_p99_ms"]),
+            "peak RSS": (old["peak_rss_mb"], result["peak_rss_mb"]),
+            "CPU per camera": (
+                old["cpu_percent_per_camera"],
+                result["cpu_percent_per_camera"],
+            ),
+        }
+        changes = "    ".join(
+            f"{name} {(new - old_value) / old_value * 100:+.1f} %"
+            for name, (old_value, new) in metrics.items()
+            if old_value and new is not None
+        )
+        print(f"    {result['cameras']} cameras    {changes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument(
+        "--realtime", action="store_true", help="release frames at the camera rate"
+    )
+    parser.add_argument(
+        "--idle-fps",
+        type=float,
+        default=0,
+        help="detection rate of cameras without motion, 0 processes every frame",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=0,
+        help="motion detection processes, 0 detects in the detection thread "
+        "and -1 uses one process per spare core",
+    )
+    parser.add_argument("--output", default="pipeline_benchmark.json")
+    parser.add_argument("--compare", help="results of an earlier run")
+    args = parser.parse_args()
+
+    # Each camera count runs in a fresh process so that peak RSS isn't carried
+    # over from the previous run
+    context = mp.get_context("spawn")
+    results: List[Dict[str, object]] = []
+    with tempfile.TemporaryDirectory() as video_directory:
+        num_frames = int(args.seconds * config.FPS)
+        video_paths = []
+        for seed, scene in enumerate(SCENES):
+            video_path = f"{video_directory}/{scene}.mp4"
+            make_video(video_path, scene, num_frames, seed)
+            video_paths.append(video_path)
+
+        for num_cameras in args.cameras:
+            # Pool processes are daemonic and can't start detection processes
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                results.append(
+                    executor.submit(
+                        run,
+                        video_paths,
+                        num_cameras,
+                        args.realtime,
+                        args.idle_fps,
+                        args.processes,
+                    ).result()
+                )
+
+    report = {
+        "commit": get_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "seconds": args.seconds,
+            "realtime": args.realtime,
+            "idle_fps": args.idle_fps,
+            "processes": args.processes,
+            "frame_size": config.FRAME_SIZE,
+            "motion_frame_size": config.MOTION_FRAME_SIZE,
+            "motion_backend": config.MOTION_BACKEND,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    print_results(results)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Measures how long it takes the intruder detector to react to frames.
+
+Runs the detector over the test videos twice: once with the old polling loop
+(sleep 1/FPS, every other iteration skipped) and once with the event driven loop.
+For each mode it reports how old frames are when they get processed and the time
+between the capture of the first motion frame and the detector triggering.
+
+Usage: python -m benchmarks.trigger_latency [--seconds 20] [--min-conseq-frames 10]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from threading import Thread
+from typing import Dict, List
+
+import config
+import numpy as np
+from camera import DetectionSource, IntruderDetector, VideoSource
+
+
+class LatencyDetector(IntruderDetector):
+    """
+    IntruderDetector that records latencies instead of recording intruders
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frame_ages: List[float] = []
+        self.trigger_latencies: List[float] = []
+        self.processed_seqs: Dict[str, List[int]] = {}
+        self._motion_onsets: Dict[str, float] = {}
+
+    def _current_packet(self, source: DetectionSource):
+        return source.frame_cursor.last_seq, source.frame_cursor.last_timestamp
+
+    def detect_motion_in_frame(
+        self, frame: np.ndarray, source: DetectionSource
+    ) -> None:
+        seq, timestamp = self._current_packet(source)
+        self.frame_ages.append(time.time() - timestamp)
+        self.processed_seqs.setdefault(source.name, []).append(seq)
+
+        super().detect_motion_in_frame(frame, source)
+        if source.conseq_motion_frames == 1:
+            self._motion_onsets[source.name] = timestamp
+
+    def check_for_intruders(
+        self, frame: np.ndarray, source: DetectionSource, min_conseq_frames: int
+    ) -> None:
+        if source.conseq_motion_frames == min_conseq_frames:
+            onset = self._motion_onsets.get(source.name)
+            if onset is not None:
+                self.trigger_latencies.append(time.time() - onset)
+
+    def _save_recordings(self, source: DetectionSource) -> None:
+        pass
+
+
+class PollingLatencyDetector(LatencyDetector):
+    """
+    Reproduces the detection loop used before frames were delivered through events
+    """
+
+    def _current_packet(self, source: DetectionSource):
+        packet = source.source.read_packet()
+        return packet.seq, packet.timestamp
+
+    def detect(self, min_conseq_frames: int = 10) -> None:
+        self._detection_status = True
+
+        frame_count = 0
+        self.start_sources()
+        time.sleep(1)
+        while self.get_detection_status():
+
+            if frame_count % 2 == 1:
+                time.sleep(1 / config.FPS)
+                frame_count += 1
+                continue
+
+            for source in self.detection_sources:
+                frame = self.read_frame(source, resize_frame=(640, 360))
+                if frame is None:
+                    continue
+                self.detect_motion_in_frame(frame, source)
+                self.check_for_intruders(frame, source, min_conseq_frames)
+
+            frame_count += 1
+            # Stands in for cv.waitKey(1000 // config.FPS)
+            time.sleep(1 / config.FPS)
+
+        self.stop_detection()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    return float(np.percentile(values, pct))
+
+
+def run(detector_class, video_paths: List[str], seconds: float, min_conseq_frames: int):
+    video_sources = [VideoSource(path) for path in video_paths]
+    sources = [DetectionSource(source.name, source) for source in video_sources]
+    with tempfile.TemporaryDirectory() as recording_directory:
+        detector = detector_class(
+            sources, recording_directory, None, None, display_frame=False
+        )
+        detect_thread = Thread(target=detector.detect, args=(min_conseq_frames,))
+        detect_thread.start()
+        time.sleep(seconds)
+        detector.stop_detection()
+        for source in sources:
+            source.stop()
+        detect_thread.join()
+
+    num_processed = sum(len(seqs) for seqs in detector.processed_seqs.values())
+    num_unique = sum(len(set(seqs)) for seqs in detector.processed_seqs.values())
+    return {
+        "frames processed": num_processed,
+        "duplicate frames": num_processed - num_unique,
+        "frame age p50 (ms)": percentile(detector.frame_ages, 50) * 1000,
+        "frame age p99 (ms)": percentile(detector.frame_ages, 99) * 1000,
+        "triggers": len(detector.trigger_latencies),
+        "trigger latency mean (ms)": (
+            statistics.mean(detector.trigger_latencies) * 1000
+            if detector.trigger_latencies
+            else float("nan")
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--videos", default=config.TEST_VID_DIRECTORY)
+    parser.add_argument("--num-videos", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--min-conseq-frames", type=int, default=10)
+    args = parser.parse_args()
+
+    video_paths = [f"{args.videos}/{name}" for name in sorted(os.listdir(args.videos))][
+        : args.num_videos
+    ]
+
+    results = {
+        "poll (before)": run(
+            PollingLatencyDetector, video_paths, args.seconds, args.min_conseq_frames
+        ),
+        "event (after)": run(
+            LatencyDetector, video_paths, args.seconds, args.min_conseq_frames
+        ),
+    }
+
+    for mode, stats in results.items():
+        print(mode)
+        for name, value in stats.items():
+            print(f"    {name:<28}{value:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,7 @@
+from .analysis import IntruderAnalyzer
 from .camera import CameraSource, VideoSource
 from .camera_manager import CameraManager
-from .detection import (
-    DetectionSource,
-    IntruderAnalyzer,
-    IntruderDetector,
-    IntruderRecorder,
-)
+from .detection import DetectionSource, IntruderDetector
 from .live_feed import LiveFeed
+from .recorder import IntruderRecorder
+from .simulated import SimulatedStream
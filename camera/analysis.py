@@ -0,0 +1,499 @@
+from __future__ import annotations
+
+import queue
+import time
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import config
+import cv2 as cv
+import numpy as np
+
+from . import metrics
+from .roi import Box, Region, crop_regions, get_regions_of_interest
+from .tracing import TRACER
+
+
+class AnalysisJob(NamedTuple):
+    """
+    Frames of one or more recordings waiting to be classified
+    """
+
+    # Maps source names to the frames recorded for them
+    frames: Dict[str, List[np.ndarray]]
+    on_done: Callable[[Dict[str, List[str]]], None]
+    submitted_at: float
+    # Moving objects in each of the frames, if they are known
+    regions: Dict[str, List[List[Box]]] | None
+
+
+# Size of the thumbnails used to compare frames with each other
+_THUMB_SIZE = (64, 36)
+# Frames whose thumbnails differ in fewer pixels than this are duplicates
+_MIN_CHANGED_PIXELS = 0.002
+
+
+def select_frames(
+    frames: List[np.ndarray], motion_energy: List[float], max_frames: int
+) -> List[np.ndarray]:
+    """
+    Picks up to `max_frames` representative frames of a recording,
+    see `select_frame_indices`
+    """
+    indices = select_frame_indices(frames, motion_energy, max_frames)
+    return [frames[index] for index in indices]
+
+
+def select_frame_indices(
+    frames: List[np.ndarray], motion_energy: List[float], max_frames: int
+) -> List[int]:
+    """
+    Picks up to `max_frames` representative frames of a recording.
+    The recording is split into equal parts and the frame with the most motion
+    is taken from each part, so that every stage of the event is covered.
+    Frames that are nearly identical to a frame with more motion are dropped.
+    Returns the indices of the frames from most to least motion
+    """
+    if not frames or max_frames < 1:
+        return []
+
+    energy = np.asarray(motion_energy, dtype=np.float32)
+    segments = np.array_split(np.arange(len(frames)), min(max_frames, len(frames)))
+    candidates = [int(segment[np.argmax(energy[segment])]) for segment in segments]
+    candidates.sort(key=lambda index: energy[index], reverse=True)
+
+    selected: List[int] = []
+    thumbs: List[np.ndarray] = []
+    for index in candidates:
+        thumb = cv.resize(
+            cv.cvtColor(frames[index], cv.COLOR_BGR2GRAY),
+            _THUMB_SIZE,
+            interpolation=cv.INTER_AREA,
+        )
+        is_duplicate = any(
+            np.count_nonzero(cv.absdiff(thumb, other) > 25) / thumb.size
+            < _MIN_CHANGED_PIXELS
+            for other in thumbs
+        )
+        if not is_duplicate:
+            selected.append(index)
+            thumbs.append(thumb)
+
+    return selected
+
+
+def predict_labels(
+    analyzer,
+    frames: Dict[str, List[np.ndarray]],
+    regions: Dict[str, List[List[Box]]] | None = None,
+    frames_per_round: int = 2,
+    person_confidence: float = config.PERSON_CONFIDENCE_THRESHOLD,
+) -> Dict[str, List[str]]:
+    """
+    Runs an IntruderAnalyzer on the frames of several sources at once.
+    Frames are analyzed `frames_per_round` at a time for each source, and a
+    source is not analyzed any further once a person has been detected with
+    `person_confidence`. `regions` holds the moving objects of each frame,
+    which lets the analyzer look at them up close.
+    Returns the labels that were detected for each source
+    """
+    predictions: Dict[str, List[str]] = {name: [] for name in frames}
+    remaining = {
+        name: [
+            (frame, regions[name][i] if regions is not None else [])
+            for i, frame in enumerate(source_frames)
+            if frame is not None
+        ]
+        for name, source_frames in frames.items()
+    }
+
+    while remaining:
+        names: List[str] = []
+        batch: List[np.ndarray] = []
+        batch_regions: List[List[Box]] = []
+        for name, source_frames in remaining.items():
+            for frame, boxes in source_frames[:frames_per_round]:
+                names.append(name)
+                batch.append(frame)
+                batch_regions.append(boxes)
+
+        found_person = set()
+        detections_per_frame = analyzer.analyze_frames(
+            batch, batch_regions if regions is not None else None
+        )
+        for name, detections in zip(names, detections_per_frame):
+            predictions[name].extend(detections.labels.tolist())
+            is_person = detections.labels == "person"
+            if np.any(detections.confidences[is_person] >= person_confidence):
+                found_person.add(name)
+
+        remaining = {
+            name: source_frames[frames_per_round:]
+            for name, source_frames in remaining.items()
+            if name not in found_person and len(source_frames) > frames_per_round
+        }
+
+    return predictions
+
+
+class AnalysisWorkerPool:
+    """
+    Classifies recorded intruders in the background.
+    Every worker thread loads its own network with `analyzer_factory`, so
+    workers never share a network. OpenCV releases the GIL while a network runs,
+    which lets the workers run in parallel with each other and with detection.
+    The queue is bounded: once `max_queued` jobs are waiting, `submit` blocks
+    until a worker picks one up
+    """
+
+    def __init__(
+        self,
+        analyzer_factory: Callable[[], Any],
+        num_workers: int = config.ANALYSIS_WORKERS,
+        max_queued: int = config.ANALYSIS_QUEUE_SIZE,
+    ):
+        if num_workers < 1:
+            raise ValueError("ERROR: The analysis pool needs at least one worker")
+
+        self.num_workers = num_workers
+        self._analyzer_factory = analyzer_factory
+        self._jobs: queue.Queue[AnalysisJob | None] = queue.Queue(maxsize=max_queued)
+        self._workers: List[Thread] = []
+        self._lock = Lock()
+
+        self._jobs_submitted = 0
+        self._jobs_completed = 0
+        self._jobs_failed = 0
+        self._jobs_in_progress = 0
+        self._blocked_submits = 0
+        self._last_wait = 0.0
+        self._max_wait = 0.0
+        self._last_latency = 0.0
+        self._total_analysis_time = 0.0
+        metrics.ANALYSIS_QUEUE_DEPTH.add_callback(
+            self, lambda pool: {(): pool.queue_depth}
+        )
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._workers)
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Number of jobs waiting for a worker
+        """
+        return self._jobs.qsize()
+
+    def start(self) -> AnalysisWorkerPool:
+        """
+        Starts the worker threads
+        """
+        with self._lock:
+            if self._workers:
+                return self
+            for i in range(self.num_workers):
+                worker = Thread(
+                    target=self._run_worker, name=f"intruder-analysis-{i}", daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+        return self
+
+    def submit(
+        self,
+        frames: Dict[str, List[np.ndarray]],
+        on_done: Callable[[Dict[str, List[str]]], None],
+        regions: Dict[str, List[List[Box]]] | None = None,
+    ) -> None:
+        """
+        Queues frames for analysis. `on_done` is called from a worker thread with
+        the labels detected for each source.
+        Blocks while the queue is full
+        """
+        self.start()
+        job = AnalysisJob(frames, on_done, time.monotonic(), regions)
+        with self._lock:
+            self._jobs_submitted += 1
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._blocked_submits += 1
+            print("Analysis queue is full, waiting for a worker")
+            self._jobs.put(job)
+
+    def stop(self) -> None:
+        """
+        Waits for every queued job to be analyzed and stops the workers
+        """
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            self._jobs.put(None)
+        for worker in workers:
+            worker.join()
+
+    def get_stats(self) -> Dict[str, float | int]:
+        """
+        Returns counters that show how far analysis is lagging behind
+        """
+        with self._lock:
+            return {
+                "queued": self.queue_depth,
+                "in_progress": self._jobs_in_progress,
+                "submitted": self._jobs_submitted,
+                "completed": self._jobs_completed,
+                "failed": self._jobs_failed,
+                "blocked_submits": self._blocked_submits,
+                # Seconds the last job waited in the queue
+                "last_wait": self._last_wait,
+                "max_wait": self._max_wait,
+                # Seconds from submitting the last job until its labels were ready
+                "last_latency": self._last_latency,
+                "mean_analysis_time": (
+                    self._total_analysis_time / self._jobs_completed
+                    if self._jobs_completed
+                    else 0.0
+                ),
+            }
+
+    def _run_worker(self) -> None:
+        """
+        Takes jobs off the queue until it receives None
+        """
+        try:
+            analyzer = self._analyzer_factory()
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"ERROR: Could not load intruder analyzer: {err}")
+            analyzer = None
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+
+            started_at = time.monotonic()
+            with self._lock:
+                self._jobs_in_progress += 1
+                self._last_wait = started_at - job.submitted_at
+                self._max_wait = max(self._max_wait, self._last_wait)
+
+            try:
+                if analyzer is None:
+                    raise RuntimeError("ERROR: No intruder analyzer available")
+                with TRACER.span("analysis", ",".join(job.frames)):
+                    predictions = predict_labels(analyzer, job.frames, job.regions)
+                job.on_done(predictions)
+                failed = False
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"ERROR: Could not analyze intruders: {err}")
+                failed = True
+
+            finished_at = time.monotonic()
+            metrics.ANALYSIS_JOBS.labels("failure" if failed else "success").inc()
+            if not failed:
+                metrics.ANALYSIS_LATENCY.observe(finished_at - job.submitted_at)
+            with self._lock:
+                self._jobs_in_progress -= 1
+                if failed:
+                    self._jobs_failed += 1
+                else:
+                    self._jobs_completed += 1
+                    self._total_analysis_time += finished_at - started_at
+                    self._last_latency = finished_at - job.submitted_at
+
+
+class FrameDetections(NamedTuple):
+    """
+    Objects detected in a single frame by IntruderAnalyzer
+    """
+
+    labels: np.ndarray
+    confidences: np.ndarray
+    # Boxes (x1, y1, x2, y2) of the objects in frame coordinates
+    boxes: np.ndarray
+
+
+class IntruderAnalyzer:
+
+    confidence_threshold = 0.25
+    # Maximum number of frames in a single forward pass
+    batch_size = 16
+    # Crops covering more than this fraction of a frame are not worth it,
+    # the whole frame is analyzed instead
+    max_roi_coverage = 0.5
+
+    ssd_classes = [
+        "background",
+        "aeroplane",
+        "bicycle",
+        "bird",
+        "boat",
+        "bottle",
+        "bus",
+        "car",
+        "cat",
+        "chair",
+        "cow",
+        "diningtable",
+        "dog",
+        "horse",
+        "motorbike",
+        "person",
+        "pottedplant",
+        "sheep",
+        "sofa",
+        "train",
+        "tvmonitor",
+    ]
+    _class_names = np.array(ssd_classes)
+
+    def __init__(
+        self,
+        use_roi: bool = config.ANALYSIS_ROI,
+        roi_padding: float = config.ROI_PADDING,
+        roi_min_size: int = config.ROI_MIN_SIZE,
+    ):
+        self.use_roi = use_roi
+        self.roi_padding = roi_padding
+        self.roi_min_size = roi_min_size
+
+        # Path to SSD weights and configuration files
+        ssd_weights = "./ssd/MobileNetSSD_deploy.caffemodel"
+        ssd_config = "./ssd/MobileNetSSD_deploy.prototxt"
+
+        self.net = cv.dnn.readNetFromCaffe(ssd_config, ssd_weights)
+
+    def analyze_frame(self, frame: np.ndarray) -> List[str] | None:
+        """
+        Uses a deep learning object detector to analyze the frames of motion
+        Returns a list of predicted labels
+        """
+
+        if frame is None:
+            return None
+        labels = self.analyze_frames([frame])[0].labels
+        if len(labels) == 0:
+            return None
+        return labels.tolist()
+
+    def analyze_frames(
+        self,
+        frames: List[np.ndarray],
+        regions: Optional[List[List[Box]]] = None,
+    ) -> List[FrameDetections]:
+        """
+        Runs the object detector on several frames with one forward pass per
+        `batch_size` frames. Returns the detected objects of each frame.
+        If `regions` holds the moving objects of each frame and ROI mode is on,
+        only crops around the moving objects are analyzed
+        """
+
+        if regions is None or not self.use_roi:
+            return self._analyze_images(frames)
+
+        crops, crop_origins, crop_ids = crop_regions(
+            frames,
+            regions,
+            self.roi_padding,
+            self.roi_min_size,
+            self.max_roi_coverage,
+        )
+        crop_detections = self._analyze_images(crops)
+
+        # Every frame has at least one crop
+        results: List[FrameDetections] = []
+        for frame_id in range(len(frames)):
+            frame_detections: List[FrameDetections] = []
+            for crop_id in np.flatnonzero(crop_ids == frame_id):
+                # Move the boxes from crop to frame coordinates
+                x_offset, y_offset = crop_origins[crop_id]
+                crop_detections[crop_id].boxes[:] += (x_offset, y_offset) * 2
+                frame_detections.append(crop_detections[crop_id])
+            results.append(
+                FrameDetections(
+                    np.concatenate(
+                        [detections.labels for detections in frame_detections]
+                    ),
+                    np.concatenate(
+                        [detections.confidences for detections in frame_detections]
+                    ),
+                    np.concatenate(
+                        [detections.boxes for detections in frame_detections]
+                    ),
+                )
+            )
+        return results
+
+    def get_regions_of_interest(
+        self, boxes: List[Box], frame_shape: Tuple[int, ...]
+    ) -> List[Region]:
+        """
+        Returns the crops (x1, y1, x2, y2) of a frame that are analyzed for the
+        moving objects `boxes`, see `roi.get_regions_of_interest`
+        """
+
+        return get_regions_of_interest(
+            boxes,
+            frame_shape,
+            self.roi_padding,
+            self.roi_min_size,
+            self.max_roi_coverage,
+        )
+
+    def _analyze_images(self, frames: List[np.ndarray]) -> List[FrameDetections]:
+        """
+        Runs the object detector on whole images
+        """
+
+        results: List[FrameDetections] = []
+        for start in range(0, len(frames), self.batch_size):
+            batch = frames[start : start + self.batch_size]
+            # Convert the frames into an appropriate format for SSD
+            blob = cv.dnn.blobFromImages(batch, 0.007843, (300, 300), 127.5)
+            self.net.setInput(blob)
+            # Perform inference on the whole batch
+            forward_start = time.perf_counter()
+            detections = self.net.forward()
+            metrics.SSD_SECONDS.observe(time.perf_counter() - forward_start)
+            metrics.SSD_IMAGES.inc(len(batch))
+            for frame, frame_detections in zip(
+                batch,
+                self.parse_detections(
+                    detections, len(batch), self.confidence_threshold
+                ),
+            ):
+                # Boxes are normalized by SSD
+                height, width = frame.shape[:2]
+                frame_detections.boxes[:] *= (width, height, width, height)
+                results.append(frame_detections)
+        return results
+
+    @classmethod
+    def parse_detections(
+        cls, detections: np.ndarray, num_frames: int, confidence_threshold: float
+    ) -> List[FrameDetections]:
+        """
+        Splits the output of the SSD network into the detections of each frame
+        and drops detections below the confidence threshold.
+        Each row of `detections` is (frame index, class id, confidence, box).
+        Boxes are left in normalized coordinates
+        """
+
+        rows = detections.reshape(-1, 7)
+        rows = rows[rows[:, 2] > confidence_threshold]
+        frame_ids = rows[:, 0].astype(np.intp)
+        class_ids = rows[:, 1].astype(np.intp)
+        labels = cls._class_names[class_ids]
+        confidences = rows[:, 2]
+        boxes = rows[:, 3:7]
+
+        return [
+            FrameDetections(
+                labels[frame_ids == i],
+                confidences[frame_ids == i],
+                boxes[frame_ids == i],
+            )
+            for i in range(num_frames)
+        ]
@@ -1,39 +1,102 @@
 from __future__ import annotations
 
 import json
+import queue
 import shutil
 import subprocess
 import time
 from threading import Thread
-from typing import Optional, Tuple
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
 
 import config
 import cv2 as cv
 import numpy as np
 from vidgear.gears import VideoGear
 
+from . import metrics
+from .frame_buffer import FrameBuffer, FrameCursor, FramePacket
+from .ingest import StreamIngest
+
+
+class StreamBackend(NamedTuple):
+    """
+    Opens the streams of cameras whose URL has a scheme other than rtsp.
+    `open_stream` takes the CameraSource and returns an object with the `read`
+    and `stop` methods of StreamIngest, which may also have its
+    `hls_directory` and `segment_directory`. `check_alive` takes the URL and
+    a timeout in seconds
+    """
+
+    open_stream: Callable[[Any], Any]
+    check_alive: Callable[[str, int], bool]
+
+
+# Stream backends by URL scheme, see register_backend
+STREAM_BACKENDS: Dict[str, StreamBackend] = {}
+
+
+def register_backend(
+    scheme: str,
+    open_stream: Callable[[Any], Any],
+    check_alive: Callable[[str, int], bool],
+) -> None:
+    """
+    Lets cameras use URLs starting with `scheme`://
+    """
+    STREAM_BACKENDS[scheme] = StreamBackend(open_stream, check_alive)
+
+
+def get_backend(source: str) -> StreamBackend | None:
+    """
+    Returns the backend of a camera URL, None for RTSP cameras
+    """
+    scheme = source.split("://", 1)[0] if "://" in source else None
+    return STREAM_BACKENDS.get(scheme)
+
 
 class CameraSource:
     """
     Class that represents a single IP camera
     """
 
-    def __init__(self, name: str, source: str, max_reset_attempts: int = 5):
+    def __init__(
+        self,
+        name: str,
+        source: str,
+        max_reset_attempts: int = 5,
+        connect: bool = True,
+        low_latency: bool = False,
+        hls_segment_duration: float | None = None,
+        frame_size: Tuple[int, int] = config.FRAME_SIZE,
+    ):
         """
         Inits CameraSource objects.
+        If `connect` is False the camera is not connected to until `connect()`
+        is called, which lets a ConnectionSupervisor connect in the background.
+        `low_latency` and `hls_segment_duration` configure the live feed.
+        Frames are decoded at `frame_size`
         """
         self.name = name
         self.source = CameraSource.validate_source_url(source)
+        self.frame_size = frame_size
+        self.low_latency = low_latency
+        self.hls_segment_duration = hls_segment_duration
+        self.frames = FrameBuffer()
+        # Called from the capture thread when the camera stops sending frames.
+        # If it is not set the capture thread tries to reconnect by itself
+        self.on_disconnect: Callable[[CameraSource], None] | None = None
 
-        self._current_frame: np.ndarray | None = None
         self._connected: bool = False
         self._camera_open: bool = False
-        self._camera: VideoGear | None = None
+        self._camera: VideoGear | StreamIngest | None = None
         self._camera_thread: Thread | None = None
         self._reconnect_attempts: int = 0
         self._max_reconnect_attempts = max_reset_attempts
+        metrics.CAMERA_CONNECTED.add_callback(self, CameraSource._get_connected_metric)
+        metrics.FFMPEG_UP.add_callback(self, CameraSource._get_ffmpeg_metrics)
 
-        self._connect_to_cam()
+        if connect:
+            self._connect_to_cam()
 
     @property
     def is_active(self) -> bool:
@@ -42,36 +105,89 @@ class CameraSource:
         """
         return self._camera_open and self._connected
 
+    @property
+    def is_connected(self) -> bool:
+        """
+        Returns whether the stream of the camera is open
+        """
+        return self._connected
+
+    def connect(self) -> None:
+        """
+        Connects to the camera, closing the previous connection if there is one.
+        Raises a RuntimeError if the camera can't be reached
+        """
+        self._release_camera()
+        self._connect_to_cam()
+
     def get_rtsp_link(self):
         """
         Returns the rtsp link of the IP camera
         """
         return self.source
 
+    @property
+    def hls_directory(self) -> str | None:
+        """
+        Returns the directory of the HLS playlist of the camera if its
+        connection also serves the live feed
+        """
+        if isinstance(self._camera, StreamIngest) or get_backend(self.source):
+            return getattr(self._camera, "hls_directory", None)
+        return None
+
+    @property
+    def segment_directory(self) -> str | None:
+        """
+        Returns the directory the connection of the camera writes stream-copy
+        recording segments to, if it does
+        """
+        if isinstance(self._camera, StreamIngest) or get_backend(self.source):
+            return getattr(self._camera, "segment_directory", None)
+        return None
+
     def start(self) -> CameraSource:
         """
         Starts reading frames from the camera
         """
-        if self._camera_open:
-            print(f"Camera {self.name} is already on")
-        else:
+        camera_thread = self._camera_thread
+        if camera_thread is not None and camera_thread.is_alive():
+            if self._camera_open:
+                print(f"Camera {self.name} is already on")
+                return self
+            # The camera was stopped and reconnected, wait for the capture
+            # thread of the old connection to notice
+            camera_thread.join(timeout=config.CAMERA_READ_TIMEOUT)
+
+        if camera_thread is None or not camera_thread.is_alive():
             self._camera_open = True
-            self._camera_thread = Thread(target=self._update_frame)
+            self._camera_thread = Thread(target=self._update_frame, daemon=True)
             self._camera_thread.start()
 
         return self
 
     def read(self, resize_frame: Optional[Tuple[int, int]] = None) -> np.ndarray | None:
         """
-        Returns a frame from the camera source and optionally resizes it
+        Returns the latest frame from the camera source and optionally resizes it.
+        Resized frames are shared with every other reader of the same frame
         """
-        if resize_frame and self._current_frame is not None:
-            return cv.resize(
-                self._current_frame,
-                resize_frame,
-                cv.INTER_NEAREST,
-            )
-        return self._current_frame
+        packet = self.frames.latest()
+        if packet is None:
+            return None
+        return packet.resized(resize_frame)
+
+    def read_packet(self) -> FramePacket | None:
+        """
+        Returns the latest frame along with its sequence number and capture time
+        """
+        return self.frames.latest()
+
+    def cursor(self, name: str) -> FrameCursor:
+        """
+        Returns a cursor that can be used to read the frames of this camera
+        without reprocessing or silently missing any of them
+        """
+        return self.frames.cursor(name)
 
     def _update_frame(self) -> None:
         """
@@ -80,10 +196,20 @@ class CameraSource:
         """
 
         while self.is_active:
-            # Read a frame from the camera
-            frame: np.ndarray | None = self._camera.read()
-            if frame is None and self.is_active:
+            # Block until the camera delivers a new frame
+            frame: np.ndarray | None = self._read_camera()
+            if frame is None:
+                if not self.is_active:
+                    break
                 self._connected = False
+                metrics.CAMERA_DISCONNECTS.labels(self.name).inc()
+
+                if self.on_disconnect is not None:
+                    # Let the supervisor reconnect without blocking this thread
+                    self._release_camera()
+                    self.on_disconnect(self)
+                    break
+
                 # Attempt a reconnection if the frame cannot be read
                 try:
                     self._reconnect()
@@ -92,10 +218,31 @@ class CameraSource:
                     print(f"ERROR: Could not connect to {self.name}.")
                     print("Stopping camera.")
                     self.stop()
+                continue
 
-            # Update frame
-            self._current_frame = frame
-            time.sleep(1 / config.FPS)
+            if frame.shape[1::-1] != self.frame_size:
+                # VideoGear decodes at the resolution of the camera
+                frame = cv.resize(frame, self.frame_size)
+
+            # Update frame and wake up consumers waiting for it
+            self.frames.put(frame)
+            metrics.FRAMES_CAPTURED.labels(self.name).inc()
+
+    def _read_camera(self) -> np.ndarray | None:
+        """
+        Reads the next frame from the camera.
+        Returns None if the camera did not produce a frame within
+        `config.CAMERA_READ_TIMEOUT` seconds
+        """
+        camera = self._camera
+        if camera is None:
+            return None
+        try:
+            return camera.read()
+        except queue.Empty:
+            print(f"{self.name} stopped sending frames")
+            metrics.CAMERA_STALLS.labels(self.name).inc()
+            return None
 
     def stop(self) -> None:
         """
@@ -105,9 +252,16 @@ class CameraSource:
         self._connected = False
         self._camera_open = False
         self._reconnect_attempts = 0
+        self.frames.clear()
+        self._release_camera()
 
-        if self._camera and self._camera_open:
-            self._camera.stop()
+    def _release_camera(self) -> None:
+        """
+        Closes the stream of the camera
+        """
+        camera, self._camera = self._camera, None
+        if camera is not None:
+            camera.stop()
 
     @staticmethod
     def check_source_alive(source: str, timeout: int = 5) -> bool:
@@ -116,6 +270,10 @@ class CameraSource:
         the source is alive. This is much faster than connecting to the
         camera then failing
         """
+        backend = get_backend(source)
+        if backend is not None:
+            return backend.check_alive(source, timeout)
+
         if not shutil.which("ffprobe"):
             raise RuntimeError("ERROR: Please install ffmpeg/ffprobe.")
 
@@ -148,13 +306,17 @@ class CameraSource:
     @staticmethod
     def validate_source_url(source: str) -> str:
         """
-        Validates the rtsp link
+        Validates the rtsp link. URLs of registered stream backends are
+        accepted as they are
         """
 
         err_message = "ERROR: Source must be an RTSP URL"
         if not isinstance(source, str):
             raise ValueError(err_message)
 
+        if get_backend(source) is not None:
+            return source
+
         if not source.startswith("rtsp://"):
             raise ValueError(err_message)
 
@@ -168,21 +330,53 @@ class CameraSource:
         Connects to an IP camera on the network
         """
         if not CameraSource.check_source_alive(self.source):
+            metrics.CAMERA_CONNECTS.labels(self.name, "failure").inc()
             raise RuntimeError(f"ERROR: Could not connect to camera {self.name}.")
         try:
             print(f"{self.name} alive attempting connection")
-            options = {"THREADED_QUEUE_MODE": False}
-            camera = VideoGear(
-                source=self.source, logging=True, time_delay=2, **options
-            ).start()
+            camera = self._open_stream()
             self._connected = True
             self._camera = camera
+            metrics.CAMERA_CONNECTS.labels(self.name, "success").inc()
             print(f"Connected to camera {self.name}")
         except RuntimeError as err:
+            metrics.CAMERA_CONNECTS.labels(self.name, "failure").inc()
             raise RuntimeError(
                 f"ERROR: Could not connect to camera {self.name}."
             ) from err
 
+    def _open_stream(self) -> VideoGear | StreamIngest:
+        """
+        Opens the RTSP stream of the camera.
+        Reads block until a new frame arrives instead of returning the same
+        frame again
+        """
+        backend = get_backend(self.source)
+        if backend is not None:
+            return backend.open_stream(self)
+
+        if config.CAMERA_INGEST:
+            segment_directory = None
+            if config.RECORDING_MODE == "copy":
+                segment_directory = f"{config.SEGMENT_DIRECTORY}/{self.name}"
+            return StreamIngest(
+                self.source,
+                hls_directory=f"{config.STREAM_DIRECTORY}/{self.name}",
+                segment_directory=segment_directory,
+                low_latency=self.low_latency,
+                hls_segment_duration=self.hls_segment_duration,
+                frame_size=self.frame_size,
+            ).start()
+
+        # Frames are queued by VideoGear
+        options = {
+            "THREADED_QUEUE_MODE": True,
+            "THREAD_TIMEOUT": config.CAMERA_READ_TIMEOUT,
+        }
+        return VideoGear(
+            source=self.source, logging=True, time_delay=2, **options
+        ).start()
+
     def _reconnect(self) -> None:
         """
         Reconnects to a camera if it gets disconnected for whatever reason
@@ -194,28 +388,47 @@ class CameraSource:
             self._reconnect_attempts += 1
             time.sleep(2)
 
-            if self._camera:
-                self._camera.stop()
+            self._release_camera()
 
             if CameraSource.check_source_alive(self.source):
                 try:
                     print(f"{self.name} alive. Attempting reconnection")
-                    options = {"THREADED_QUEUE_MODE": False}
-                    camera = VideoGear(
-                        source=self.source, logging=True, time_delay=2, **options
-                    ).start()
+                    camera = self._open_stream()
                     self._connected = True
                     self._camera = camera
                     self._reconnect_attempts = 0
+                    metrics.CAMERA_CONNECTS.labels(self.name, "success").inc()
                     print(f"Reconnection to {self.name} successful")
                     return
                 except RuntimeError:
                     pass
             else:
                 print(f"{self.name} is not alive.")
+            metrics.CAMERA_CONNECTS.labels(self.name, "failure").inc()
 
         raise RuntimeError("ERROR: Could not reconnect to camera")
 
+    def _get_connected_metric(self) -> Dict[Tuple[str, ...], float]:
+        """
+        Reports whether the camera is connected while it is in use
+        """
+        if not self._camera_open and not self._connected:
+            return {}
+        return {(self.name,): float(self._connected)}
+
+    def _get_ffmpeg_metrics(self) -> Dict[Tuple[str, ...], float]:
+        """
+        Reports whether the ingest process of the camera is running. Cameras
+        read through VideoGear or a stream backend have no ingest process
+        """
+        if not self._camera_open or get_backend(self.source) is not None:
+            return {}
+        if not config.CAMERA_INGEST:
+            return {}
+        camera = self._camera
+        is_running = isinstance(camera, StreamIngest) and camera.is_running
+        return {(self.name, "ingest"): float(is_running)}
+
     def __str__(self) -> str:
         return f"Camera({self.name}, {self.source})"
 
@@ -229,12 +442,25 @@ class VideoSource:
     Mostly used for testing purposes and is not really part of OpenSec
     """
 
-    def __init__(self, video_path: str):
+    def __init__(
+        self,
+        video_path: str,
+        frame_size: Tuple[int, int] | None = None,
+        realtime: bool = True,
+    ):
+        """
+        Frames are resized to `frame_size` as they are decoded, if it is given.
+        If `realtime` is False frames are released as fast as they are decoded
+        instead of at the rate of a live camera
+        """
         self.name = video_path.split("/")[-1]
-        self._vid_cap = VideoGear(source=video_path)
+        self.frame_size = frame_size
+        self.realtime = realtime
+        # The timeout lets the reading thread notice when the source is stopped
+        self._vid_cap = VideoGear(source=video_path, THREAD_TIMEOUT=1)
         self._vid_cap_thread: Thread | None = None
         self._vid_cap_open = False
-        self._current_frame: np.ndarray | None = None
+        self.frames = FrameBuffer()
 
     @property
     def is_active(self) -> bool:
@@ -246,18 +472,21 @@ class VideoSource:
         else:
             self._vid_cap.start()
             self._vid_cap_open = True
-            self._vid_cap_thread = Thread(target=self._update_frame)
+            self._vid_cap_thread = Thread(target=self._update_frame, daemon=True)
             self._vid_cap_thread.start()
         return self
 
     def read(self, resize_frame: Optional[Tuple[int, int]] = None) -> np.ndarray | None:
-        if resize_frame and self._current_frame is not None:
-            return cv.resize(
-                self._current_frame,
-                resize_frame,
-                cv.INTER_NEAREST,
-            )
-        return self._current_frame
+        packet = self.frames.latest()
+        if packet is None:
+            return None
+        return packet.resized(resize_frame)
+
+    def read_packet(self) -> FramePacket | None:
+        return self.frames.latest()
+
+    def cursor(self, name: str) -> FrameCursor:
+        return self.frames.cursor(name)
 
     def stop(self) -> None:
 
@@ -269,14 +498,34 @@ class VideoSource:
 
     def _update_frame(self) -> None:
 
+        # Frames are released at a fixed rate to mimic a live camera.
+        # Sleeping until the next deadline stops decode time from adding up
+        frame_interval = 1 / config.FPS
+        next_frame_time = time.monotonic()
         while self.is_active:
             # Read a frame from the camera
-            frame = self._vid_cap.read()
+            try:
+                frame = self._vid_cap.read()
+            except queue.Empty:
+                continue
 
             if frame is None:
-                self._current_frame = None
+                # End of the video
+                self._vid_cap_open = False
+                self.frames.clear()
                 break
 
-            # Update frame
-            self._current_frame = frame
-            time.sleep(1 / config.FPS)
+            delay = next_frame_time - time.monotonic()
+            if delay > 0 and self.realtime:
+                time.sleep(delay)
+            else:
+                # Running behind, don't try to catch up
+                next_frame_time = time.monotonic()
+
+            if self.frame_size is not None:
+                frame = cv.resize(frame, self.frame_size)
+
+            # Update frame and wake up consumers waiting for it
+            self.frames.put(frame)
+            metrics.FRAMES_CAPTURED.labels(self.name).inc()
+            next_frame_time += frame_interval
@@ -1,12 +1,15 @@
 from __future__ import annotations
 
-from threading import Thread
+from functools import partial
+from threading import RLock, Thread
 
+import config
 import cv2 as cv
 
 from .camera import CameraSource
 from .detection import DetectionSource, IntruderDetector
 from .live_feed import LiveFeed
+from .supervisor import ConnectionSupervisor
 
 
 class CameraManager:
@@ -20,6 +23,10 @@ class CameraManager:
         self.camera_model = None
         self.intruder_model = None
         self.django_settings = None
+        self.supervisor = ConnectionSupervisor()
+
+        # Cameras are brought online from the supervisor's threads
+        self._lock = RLock()
 
     def setup_and_update_cameras(self):
         self.update_camera_list()
@@ -32,81 +39,174 @@ class CameraManager:
         """
         Creates live feeds based on camera in the database
         """
-        for camera_pk in self.cameras:
-            camera, source, _ = self.cameras[camera_pk]
-            if source is not None:
-                feed = LiveFeed(source)
-                stream_link = feed.start()
-                self.cameras[camera_pk][2] = feed
-                print(f"SETTING STREAM LINK TO {stream_link}")
-                camera.stream_link = stream_link
-                camera.save()
+        with self._lock:
+            for camera_pk in self.cameras:
+                self._start_live_feed(camera_pk)
+
+    def _start_live_feed(self, camera_pk):
+        """
+        Starts the live feed of a connected camera if it is not already streaming
+        """
+        camera, source, feed = self.cameras[camera_pk]
+        if source is None or (feed is not None and feed.is_streaming()):
+            return
+
+        if feed is None:
+            feed = LiveFeed(source)
+            self.cameras[camera_pk][2] = feed
+        else:
+            feed.stop()
+        stream_link = feed.start()
+        print(f"SETTING STREAM LINK TO {stream_link}")
+        camera.stream_link = stream_link
+        camera.save()
 
     def start_detection(self):
         """
-        Starts detecting intruders
-        """
-        if self.detector is not None:
-            self.detector.stop_detection()
-        self.detector = IntruderDetector(
-            [camera[1] for camera in self.cameras.values() if camera[1] is not None],
-            f"{self.django_settings.MEDIA_ROOT}/intruders",
-            self.camera_model,
-            self.intruder_model,
-            num_frames_to_record=100,
-            display_frame=False,
-        )
-        Thread(target=self.detector.detect, args=(10,)).start()
+        Starts detecting intruders if it is not running already.
+        Cameras that are added or removed later on are handed to the running
+        detector, so the other cameras are never interrupted
+        """
+        with self._lock:
+            if self.detector is not None:
+                return
+            self.detector = IntruderDetector(
+                [
+                    camera[1]
+                    for camera in self.cameras.values()
+                    if camera[1] is not None
+                ],
+                f"{self.django_settings.MEDIA_ROOT}/intruders",
+                self.camera_model,
+                self.intruder_model,
+                num_frames_to_record=100,
+                display_frame=False,
+                stop_when_inactive=False,
+            )
+            Thread(target=self.detector.detect, args=(10,)).start()
 
     def update_camera_list(self):
         """
         Updates the camera sources used by OpenSec to match the ones in the database
         """
         new_camera_list = list(self.camera_model.objects.all())
-        for camera in new_camera_list:
-            if camera.pk not in self.cameras:
-                self.cameras[camera.pk] = [camera, None, None]
+        with self._lock:
+            for camera in new_camera_list:
+                if camera.pk not in self.cameras:
+                    self.cameras[camera.pk] = [camera, None, None]
 
-                # Initially the cameras will be inactive
-                camera.is_active = False
-                camera.save()
+                    # Initially the cameras will be inactive
+                    camera.is_active = False
+                    camera.save()
 
-        for _, (cam, source, feed) in self.cameras.items():
-            if cam not in new_camera_list:
-                source.stop()
-                feed.stop()
+            for camera_pk, (cam, source, feed) in list(self.cameras.items()):
+                if cam not in new_camera_list:
+                    self.supervisor.unwatch(camera_pk)
+                    self.cameras.pop(camera_pk)
+                    if source is not None:
+                        if self.detector is not None:
+                            self.detector.remove_source(source)
+                        source.stop()
+                    if feed is not None:
+                        feed.stop()
 
     def connect_to_sources(self):
         """
-        Initialize camera sources and connect to them using the names and rtsp links
-        present in the database.
+        Initialize camera sources using the names and rtsp links present in the
+        database and connect to them in the background.
+        Each camera is started as soon as it answers, see `_on_camera_connected`
         """
-        for camera_pk in self.cameras:
-            camera, old_source, _ = self.cameras[camera_pk]
-            if not camera.is_active or old_source is None:
+        with self._lock:
+            for camera_pk in self.cameras:
+                camera, old_source, _ = self.cameras[camera_pk]
+                if old_source is not None or self.supervisor.is_watching(camera_pk):
+                    continue
                 try:
                     camera_source = CameraSource(
-                        camera.name, camera.rtsp_url, max_reset_attempts=3
+                        camera.name,
+                        camera.rtsp_url,
+                        connect=False,
+                        low_latency=camera.low_latency,
+                        hls_segment_duration=camera.segment_duration,
                     )
-                    source = DetectionSource(camera.name, camera_source)
-                    source.start()
-                    self.cameras[camera_pk][1] = source
-                    camera.is_active = True
-                    camera.save()
-                except RuntimeError:
-                    print(f"Could not connect to camera {camera.name}")
                 except ValueError:
                     print("Source must be a valid RTSP URL")
+                    continue
+
+                self._watch(camera_pk, camera_source)
+
+    def _watch(self, camera_pk, camera_source: CameraSource):
+        """
+        Lets the supervisor connect to a camera and keep it connected
+        """
+        self.supervisor.watch(
+            camera_pk,
+            camera_source,
+            partial(self._on_camera_connected, camera_pk),
+            partial(self._on_camera_disconnected, camera_pk),
+        )
+
+    @staticmethod
+    def _get_min_motion_area(camera) -> int:
+        """
+        Returns the minimum motion area of a camera, cameras without one use
+        the default of the config
+        """
+        if camera.min_motion_area is None:
+            return config.MIN_MOTION_AREA
+        return camera.min_motion_area
+
+    def _on_camera_connected(self, camera_pk, camera_source: CameraSource):
+        """
+        Called by the supervisor whenever a camera (re)connects
+        """
+        with self._lock:
+            if camera_pk not in self.cameras:
+                camera_source.stop()
+                return
+
+            camera, source, _ = self.cameras[camera_pk]
+            is_new_source = source is None
+            if is_new_source:
+                source = DetectionSource(
+                    camera.name,
+                    camera_source,
+                    min_motion_area=self._get_min_motion_area(camera),
+                )
+                source.set_zones(camera.detection_zones)
+                self.cameras[camera_pk][1] = source
+            source.start()
+
+            camera.is_active = True
+            camera.save()
+            self._start_live_feed(camera_pk)
+
+            if self.detector is None:
+                self.start_detection()
+            elif is_new_source:
+                self.detector.add_source(source)
+
+    def _on_camera_disconnected(self, camera_pk, camera_source: CameraSource):
+        """
+        Called by the supervisor when a camera stops sending frames
+        """
+        with self._lock:
+            if camera_pk in self.cameras:
+                camera = self.cameras[camera_pk][0]
+                camera.is_active = False
+                camera.save()
 
     def update_snapshots(self):
         """
         Take a screenshot of the live feed of the camera sources and save it to disk
         """
-        for camera_pk in self.cameras:
-            camera, source = self.cameras[camera_pk][:2]
+        with self._lock:
+            cameras = [camera[:2] for camera in self.cameras.values()]
+
+        for camera, source in cameras:
             if source is None:
                 continue
-            frame = source.read()
+            frame = source.source.read()
             if frame is not None:
                 snapshot_path = (
                     f"{self.django_settings.MEDIA_ROOT}/camera_snaps/{source.name}.jpg"
@@ -119,40 +219,117 @@ class CameraManager:
         """
         This function is called when a camera is added or edited in the database
         """
-        old_camera = self.cameras[camera_instance.pk]
+        with self._lock:
+            if camera_instance.pk not in self.cameras:
+                return
+            old_camera = self.cameras[camera_instance.pk]
+            old_instance, source, feed = old_camera
+            # Keep the latest version of the camera from the database
+            old_camera[0] = camera_instance
 
-        old_rtsp_link = old_camera[0].rtsp_url
-        if old_rtsp_link != camera_instance.rtsp_url:
-            print("SOURCE URL CHANGED")
-            old_source, old_feed = old_camera[1:]
+            live_view_changed = (
+                old_instance.live_view_mode != camera_instance.live_view_mode
+                or old_instance.segment_duration != camera_instance.segment_duration
+            )
+            reconnect = (
+                old_instance.rtsp_url != camera_instance.rtsp_url or live_view_changed
+            )
+            if reconnect:
+                # The live feed is written by the connection to the camera
+                print("SOURCE URL CHANGED")
+                self.supervisor.unwatch(camera_instance.pk)
 
-            if old_source is not None:
-                old_source.stop()
-                old_feed.stop()
+                if source is not None:
+                    if self.detector is not None:
+                        self.detector.remove_source(source, save_recording=True)
+                    source.stop()
+                if feed is not None:
+                    feed.stop()
 
-            self.cameras.pop(old_camera[0].pk)
-            self.cameras[camera_instance.pk] = [camera_instance, None, None]
+                self.cameras[camera_instance.pk] = [camera_instance, None, None]
+                # The new source is added to the detector once it connects
+                self.connect_to_sources()
 
-            self.connect_to_sources()
-            self.update_live_feeds()
-            self.start_detection()
+            elif old_instance.name != camera_instance.name:
+                print("CAMERA RENAMED")
+                if source is not None:
+                    on_renamed = partial(self._on_source_renamed, camera_instance.pk)
+                    if self.detector is not None:
+                        self.detector.rename_source(
+                            source, camera_instance.name, on_renamed
+                        )
+                    else:
+                        source.rename(camera_instance.name)
+                        on_renamed()
+                elif self.supervisor.is_watching(camera_instance.pk):
+                    # The camera hasn't connected yet, connect under the new name
+                    self.supervisor.unwatch(camera_instance.pk)
+                    self.connect_to_sources()
 
-        old_source_name = old_camera[0].name
-        if old_source_name != camera_instance.name:
-            old_source = old_camera[0]
-            if old_source is not None:
-                old_source.name = camera_instance.name
+            zones = camera_instance.detection_zones
+            if (
+                not reconnect
+                and source is not None
+                and old_instance.detection_zones != zones
+            ):
+                # A new source gets its zones when it connects
+                print("DETECTION ZONES CHANGED")
+                if self.detector is not None:
+                    self.detector.set_zones(source, zones)
+                else:
+                    source.set_zones(zones)
+
+            min_area = self._get_min_motion_area(camera_instance)
+            if (
+                not reconnect
+                and source is not None
+                and self._get_min_motion_area(old_instance) != min_area
+            ):
+                print("MINIMUM MOTION AREA CHANGED")
+                if self.detector is not None:
+                    self.detector.set_min_motion_area(source, min_area)
+                else:
+                    source.min_motion_area = min_area
+
+    def _on_source_renamed(self, camera_pk):
+        """
+        Moves the live feed of a renamed camera, since the stream directory is
+        named after the camera. Called once the source has been renamed, which
+        may happen on the detection thread
+        """
+        with self._lock:
+            if camera_pk not in self.cameras:
+                return
+            _, source, feed = self.cameras[camera_pk]
+            if feed is not None:
+                feed.stop()
+                self.cameras[camera_pk][2] = None
+
+            camera_source = source.source
+            if camera_source.hls_directory is not None:
+                # The connection of the camera writes the live feed, reconnect
+                # so that it writes it under the new name. The live feed is
+                # restarted once the camera is back
+                self.supervisor.unwatch(camera_pk)
+                camera_source.stop()
+                self._watch(camera_pk, camera_source)
+            elif source.is_active:
+                self._start_live_feed(camera_pk)
+            # Otherwise the live feed is started once the camera reconnects
 
     def remove_source(self, camera_instance):
         """
         This function is called when a camera is removed from the database
         """
-        old_camera = self.cameras[camera_instance.pk]
-        _, source, feed = old_camera
+        with self._lock:
+            if camera_instance.pk not in self.cameras:
+                return
+            self.supervisor.unwatch(camera_instance.pk)
+            _, source, feed = self.cameras.pop(camera_instance.pk)
 
-        if source is not None:
-            source.stop()
-            feed.stop()
-
-        self.cameras.pop(camera_instance.pk)
-        self.start_detection()
+            if source is not None:
+                if self.detector is not None:
+                    self.detector.remove_source(source)
+                source.stop()
+            if feed is not None:
+                feed.stop()
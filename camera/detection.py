@@ -1,215 +1,104 @@
 from __future__ import annotations
 
 import os
+import queue
 import time
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from functools import partial
+from threading import Event
+from typing import Callable, Dict, List, Optional, Tuple
 
 import config
 import cv2 as cv
 import numpy as np
-from vidgear.gears import WriteGear
 
-from . import CameraSource, VideoSource
+from . import CameraSource, VideoSource, metrics
+from .analysis import AnalysisWorkerPool, Box, IntruderAnalyzer
+from .detection_pool import (
+    DetectionProcessPool,
+    MotionResult,
+    default_num_processes,
+    default_num_threads,
+)
+from .frame_buffer import FrameBuffer, FramePacket, PreRollBuffer
+from .motion import NOISE_KERNEL, BatchedMotionEngine, MotionBlobs, find_blobs
+from .recorder import IntruderRecorder
+from .scheduler import DetectionScheduler
+from .tracing import TRACER
+from .zones import DetectionZones
 
-NOISE_KERNEL = cv.getStructuringElement(cv.MORPH_ELLIPSE, (3, 3))
 
-
-class IntruderRecorder:
+class DetectionSource:
     """
-    This class is used to record videos of detected intruders
+    Similar to CameraSource or VideoSource, but with additional functionality to
+    be able to detect intruders
     """
 
-    num_frames_to_analyze = 50
-
     def __init__(
         self,
-        detection_sources: List[DetectionSource],
-        recording_directory: str,
-        max_stored_frames: int = 80,
+        name: str,
+        source: CameraSource | VideoSource,
+        motion_frame_size: Optional[Tuple[int, int]] = config.MOTION_FRAME_SIZE,
+        grayscale_motion: bool = config.MOTION_GRAYSCALE,
+        parallel_motion: bool = config.MOTION_PARALLEL,
+        min_motion_area: int = config.MIN_MOTION_AREA,
     ):
-        self.sources = detection_sources
-        self.recordings_directory = recording_directory
-        self.max_stored_frames = max_stored_frames
-
-        self._video_writers: Dict[str, WriteGear] = {}
-        self._start_times: Dict[str, str] = {}
-        self._stored_frames: Dict[str, List[np.ndarray]] = {}
-        self._intruder_labels: Dict[str, List[str]] = {}
-        self._analyzer = IntruderAnalyzer()
-        self._is_analyzing = False
-        self._setup()
-
-    def get_labels(self) -> Dict[str, List[str]] | None:
-        if self._is_analyzing:
-            return None
-        return self._intruder_labels
-
-    def get_num_frames_recorded(self, source: DetectionSource) -> int:
-        return len(self._stored_frames[source.name])
-
-    def add_frame(self, frame: np.ndarray | None, source: DetectionSource) -> None:
-        """
-        Adds a frame to be written to a video file
-        """
-        if self._start_times[source.name] is None:
-            current_date_time = datetime.now().strftime("%Y_%m_%d %Hh %Mm %Ss")
-            self._start_times[source.name] = current_date_time
-
-        if frame is not None:
-            stored_frames = self._stored_frames[source.name]
-            if len(stored_frames) < self.max_stored_frames:
-                stored_frames.append(frame)
-
-            writer = self._video_writers[source.name]
-            writer.write(frame)
-
-    def save(self, source: DetectionSource, thumb: bool = True) -> List[str]:
         """
-        Stops adding frames to video and writes it to the disk.
-        If `thumb` is True then a thumbnail is also produced from the recorded frames
-        Returns paths to the thumbnail and video
+        Motion is detected on frames scaled down to `motion_frame_size`, in
+        grayscale if `grayscale_motion` is set. `parallel_motion` lets the
+        background subtractor use several OpenCV threads per frame.
+        Moving areas smaller than `min_motion_area` pixels of a FRAME_SIZE
+        frame are ignored
         """
-        writer = self._video_writers[source.name]
-        writer.close()
-        video_path = self._rename_video(source)
-        if source.is_active:
-            print("Creating video writer")
-            output_params = {"-input_framerate": config.FPS}
-            self._video_writers[source.name] = WriteGear(
-                f"{self.recordings_directory}/videos/{source.name}/intruder.mp4",
-                **output_params,
-            )
-
-        paths = [video_path]
-        if thumb:
-            print("Creating thumbnail")
-            thumb_path = self._save_thumb(source)
-            paths.append(thumb_path)
-
-        frames_to_analyze = self._stored_frames[source.name][
-            : self.num_frames_to_analyze
-        ]
-        self._analyze_intruders(source, frames_to_analyze)
-        self._start_times[source.name] = None
-        self._stored_frames[source.name] = []
-        return paths
-
-    def _rename_video(self, source: DetectionSource) -> str:
-        """
-        Renames a video from the default `intruder.mp4` to a name containing
-        the time the intruder was detected.
-        Returns the new name of the video
-        """
-
-        videos_directory = f"{self.recordings_directory}/videos"
-        base_name = f"{videos_directory}/{source.name}"
-        old_file_path = f"{base_name}/intruder.mp4"
-        new_file_path = f"{base_name}/{self._start_times[source.name]}.mp4"
-
-        rename_tries = 0
-        while not os.path.exists(old_file_path):
-            if rename_tries == 3:
-                return None
-            time.sleep(2)
-            rename_tries += 1
-        os.rename(old_file_path, new_file_path)
-        return new_file_path
-
-    def _save_thumb(self, source: DetectionSource) -> str | None:
-        """
-        Creates a thumbnail from the recorded frames and saves it to disk
-        """
-
-        thumbnails_directory = f"{self.recordings_directory}/thumbnails"
-        base_dir = f"{thumbnails_directory}/{source.name}"
-        thumb_name = self._start_times[source.name]
-        thumb_path = f"{base_dir}/{thumb_name}.jpg"
-        stored_frames = self._stored_frames[source.name]
-        if stored_frames is not None and len(stored_frames) != 0:
-            thumb_frame = stored_frames[len(stored_frames) // 2]
-            if thumb_frame is not None:
-                cv.imwrite(thumb_path, thumb_frame)
-                return thumb_path
-        return None
+        self.name = name
+        self.source = source
+        self.conseq_motion_frames = 0
+        # Fraction of the last frame that was part of the foreground
+        self.motion_energy = 0.0
+        # Bounding boxes of the moving objects in the last frame
+        self.motion_boxes: List[Box] = []
+        # Frames from before motion was confirmed, added to the start of recordings
+        self.pre_roll = PreRollBuffer()
+        self.frame_cursor = source.cursor(name)
+        self.motion_frame_size = motion_frame_size
+        self.grayscale_motion = grayscale_motion
+        self.min_motion_area = min_motion_area
+        # Replaces the background subtractor of the source if it is set
+        self.motion_engine: BatchedMotionEngine | None = None
+        # Areas of the frame in which motion is looked for
+        self.zones = DetectionZones()
+
+        # Last frame returned by read_new, whose derived views can be reused
+        self._last_read: Tuple[np.ndarray, FramePacket] | None = None
+        # Size of the frames read over size of the frames motion is detected on
+        self._motion_scale = (1.0, 1.0)
+        self._bg_subtractor = cv.bgsegm.createBackgroundSubtractorCNT(
+            minPixelStability=config.FPS // 2,
+            maxPixelStability=(config.FPS // 2) * 4,
+            isParallel=parallel_motion,
+        )
 
-    def _setup(self) -> None:
+    @property
+    def frames(self) -> FrameBuffer:
         """
-        Sets up the video writers and creates directories for each
-        source to store recorded videos
+        Returns the frame buffer of the underlying source
         """
+        return self.source.frames
 
-        self._make_paths()
-        self._make_video_writers()
-        for source in self.sources:
-            self._start_times[source.name] = None
-            self._stored_frames[source.name] = []
-
-    def _make_video_writers(self) -> None:
+    def set_zones(self, zones: List[dict] | None) -> None:
         """
-        Used by _setup() to create video writers
+        Sets the include and exclude zones of the source, see DetectionZones.
+        Raises a ValueError if the zones are malformed
         """
-        for source in self.sources:
-            output_params = {"-input_framerate": config.FPS}
-            self._video_writers[source.name] = WriteGear(
-                f"{self.recordings_directory}/videos/{source.name}/intruder.mp4",
-                **output_params,
-            )
+        if zones != self.zones.data:
+            self.zones = DetectionZones(zones)
 
-    def _make_paths(self) -> None:
+    def rename(self, name: str) -> None:
         """
-        Used by _setup() to make directories to store videos
+        Renames the detection source and the source it reads from
         """
-        if not os.path.exists(self.recordings_directory):
-            os.mkdir(self.recordings_directory)
-
-        directories = [
-            f"{self.recordings_directory}/videos",
-            f"{self.recordings_directory}/thumbnails",
-        ]
-        for directory in directories:
-            if not os.path.exists(directory):
-                os.mkdir(directory)
-
-            for source in self.sources:
-                if source is not None and not os.path.exists(
-                    f"{directory}/{source.name}"
-                ):
-                    os.mkdir(f"{directory}/{source.name}")
-
-    def _analyze_intruders(self, source: DetectionSource, frames: List[np.ndarray]):
-        """
-        Uses the IntruderAnalyzer class to get predictions on what the type of
-        the intruder is
-        """
-        self._is_analyzing = True
-        predictions: List[str] = []
-        for frame in frames:
-            if frame is not None:
-                frame_labels = self._analyzer.analyze_frame(frame)
-                if frame_labels is not None:
-                    predictions.extend(frame_labels)
-
-        self._intruder_labels[source.name] = predictions
-        self._is_analyzing = False
-
-
-class DetectionSource:
-    """
-    Similar to CameraSource or VideoSource, but with additional functionality to
-    be able to detect intruders
-    """
-
-    def __init__(self, name: str, source: CameraSource | VideoSource):
         self.name = name
-        self.source = source
-        self.conseq_motion_frames = 0
-
-        self._bg_subtractor = cv.bgsegm.createBackgroundSubtractorCNT(
-            minPixelStability=config.FPS // 2,
-            maxPixelStability=(config.FPS // 2) * 4,
-            isParallel=False,
-        )
+        self.source.name = name
+        self.frame_cursor.name = name
 
     def get_rtsp_link(self):
         """
@@ -236,6 +125,7 @@ class DetectionSource:
         """
         if self.is_active:
             self.conseq_motion_frames = 0
+            self.pre_roll.clear()
             self.source.stop()
 
     def read(self, resize_frame: Optional[Tuple[int, int]] = None) -> np.ndarray | None:
@@ -248,74 +138,129 @@ class DetectionSource:
 
         return frame
 
+    def read_new(
+        self, resize_frame: Optional[Tuple[int, int]] = None
+    ) -> np.ndarray | None:
+        """
+        Returns the newest frame that has not been read through this detection
+        source yet, or None if the source has not produced a new frame.
+        Frames that are skipped over are counted in `frame_cursor.frames_dropped`
+        """
+        frames_dropped = self.frame_cursor.frames_dropped
+        packet = self.frame_cursor.read_latest()
+        if packet is None:
+            return None
+        if self.frame_cursor.frames_dropped > frames_dropped:
+            metrics.FRAMES_DROPPED.labels(self.name).inc(
+                self.frame_cursor.frames_dropped - frames_dropped
+            )
+        frame_age = time.time() - packet.timestamp
+        metrics.FRAME_AGE.observe(frame_age)
+        if frame_age > config.STALE_FRAME_SECONDS:
+            metrics.FRAMES_STALE.labels(self.name).inc()
+        frame = packet.resized(resize_frame)
+        self._last_read = (frame, packet)
+        return frame
+
+    def get_motion_frame(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Returns the frame motion is detected on: scaled down to
+        `motion_frame_size` and converted to grayscale if enabled.
+        If `frame` was returned by `read_new`, views of it that other consumers
+        already computed are reused
+        """
+        if self._last_read is None or self._last_read[0] is not frame:
+            # Keep the views of frames that were not read through read_new
+            # in case they are asked for again
+            self._last_read = (frame, FramePacket(0, 0.0, frame, {}))
+        packet = self._last_read[1]
+
+        size = self.motion_frame_size
+        if size is not None and frame.shape[1] <= size[0]:
+            # Never scale frames up
+            size = None
+        if self.grayscale_motion or self.motion_engine is not None:
+            return packet.gray(size)
+        return packet.resized(size)
+
     def get_foreground_mask(self, frame: np.ndarray) -> np.ndarray:
         """
         Uses a background subtractor to generate a foreground mask that can
-        be used to detect motion
+        be used to detect motion. The mask has the size of the motion frame
         """
 
-        foreground_mask = self._bg_subtractor.apply(frame)
+        motion_frame = self.get_motion_frame(frame)
+        self._motion_scale = (
+            frame.shape[1] / motion_frame.shape[1],
+            frame.shape[0] / motion_frame.shape[0],
+        )
+        if self.motion_engine is not None:
+            # The engine drops the motion outside of the zones itself
+            return self.motion_engine.get_foreground_mask(
+                self.name, motion_frame, self.zones
+            )
+
+        foreground_mask = self._bg_subtractor.apply(motion_frame)
 
         denoised_foreground_mask = cv.morphologyEx(
             foreground_mask, cv.MORPH_OPEN, NOISE_KERNEL
         )
-        return cv.dilate(denoised_foreground_mask, None, iterations=3)
+        # Grow the mask by about as much as 3 iterations at full size
+        iterations = max(1, round(3 / self._motion_scale[0]))
+        foreground_mask = cv.dilate(
+            denoised_foreground_mask, None, iterations=iterations
+        )
+        # Motion outside of the detection zones is ignored
+        return self.zones.apply(foreground_mask)
 
-    def find_contours(
-        self, foreground_mask: np.ndarray, display_frame: Optional[np.ndarray] = None
-    ) -> List[np.ndarray]:
+    @staticmethod
+    def get_motion_boxes(blobs: MotionBlobs) -> List[Box]:
         """
-        Takes a foreground mask and finds contours, which are outlines of potential
-        moving objects. The presence of these contours can be used to detect whether
-        or not an intruder is present.
+        Returns the bounding boxes (x, y, width, height) of the moving objects
         """
 
-        detection_mode = cv.RETR_EXTERNAL
-        detection_method = cv.CHAIN_APPROX_SIMPLE
-
-        contours = cv.findContours(foreground_mask, detection_mode, detection_method)[0]
+        return blobs.box_list()
 
-        return self.filter_contours(contours, display_frame)
-
-    def filter_contours(
-        self, contours: List[np.ndarray], display_frame: Optional[np.ndarray] = None
-    ) -> List[np.ndarray]:
+    def update_motion_energy(self, foreground_mask: np.ndarray) -> float:
         """
-        Remove contours whose area is too small.
+        Measures how much of the frame is moving, which is used to pick the
+        frames of a recording that are worth classifying
         """
 
-        filtered_contours: List[np.ndarray] = []
-
-        # Loop through the contours if there are any
-        for contour in contours:
-            # Remove small instances of detected motion
-            # this will mostly be lighting changes
-            if cv.contourArea(contour) < 1000:
-                continue
+        self.motion_energy = cv.countNonZero(foreground_mask) / foreground_mask.size
+        return self.motion_energy
 
-            filtered_contours.append(contour)
+    def find_blobs(self, foreground_mask: np.ndarray) -> MotionBlobs:
+        """
+        Takes a foreground mask and finds the blobs of potential moving objects,
+        in the coordinates of the frames that were read. The presence of these
+        blobs can be used to detect whether or not an intruder is present.
+        Small blobs, which are mostly lighting changes, are left out
+        """
 
-            # Performance optimization when there is no need to display a frame
-            if display_frame is None:
-                break
+        if self.motion_engine is not None and not self.motion_engine.has_motion(
+            self.name
+        ):
+            # Too little motion for the batched backend to look for blobs
+            return MotionBlobs()
 
-            # DetectionSource._draw_bounding_boxes(display_frame, contour)
-        return filtered_contours
+        # The minimum area is given at FRAME_SIZE
+        min_area = self.min_motion_area / (
+            self._motion_scale[0] * self._motion_scale[1]
+        )
+        return find_blobs(foreground_mask, min_area).scaled(self._motion_scale)
 
     @staticmethod
-    def _draw_bounding_boxes(display_frame: np.ndarray, contour: np.ndarray) -> None:
-
-        # Get the bounding rectangle from the contour
-        x_coord, y_coord, width, height = cv.boundingRect(contour)
-
-        # Draw the bounding box
-        cv.rectangle(
-            display_frame,
-            (x_coord, y_coord),
-            (x_coord + width, y_coord + height),
-            (0, 255, 0),
-            1,
-        )
+    def _draw_bounding_boxes(display_frame: np.ndarray, blobs: MotionBlobs) -> None:
+
+        for x_coord, y_coord, width, height in blobs.box_list():
+            cv.rectangle(
+                display_frame,
+                (x_coord, y_coord),
+                (x_coord + width, y_coord + height),
+                (0, 255, 0),
+                1,
+            )
 
 
 class IntruderDetector:
@@ -331,14 +276,55 @@ class IntruderDetector:
         intruder_model,
         num_frames_to_record: int = 60,
         display_frame: bool = False,
+        num_processes: int = config.DETECTION_PROCESSES,
+        stop_when_inactive: bool = True,
+        num_analysis_workers: int = config.ANALYSIS_WORKERS,
+        num_motion_threads: int = config.MOTION_THREADS,
+        motion_backend: str = config.MOTION_BACKEND,
+        idle_fps: float = config.IDLE_DETECTION_FPS,
     ):
-        self.detection_sources = detection_sources
+        self.detection_sources = list(detection_sources)
         self.camera_model = camera_model
         self.intruder_model = intruder_model
         self._display_frame = display_frame
         self._max_frames_to_record = num_frames_to_record
 
+        if num_processes < 0:
+            num_processes = default_num_processes()
+        self._num_processes = num_processes
+        self._num_motion_threads = num_motion_threads
+        if motion_backend not in ("cnt", "batched"):
+            raise ValueError(f"ERROR: Unknown motion backend {motion_backend}")
+        if motion_backend == "batched" and num_processes > 0:
+            raise ValueError(
+                "ERROR: The batched motion backend can't run in detection processes"
+            )
+        # Cameras without motion are processed at a lower rate
+        self.scheduler = DetectionScheduler(idle_fps)
+        self._motion_engine: BatchedMotionEngine | None = None
+        if motion_backend == "batched":
+            self._motion_engine = BatchedMotionEngine()
+            for source in self.detection_sources:
+                source.motion_engine = self._motion_engine
+        self._process_pool: DetectionProcessPool | None = None
+        self._motion_results: queue.Queue[MotionResult] = queue.Queue()
+        # Frames sent to the process pool, each followed by the frames that
+        # were skipped after it
+        self._pending_frames: Dict[str, Dict[int, List[np.ndarray]]] = {}
+        # Recordings are classified in the background so that motion detection
+        # never waits for the object detector
+        self.analysis_pool = AnalysisWorkerPool(IntruderAnalyzer, num_analysis_workers)
+
+        # If False detection keeps running while every source is inactive
+        # so that sources can be added or reconnected later on
+        self._stop_when_inactive = stop_when_inactive
         self._detection_status = False
+        self._detecting = False
+        self._sources_to_save: List[DetectionSource] = []
+        self._new_frame_event = Event()
+        # Changes to the list of sources are applied by the detection thread
+        # in between frames
+        self._source_changes: queue.Queue[Callable[[], None]] = queue.Queue()
         self._recorder = IntruderRecorder(
             self.detection_sources, recording_directory, num_frames_to_record
         )
@@ -361,21 +347,191 @@ class IntruderDetector:
             return labels
         intruders: Dict[str, str] = {}
         for source, intruder_labels in labels.items():
-            if "cat" in intruder_labels or "dog" in intruder_labels:
-                intruders[source] = "animal"
-            if "person" in intruder_labels:
-                intruders[source] = "person"
+            label = self.get_intruder_label(intruder_labels)
+            if label is not None:
+                intruders[source] = label
 
         return intruders
 
+    @staticmethod
+    def get_intruder_label(labels: List[str]) -> str | None:
+        """
+        Picks the type of intruder from the labels predicted for a recording
+        """
+
+        if "person" in labels:
+            return "person"
+        if "cat" in labels or "dog" in labels:
+            return "animal"
+        return None
+
     def get_detection_status(self) -> bool:
 
+        if not self._detection_status:
+            return False
+        if not self._stop_when_inactive:
+            return True
+
         all_sources_inactive = all(
             not source.is_active for source in self.detection_sources
         )
-        if not self._detection_status or all_sources_inactive:
-            return False
-        return True
+        return not all_sources_inactive
+
+    def add_source(self, source: DetectionSource) -> None:
+        """
+        Starts detecting intruders on a new source.
+        The other sources keep running without interruption
+        """
+
+        self._change_sources(lambda: self._add_source(source))
+
+    def remove_source(
+        self, source: DetectionSource, save_recording: bool = False
+    ) -> None:
+        """
+        Stops detecting intruders on a source.
+        If `save_recording` is True an ongoing recording is saved first,
+        otherwise it is discarded
+        """
+
+        self._change_sources(lambda: self._remove_source(source, save_recording))
+
+    def rename_source(
+        self,
+        source: DetectionSource,
+        name: str,
+        on_renamed: Callable[[], None] | None = None,
+    ) -> None:
+        """
+        Renames a source. Its background model is kept but an ongoing
+        recording is discarded. While detection is running the source is
+        renamed by the detection thread, which calls `on_renamed` once it is
+        """
+
+        def rename() -> None:
+            self._rename_source(source, name)
+            if on_renamed is not None:
+                on_renamed()
+
+        self._change_sources(rename)
+
+    def set_zones(self, source: DetectionSource, zones: List[dict] | None) -> None:
+        """
+        Changes the detection zones of a source
+        """
+
+        self._change_sources(lambda: self._set_zones(source, zones))
+
+    def set_min_motion_area(self, source: DetectionSource, min_area: int) -> None:
+        """
+        Changes the smallest moving area that counts as motion for a source
+        """
+
+        self._change_sources(lambda: self._set_min_motion_area(source, min_area))
+
+    def _change_sources(self, change: Callable[[], None]) -> None:
+        """
+        Applies a change to the list of sources. While detection is running the
+        change is handed to the detection thread so the list is never modified
+        while it is being processed
+        """
+
+        if self._detection_status:
+            self._source_changes.put(change)
+            self._new_frame_event.set()
+        else:
+            change()
+
+    def _apply_source_changes(self) -> None:
+
+        while True:
+            try:
+                change = self._source_changes.get_nowait()
+            except queue.Empty:
+                return
+            change()
+
+    def _add_source(self, source: DetectionSource) -> None:
+
+        if source in self.detection_sources:
+            return
+
+        self.detection_sources.append(source)
+        self._recorder.add_source(source)
+        source.motion_engine = self._motion_engine
+        if self._detection_status:
+            source.start()
+            source.frames.subscribe(self._new_frame_event)
+        if self._process_pool is not None:
+            self._process_pool.add_source(
+                source.name, source.zones.data, source.min_motion_area
+            )
+            self._pending_frames[source.name] = {}
+
+    def _remove_source(self, source: DetectionSource, save_recording: bool) -> None:
+
+        if source not in self.detection_sources:
+            return
+
+        num_frames_recorded = self._recorder.get_num_frames_recorded(source)
+        if save_recording and num_frames_recorded >= self._max_frames_to_record // 4:
+            print(f"Saving recordings for source {source.name}")
+            # The recorder of the source is removed below, so it can't wait for
+            # the end of the iteration
+            self._save_all_recordings([source])
+
+        self.detection_sources.remove(source)
+        self._recorder.remove_source(source)
+        source.frames.unsubscribe(self._new_frame_event)
+        source.conseq_motion_frames = 0
+        source.pre_roll.clear()
+        self.scheduler.remove_source(source.name)
+        if self._motion_engine is not None:
+            self._motion_engine.remove_source(source.name)
+            source.motion_engine = None
+        if self._process_pool is not None:
+            self._process_pool.remove_source(source.name)
+            self._pending_frames.pop(source.name, None)
+        metrics.remove_camera(source.name)
+
+    def _rename_source(self, source: DetectionSource, name: str) -> None:
+
+        if source not in self.detection_sources:
+            metrics.remove_camera(source.name)
+            source.rename(name)
+            return
+
+        self._recorder.remove_source(source)
+        if self._process_pool is not None:
+            self._process_pool.remove_source(source.name)
+            self._pending_frames.pop(source.name, None)
+
+        old_name = source.name
+        self.scheduler.rename_source(old_name, name)
+        if self._motion_engine is not None:
+            self._motion_engine.rename_source(old_name, name)
+        source.rename(name)
+        metrics.remove_camera(old_name)
+        source.conseq_motion_frames = 0
+
+        self._recorder.add_source(source)
+        if self._process_pool is not None:
+            self._process_pool.add_source(
+                source.name, source.zones.data, source.min_motion_area
+            )
+            self._pending_frames[source.name] = {}
+
+    def _set_zones(self, source: DetectionSource, zones: List[dict] | None) -> None:
+
+        source.set_zones(zones)
+        if self._process_pool is not None and source in self.detection_sources:
+            self._process_pool.set_zones(source.name, source.zones.data)
+
+    def _set_min_motion_area(self, source: DetectionSource, min_area: int) -> None:
+
+        source.min_motion_area = min_area
+        if self._process_pool is not None and source in self.detection_sources:
+            self._process_pool.set_min_motion_area(source.name, min_area)
 
     def read_frame(
         self, source: DetectionSource, resize_frame: Tuple[int, int] = None
@@ -391,16 +547,59 @@ class IntruderDetector:
 
         return frame
 
+    def read_new_frame(
+        self, source: DetectionSource, resize_frame: Tuple[int, int] = None
+    ) -> np.ndarray | None:
+        """
+        Read a frame from a detection source, but only if it has not been processed yet
+        """
+
+        if not source.is_active:
+            return None
+
+        return source.read_new(resize_frame)
+
+    def get_memory_usage(self) -> Dict[str, int]:
+        """
+        Returns the number of bytes used by the frames of ongoing recordings
+        of each source
+        """
+
+        return self._recorder.get_memory_usage()
+
+    def get_frame_stats(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Returns the number of frames processed and dropped by the detector for
+        each source
+        """
+
+        return {
+            source.name: (
+                source.frame_cursor.frames_read,
+                source.frame_cursor.frames_dropped,
+            )
+            for source in self.detection_sources
+        }
+
+    def get_detection_rates(self) -> Dict[str, float]:
+        """
+        Returns the number of frames per second the detector currently
+        processes for each source
+        """
+
+        return self.scheduler.get_rates()
+
     def update_conseq_frames(
-        self, source: DetectionSource, contours: List[np.ndarray]
+        self, source: DetectionSource, blobs: MotionBlobs | List[Box]
     ) -> None:
 
-        if IntruderDetector.is_motion_frame(contours):
+        if IntruderDetector.is_motion_frame(blobs):
             source.conseq_motion_frames += 1
         else:
             if source.conseq_motion_frames > 0:
                 self._save_recordings(source)
             source.conseq_motion_frames = 0
+        self.scheduler.update_activity(source.name, source.conseq_motion_frames > 0)
 
     def detect(self, min_conseq_frames: int = 10) -> None:
         """
@@ -408,70 +607,253 @@ class IntruderDetector:
         """
 
         self._detection_status = True
+        self._detecting = True
 
-        frame_count = 0
         self.start_sources()
-        time.sleep(1)
-        while self.get_detection_status():
-
-            if frame_count % 2 == 1:
-                time.sleep(1 / config.FPS)
-                frame_count += 1
-                continue
-
-            for source in self.detection_sources:
-
-                frame = self.read_frame(source, resize_frame=(640, 360))
+        self._recorder.start()
+        for source in self.detection_sources:
+            source.frames.subscribe(self._new_frame_event)
+        if self._num_processes > 0:
+            self._start_process_pool()
+        elif self.get_num_motion_threads() > 0:
+            cv.setNumThreads(self.get_num_motion_threads())
 
-                if frame is None:
-                    continue
+        while self.get_detection_status():
 
-                self.detect_motion_in_frame(frame, source)
+            # Sleep until any of the sources has a new frame. The timeout makes
+            # sure the detection status is checked even if every source stalls
+            self._new_frame_event.wait(timeout=1)
+            self._new_frame_event.clear()
 
-                if self._display_frame:
-                    # Show the resized frame with bounding boxes around intruders (if any)
-                    cv.imshow(f"({source.name}) Motion Detection", frame)
+            with TRACER.tick():
+                self._process_new_frames(min_conseq_frames)
 
-                self.check_for_intruders(frame, source, min_conseq_frames)
-            frame_count += 1
-            if cv.waitKey(1000 // config.FPS) == ord("q"):
+            if self._display_frame and cv.waitKey(1) == ord("q"):
                 break
 
+        for source in self.detection_sources:
+            source.frames.unsubscribe(self._new_frame_event)
+        self._stop_process_pool()
+        self._apply_source_changes()
+
         if self._display_frame:
             # Close all windows
             cv.destroyAllWindows()
 
+        self._detecting = False
+        self._save_pending_recordings()
         self.stop_detection()
 
+    def _process_new_frames(self, min_conseq_frames: int) -> None:
+        """
+        Runs one iteration of the detection loop over the new frames of
+        every source
+        """
+
+        self._apply_source_changes()
+
+        if self._process_pool is not None:
+            with TRACER.span("process_motion_results"):
+                self._process_motion_results(min_conseq_frames)
+
+        new_frames: List[Tuple[DetectionSource, np.ndarray]] = []
+        for source in self.detection_sources:
+            with TRACER.span("read", source.name):
+                frame = self.read_new_frame(source, resize_frame=config.FRAME_SIZE)
+            if frame is None:
+                continue
+            if not self.scheduler.should_process(source.name):
+                self._keep_for_pre_roll(frame, source)
+                continue
+            self.scheduler.mark_processed(source.name)
+            metrics.FRAMES_PROCESSED.labels(source.name).inc()
+            new_frames.append((source, frame))
+
+        if self._motion_engine is not None:
+            # The background models of every camera are updated at once
+            with TRACER.span("motion_engine"):
+                self._motion_engine.process(
+                    {
+                        source.name: source.get_motion_frame(frame)
+                        for source, frame in new_frames
+                    },
+                    {source.name: source.zones for source, _ in new_frames},
+                )
+
+        for source, frame in new_frames:
+
+            if self._process_pool is not None:
+                # Motion detection happens in a worker process, the result
+                # is handled by _process_motion_results
+                with TRACER.span("submit_frame", source.name):
+                    self._submit_frame(frame, source)
+                continue
+
+            self.detect_motion_in_frame(frame, source)
+
+            if self._display_frame:
+                # Show the resized frame with bounding boxes around intruders (if any)
+                cv.imshow(f"({source.name}) Motion Detection", frame)
+
+            with TRACER.span("check_for_intruders", source.name):
+                self.check_for_intruders(frame, source, min_conseq_frames)
+
+        self._save_pending_recordings()
+
+    def _start_process_pool(self) -> None:
+        """
+        Starts the worker processes that run motion detection
+        """
+
+        self._process_pool = DetectionProcessPool(
+            self._num_processes,
+            self._on_motion_result,
+            num_threads=max(1, self.get_num_motion_threads()),
+        ).start()
+        for source in self.detection_sources:
+            self._process_pool.add_source(
+                source.name, source.zones.data, source.min_motion_area
+            )
+            self._pending_frames[source.name] = {}
+
+    def get_num_motion_threads(self) -> int:
+        """
+        Returns the number of OpenCV threads each process detecting motion
+        uses, 0 meaning OpenCV's default
+        """
+
+        if self._num_motion_threads < 0:
+            return default_num_threads(len(self.detection_sources), self._num_processes)
+        return self._num_motion_threads
+
+    def _stop_process_pool(self) -> None:
+
+        if self._process_pool is not None:
+            self._process_pool.stop()
+        self._process_pool = None
+        self._pending_frames = {}
+
+    def _submit_frame(self, frame: np.ndarray, source: DetectionSource) -> None:
+        """
+        Sends a frame to the process pool and keeps it until its result comes back
+        """
+
+        seq = self._process_pool.submit(source.name, frame)
+        if seq is not None:
+            self._pending_frames[source.name][seq] = [frame]
+
+    def _keep_for_pre_roll(self, frame: np.ndarray, source: DetectionSource) -> None:
+        """
+        Adds a frame that is not processed to the pre-roll, so that the pre-roll
+        of an idle camera has every frame and plays at the speed of the camera.
+        Most frames of an idle camera are skipped, so they are kept without
+        being encoded. Frames from the capture layer are never modified, and
+        are only encoded if a recording starts.
+        Frames that come after one that the process pool is still working on
+        are added once its result is in, which keeps the pre-roll in order
+        """
+
+        pending_frames = self._pending_frames.get(source.name)
+        if self._process_pool is not None and pending_frames:
+            pending_frames[next(reversed(pending_frames))].append(frame)
+        else:
+            source.pre_roll.push(
+                frame, source.motion_energy, source.motion_boxes, encode=False
+            )
+
+    def _on_motion_result(self, result: MotionResult) -> None:
+        """
+        Called from the process pool when a worker has processed a frame
+        """
+
+        self._motion_results.put(result)
+        self._new_frame_event.set()
+
+    def _process_motion_results(self, min_conseq_frames: int) -> None:
+        """
+        Updates the state of each source with the results of the worker processes
+        """
+
+        sources = {source.name: source for source in self.detection_sources}
+        while True:
+            try:
+                result = self._motion_results.get_nowait()
+            except queue.Empty:
+                return
+
+            source = sources.get(result.name)
+            pending_frames = self._pending_frames.get(result.name, {})
+            frames = pending_frames.pop(result.seq, None)
+            if source is None or frames is None:
+                continue
+            frame, *skipped_frames = frames
+
+            source.motion_energy = result.motion_energy
+            source.motion_boxes = result.boxes
+            self.update_conseq_frames(source, result.boxes)
+            if self._display_frame:
+                cv.imshow(f"({source.name}) Motion Detection", frame)
+            self.check_for_intruders(frame, source, min_conseq_frames)
+            for skipped_frame in skipped_frames:
+                source.pre_roll.push(
+                    skipped_frame,
+                    source.motion_energy,
+                    source.motion_boxes,
+                    encode=False,
+                )
+
     def detect_motion_in_frame(
         self, frame: np.ndarray, source: DetectionSource
     ) -> None:
 
-        foreground_mask = source.get_foreground_mask(frame)
+        start = time.perf_counter()
+        with TRACER.span("get_foreground_mask", source.name):
+            foreground_mask = source.get_foreground_mask(frame)
+            source.update_motion_energy(foreground_mask)
 
-        contours = source.find_contours(foreground_mask, display_frame=frame)
+        with TRACER.span("find_blobs", source.name):
+            blobs = source.find_blobs(foreground_mask)
+            source.motion_boxes = source.get_motion_boxes(blobs)
+        metrics.STAGE_SECONDS.labels("motion").observe(time.perf_counter() - start)
 
-        self.update_conseq_frames(source, contours)
+        self.update_conseq_frames(source, blobs)
 
     @staticmethod
-    def is_motion_frame(contours: List[np.ndarray]) -> bool:
+    def is_motion_frame(blobs: MotionBlobs | List[Box]) -> bool:
 
-        # If no contours have been found then this is not a motion frame
-        return contours is not None and len(contours) != 0
+        # If no blobs have been found then this is not a motion frame
+        return blobs is not None and len(blobs) != 0
 
     def check_for_intruders(
         self, frame: np.ndarray, source: DetectionSource, min_conseq_frames: int
     ) -> None:
 
+        start = time.perf_counter()
         if source.conseq_motion_frames >= min_conseq_frames:
-            print(f"motion detected at {source.name}")
+            if self._recorder.get_num_frames_recorded(source) == 0:
+                print(f"motion detected at {source.name}")
+                metrics.MOTION_EVENTS.labels(source.name).inc()
+                self._record_pre_roll(source)
             self.record_frame(frame, source)
+        else:
+            source.pre_roll.push(frame, source.motion_energy, source.motion_boxes)
+        metrics.STAGE_SECONDS.labels("record").observe(time.perf_counter() - start)
+
+    def _record_pre_roll(self, source: DetectionSource) -> None:
+        """
+        Adds the frames that came before motion was confirmed to a new recording
+        """
+
+        for frame, (motion_energy, motion_boxes) in source.pre_roll.drain():
+            self._recorder.add_frame(frame, source, motion_energy, motion_boxes)
 
     def record_frame(self, frame: np.ndarray, source: DetectionSource) -> None:
 
         num_frames_recorded = self._recorder.get_num_frames_recorded(source)
         if num_frames_recorded <= self._max_frames_to_record:
-            self._recorder.add_frame(frame, source)
+            self._recorder.add_frame(
+                frame, source, source.motion_energy, source.motion_boxes
+            )
         else:
             self._save_recordings(source)
 
@@ -479,6 +861,12 @@ class IntruderDetector:
 
         self._detection_status = False
 
+        if self._detecting:
+            # The detection thread saves the recordings once it leaves its loop,
+            # saving them from here would close writers it is still using
+            self._new_frame_event.set()
+            return
+
         for source in self.detection_sources:
 
             num_frames_recorded = self._recorder.get_num_frames_recorded(source)
@@ -486,98 +874,122 @@ class IntruderDetector:
                 print(f"Saving recordings for source {source.name}")
                 self._save_recordings(source)
 
+        # Wait for the recordings that are still being analyzed
+        self.analysis_pool.stop()
+        self._recorder.stop()
+
     def add_intruder(
-        self, source: DetectionSource, video_path: str, thumb_path: Optional[str] = None
+        self,
+        source: DetectionSource,
+        video_path: str,
+        thumb_path: Optional[str] = None,
+        labels: Optional[List[str]] = None,
     ):
         """
-        Adds an intruder to the database
+        Adds an intruder to the database.
+        `labels` are the objects detected in the recording, if they are not given
+        the latest labels of the recorder are used
         """
 
-        intruder_labels = self.get_intruder_labels()
-        label = intruder_labels.get(source.name, None)
+        if labels is None:
+            intruder_labels = self.get_intruder_labels()
+            label = intruder_labels.get(source.name, None)
+        else:
+            label = self.get_intruder_label(labels)
 
         # If no label is produced then don't add intruder to database
         if label is not None:
             print("Saving recording and adding intruder to database")
-            camera = self.camera_model.objects.get(name=source.name)
-            if thumb_path is not None:
-                self.intruder_model.objects.create(
-                    label=label,
-                    video=video_path,
-                    thumbnail=thumb_path,
-                    camera=camera,
-                )
-            else:
-                self.intruder_model.objects.create(
-                    label=label,
-                    video=video_path,
-                    camera=camera,
-                )
+            with TRACER.span("add_intruder", source.name):
+                camera = self.camera_model.objects.get(name=source.name)
+                if thumb_path is not None:
+                    self.intruder_model.objects.create(
+                        label=label,
+                        video=video_path,
+                        thumbnail=thumb_path,
+                        camera=camera,
+                    )
+                else:
+                    self.intruder_model.objects.create(
+                        label=label,
+                        video=video_path,
+                        camera=camera,
+                    )
 
     def _save_recordings(self, source: DetectionSource) -> None:
-        paths = self._recorder.save(source, thumb=True)
-        if len(paths) == 2:
-            self.add_intruder(source, video_path=paths[0], thumb_path=paths[1])
-        else:
-            self.add_intruder(source, video_path=paths[0])
-
-
-class IntruderAnalyzer:
-
-    ssd_classes = [
-        "background",
-        "aeroplane",
-        "bicycle",
-        "bird",
-        "boat",
-        "bottle",
-        "bus",
-        "car",
-        "cat",
-        "chair",
-        "cow",
-        "diningtable",
-        "dog",
-        "horse",
-        "motorbike",
-        "person",
-        "pottedplant",
-        "sheep",
-        "sofa",
-        "train",
-        "tvmonitor",
-    ]
-
-    def __init__(self):
-        # Path to SSD weights and configuration files
-        ssd_weights = "./ssd/MobileNetSSD_deploy.caffemodel"
-        ssd_config = "./ssd/MobileNetSSD_deploy.prototxt"
-
-        self.net = cv.dnn.readNetFromCaffe(ssd_config, ssd_weights)
-
-    def analyze_frame(self, frame: np.ndarray) -> List[str] | None:
-        """
-        Uses a deep learning object detector to analyze the frames of motion
-        Returns a list of predicted labels
-        """
-
-        # Convert the frame into an appropriate format for SSD
-        if frame is None:
-            return None
-        blob = cv.dnn.blobFromImage(frame, 0.007843, (300, 300), 127.5)
-        self.net.setInput(blob)
-        # Perform inference on the frame
-        detections = self.net.forward()
-
-        predicted_labels = []
-        for i in np.arange(0, detections.shape[2]):
-            # Get confidence score
-            confidence = detections[0, 0, i, 2]
-            if confidence > 0.25:
-                class_id = int(detections[0, 0, i, 1])
-                predicted_labels.append((self.ssd_classes[class_id], confidence))
-
-        if not predicted_labels:
-            return None
-        # Get labels only
-        return [label for label, _ in predicted_labels]
+        """
+        Saves the recording of a source. While the detection loop is running the
+        recording is saved at the end of the current iteration, so recordings of
+        events that end together are analyzed in one batch
+        """
+        if not self._detecting:
+            self._save_all_recordings([source])
+        elif source not in self._sources_to_save:
+            self._sources_to_save.append(source)
+
+    def _save_pending_recordings(self) -> None:
+        sources, self._sources_to_save = self._sources_to_save, []
+        if sources:
+            self._save_all_recordings(sources)
+
+    def _save_all_recordings(self, sources: List[DetectionSource]) -> None:
+        """
+        Saves the recordings of several sources and hands their frames to the
+        analysis pool. The intruders are added to the database once analyzed.
+        Sources whose motion ended before a recording was started are skipped
+        """
+        sources = [source for source in sources if self._recorder.is_recording(source)]
+        if not sources:
+            return
+        frames: Dict[str, List[np.ndarray]] = {}
+        regions: Dict[str, List[List[Box]]] = {}
+        for source in sources:
+            frames[source.name], regions[source.name] = (
+                self._recorder.get_frames_to_analyze(source)
+            )
+        names = ",".join(source.name for source in sources)
+        with TRACER.span("save", names):
+            all_paths = self._recorder.save_all(sources, thumb=True, analyze=False)
+        recordings = [
+            (source, source.name, paths) for source, paths in zip(sources, all_paths)
+        ]
+        # Blocks while the analysis queue is full
+        with TRACER.span("analysis_submit", names):
+            self.analysis_pool.submit(
+                frames, partial(self._add_intruders, recordings), regions
+            )
+
+    def _add_intruders(
+        self,
+        recordings: List[Tuple[DetectionSource, str, List[str]]],
+        predictions: Dict[str, List[str]],
+    ) -> None:
+        """
+        Called by the analysis pool once the recordings have been analyzed.
+        Each intruder is added once its video has been saved
+        """
+        for source, name, paths in recordings:
+            labels = predictions.get(name, [])
+            thumb_path = paths[1] if len(paths) == 2 else None
+            self._recorder.when_saved(
+                paths[0],
+                partial(self._add_saved_intruder, source, thumb_path, labels),
+            )
+
+    def _add_saved_intruder(
+        self,
+        source: DetectionSource,
+        thumb_path: str | None,
+        labels: List[str],
+        video_path: str | None,
+    ) -> None:
+        """
+        Adds an intruder whose video has been saved. Recordings whose video
+        could not be saved are dropped along with their thumbnail
+        """
+        if video_path is None:
+            print(f"ERROR: The recording of {source.name} could not be saved")
+            if thumb_path is not None and os.path.exists(thumb_path):
+                os.remove(thumb_path)
+            return
+        self.add_intruder(source, video_path, thumb_path=thumb_path, labels=labels)
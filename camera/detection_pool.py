@@ -0,0 +1,481 @@
+from __future__ import annotations
+
+import multiprocessing as mp
+import time
+from multiprocessing.connection import Connection, wait
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock, Thread
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+import config
+import cv2 as cv
+import numpy as np
+
+from .frame_buffer import FrameBuffer, FrameCursor
+
+
+class MotionResult(NamedTuple):
+    """
+    Result of running motion detection on a single frame in a worker process
+    """
+
+    name: str
+    seq: int
+    # Bounding boxes (x, y, width, height) of the moving objects, largest first
+    boxes: List[Tuple[int, int, int, int]]
+    # Fraction of the frame covered by the foreground mask
+    motion_energy: float
+
+
+class SharedFrameSource:
+    """
+    Source used by detection worker processes.
+    Frames are written into shared memory by the main process so that they
+    never have to be pickled when they are handed over to a worker
+    """
+
+    def __init__(
+        self, name: str, shm_name: str, frame_shape: Tuple[int, ...], num_slots: int
+    ):
+        self.name = name
+        self.source = None
+        self.frames = FrameBuffer(num_slots)
+        self._shm = SharedMemory(name=shm_name)
+        self._slots = np.ndarray(
+            (num_slots, *frame_shape), dtype=np.uint8, buffer=self._shm.buf
+        )
+        self._open = True
+
+    @property
+    def is_active(self) -> bool:
+        return self._open
+
+    def start(self) -> SharedFrameSource:
+        return self
+
+    def stop(self) -> None:
+        self._open = False
+
+    def load(self, slot: int) -> None:
+        """
+        Makes the frame in `slot` the newest frame of the source. No data is copied
+        """
+        self.frames.put(self._slots[slot])
+
+    def read(self, resize_frame: Tuple[int, int] | None = None) -> np.ndarray | None:
+        packet = self.frames.latest()
+        if packet is None:
+            return None
+        return packet.resized(resize_frame)
+
+    def cursor(self, name: str) -> FrameCursor:
+        return self.frames.cursor(name)
+
+    def close(self) -> None:
+        self.stop()
+        self.frames.clear()
+        self._slots = None
+        self._shm.close()
+
+
+def _run_worker(
+    task_queue: mp.Queue, result_conn: Connection, num_threads: int = 1
+) -> None:
+    """
+    Entry point of a detection worker process.
+    Every worker owns the DetectionSources (and background subtractors) of the
+    cameras assigned to it and processes their frames in order. A task that
+    fails is skipped, a frame that fails gets a result without motion so that
+    its slot is freed
+    """
+    # pylint: disable=import-outside-toplevel
+    from .detection import DetectionSource
+
+    # Each worker handles a share of the cameras, so OpenCV should only use
+    # the cores that are not taken by the other workers
+    cv.setNumThreads(num_threads)
+
+    shared_sources: Dict[str, SharedFrameSource] = {}
+    detection_sources: Dict[str, DetectionSource] = {}
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        command, name, *args = task
+        try:
+            if command == "add":
+                shared_source = SharedFrameSource(name, *args)
+                shared_sources[name] = shared_source
+                detection_sources[name] = DetectionSource(name, shared_source)
+            elif command == "zones" and name in detection_sources:
+                detection_sources[name].set_zones(*args)
+            elif command == "min_area" and name in detection_sources:
+                detection_sources[name].min_motion_area = args[0]
+            elif command == "remove":
+                detection_sources.pop(name, None)
+                shared_source = shared_sources.pop(name, None)
+                if shared_source is not None:
+                    shared_source.close()
+            elif command == "frame":
+                # Fails if the camera could not be added
+                seq, slot = args
+                shared_sources[name].load(slot)
+                boxes = _detect_motion(detection_sources[name])
+                result_conn.send(
+                    MotionResult(
+                        name, seq, boxes, detection_sources[name].motion_energy
+                    )
+                )
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"ERROR: Detection task {command} of {name} failed: {err}")
+            if command == "frame":
+                result_conn.send(MotionResult(name, args[0], [], 0.0))
+
+    for shared_source in shared_sources.values():
+        shared_source.close()
+
+
+def _detect_motion(detection_source) -> List[Tuple[int, int, int, int]]:
+    """
+    Runs the same motion detection as IntruderDetector.detect_motion_in_frame
+    on the newest frame of a detection source
+    """
+    frame = detection_source.read_new()
+    foreground_mask = detection_source.get_foreground_mask(frame)
+    detection_source.update_motion_energy(foreground_mask)
+    blobs = detection_source.find_blobs(foreground_mask)
+    return detection_source.get_motion_boxes(blobs)
+
+
+class DetectionProcessPool:
+    """
+    Runs motion detection for many cameras on a pool of worker processes.
+    Cameras are partitioned across the workers, frames are handed over through
+    shared memory and results come back through a pipe per worker.
+    A worker that dies, e.g. because it ran out of memory, is restarted with
+    the same cameras. The frames it was working on come back without motion
+    """
+
+    def __init__(
+        self,
+        num_processes: int,
+        on_result: Callable[[MotionResult], None],
+        frame_size: Tuple[int, int] = config.FRAME_SIZE,
+        num_slots: int = 4,
+        num_threads: int = 1,
+    ):
+        if num_processes < 1:
+            raise ValueError("ERROR: The detection pool needs at least one process")
+
+        self.num_processes = num_processes
+        self.frame_shape = (frame_size[1], frame_size[0], 3)
+        self.num_slots = num_slots
+        self.num_threads = num_threads
+        self._on_result = on_result
+
+        self._context = mp.get_context("spawn")
+        self._task_queues: List[mp.Queue] = []
+        # Every worker has its own pipe for results, so that a worker that is
+        # killed can't leave a shared queue locked
+        self._result_conns: List[Connection] = []
+        self._workers: List[mp.Process] = []
+        self._result_thread: Thread | None = None
+        self._stopping = False
+
+        self._assignments: Dict[str, int] = {}
+        # Settings of each camera, sent again when its worker is restarted
+        self._zones: Dict[str, List[dict] | None] = {}
+        self._min_areas: Dict[str, int] = {}
+        self._shared_memory: Dict[str, SharedMemory] = {}
+        self._frame_slots: Dict[str, np.ndarray] = {}
+        self._next_seq: Dict[str, int] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._in_flight_lock = Lock()
+        self.frames_submitted: Dict[str, int] = {}
+        self.frames_skipped: Dict[str, int] = {}
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self) -> DetectionProcessPool:
+        """
+        Starts the worker processes
+        """
+        if self.is_running:
+            return self
+
+        self._stopping = False
+        for _ in range(self.num_processes):
+            task_queue, result_conn, worker = self._start_worker()
+            self._task_queues.append(task_queue)
+            self._result_conns.append(result_conn)
+            self._workers.append(worker)
+
+        self._result_thread = Thread(target=self._collect_results, daemon=True)
+        self._result_thread.start()
+        return self
+
+    def _start_worker(self) -> Tuple[mp.Queue, Connection, mp.Process]:
+        """
+        Starts a worker process with its own task queue and result pipe
+        """
+        task_queue = self._context.Queue()
+        result_conn, worker_conn = self._context.Pipe(duplex=False)
+        worker = self._context.Process(
+            target=_run_worker,
+            args=(task_queue, worker_conn, self.num_threads),
+            daemon=True,
+        )
+        worker.start()
+        # Only the worker writes to the pipe, so that it reaches its end once
+        # the worker stops
+        worker_conn.close()
+        return task_queue, result_conn, worker
+
+    def add_source(
+        self,
+        name: str,
+        zones: List[dict] | None = None,
+        min_motion_area: int = config.MIN_MOTION_AREA,
+    ) -> None:
+        """
+        Assigns a camera to the worker with the fewest cameras.
+        `zones` are the detection zones of the camera
+        """
+        if name in self._assignments:
+            return
+
+        loads = [0] * self.num_processes
+        for worker_id in self._assignments.values():
+            loads[worker_id] += 1
+        worker_id = loads.index(min(loads))
+
+        frame_bytes = int(np.prod(self.frame_shape))
+        shm = SharedMemory(create=True, size=frame_bytes * self.num_slots)
+        self._shared_memory[name] = shm
+        self._frame_slots[name] = np.ndarray(
+            (self.num_slots, *self.frame_shape), dtype=np.uint8, buffer=shm.buf
+        )
+        self._assignments[name] = worker_id
+        self._next_seq[name] = 0
+        self._in_flight[name] = 0
+        self.frames_submitted[name] = 0
+        self.frames_skipped[name] = 0
+
+        self._zones[name] = zones
+        self._min_areas[name] = min_motion_area
+        with self._in_flight_lock:
+            self._add_to_worker(name)
+
+    def _add_to_worker(self, name: str) -> None:
+        """
+        Sends a camera and its settings to its worker
+        """
+        task_queue = self._task_queues[self._assignments[name]]
+        task_queue.put(
+            (
+                "add",
+                name,
+                self._shared_memory[name].name,
+                self.frame_shape,
+                self.num_slots,
+            )
+        )
+        if self._zones[name]:
+            task_queue.put(("zones", name, self._zones[name]))
+        if self._min_areas[name] != config.MIN_MOTION_AREA:
+            task_queue.put(("min_area", name, self._min_areas[name]))
+
+    def set_zones(self, name: str, zones: List[dict] | None) -> None:
+        """
+        Changes the detection zones of a camera
+        """
+        with self._in_flight_lock:
+            worker_id = self._assignments.get(name)
+            if worker_id is not None:
+                self._zones[name] = zones
+                self._task_queues[worker_id].put(("zones", name, zones))
+
+    def set_min_motion_area(self, name: str, min_area: int) -> None:
+        """
+        Changes the smallest moving area that counts as motion for a camera
+        """
+        with self._in_flight_lock:
+            worker_id = self._assignments.get(name)
+            if worker_id is not None:
+                self._min_areas[name] = min_area
+                self._task_queues[worker_id].put(("min_area", name, min_area))
+
+    def remove_source(self, name: str) -> None:
+        """
+        Removes a camera from its worker and frees its shared memory
+        """
+        with self._in_flight_lock:
+            worker_id = self._assignments.pop(name, None)
+            if worker_id is None:
+                return
+            self._task_queues[worker_id].put(("remove", name))
+            self._in_flight.pop(name)
+        self._zones.pop(name, None)
+        self._min_areas.pop(name, None)
+        self._frame_slots.pop(name)
+        shm = self._shared_memory.pop(name)
+        shm.close()
+        shm.unlink()
+
+    def submit(self, name: str, frame: np.ndarray) -> int | None:
+        """
+        Copies a frame into the shared memory of a camera and queues it for
+        motion detection. Returns the sequence number of the submitted frame, or
+        None if the camera's worker is still busy with every shared memory slot
+        """
+        # One slot is always kept free so that the frame a worker is reading
+        # is never overwritten
+        with self._in_flight_lock:
+            if self._in_flight[name] >= self.num_slots - 1:
+                self.frames_skipped[name] += 1
+                return None
+            self._in_flight[name] += 1
+
+        seq = self._next_seq[name] + 1
+        slot = seq % self.num_slots
+        np.copyto(self._frame_slots[name][slot], frame)
+
+        with self._in_flight_lock:
+            self._next_seq[name] = seq
+            self.frames_submitted[name] += 1
+            # Queued under the lock so that a worker being restarted can't
+            # miss it
+            self._task_queues[self._assignments[name]].put(("frame", name, seq, slot))
+        return seq
+
+    def stop(self) -> None:
+        """
+        Stops all worker processes and frees every shared memory block
+        """
+        self._stopping = True
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+        # Returns once every result of the stopped workers has been forwarded
+        if self._result_thread is not None:
+            self._result_thread.join()
+        for result_conn in self._result_conns:
+            result_conn.close()
+
+        for name in list(self._assignments):
+            self._assignments.pop(name)
+            shm = self._shared_memory.pop(name)
+            shm.close()
+            shm.unlink()
+        self._frame_slots.clear()
+        self._zones.clear()
+        self._min_areas.clear()
+        self._task_queues = []
+        self._result_conns = []
+        self._workers = []
+
+    def _collect_results(self) -> None:
+        """
+        Forwards results from the workers to the `on_result` callback and
+        restarts workers that died
+        """
+        next_check = time.monotonic() + 1
+        while True:
+            if time.monotonic() >= next_check:
+                self._restart_dead_workers()
+                next_check = time.monotonic() + 1
+
+            result_conns = [conn for conn in self._result_conns if not conn.closed]
+            if self._stopping and not result_conns:
+                break
+
+            for result_conn in wait(result_conns, timeout=1):
+                try:
+                    result: MotionResult = result_conn.recv()
+                except (EOFError, OSError):
+                    # The worker stopped
+                    result_conn.close()
+                    continue
+                self._forward_result(result)
+
+    def _forward_result(self, result: MotionResult) -> None:
+        """
+        Frees the slot of a result and passes it on to the `on_result` callback
+        """
+        with self._in_flight_lock:
+            if result.name in self._in_flight:
+                self._in_flight[result.name] -= 1
+        self._on_result(result)
+
+    def _restart_dead_workers(self) -> None:
+        """
+        Starts a new worker in place of every worker that died and gives it
+        the cameras of the old one. Their frames that were lost with the old
+        worker get results without motion, which frees their slots
+        """
+        for worker_id, worker in enumerate(self._workers):
+            if self._stopping or worker.is_alive():
+                continue
+            print(
+                f"ERROR: Detection worker {worker_id} stopped with exit code "
+                f"{worker.exitcode}, restarting it"
+            )
+            # Results that were sent before the worker died are still valid
+            old_conn = self._result_conns[worker_id]
+            while not old_conn.closed and old_conn.poll():
+                try:
+                    self._forward_result(old_conn.recv())
+                except (EOFError, OSError):
+                    old_conn.close()
+            old_conn.close()
+
+            lost_results: List[MotionResult] = []
+            with self._in_flight_lock:
+                (
+                    self._task_queues[worker_id],
+                    self._result_conns[worker_id],
+                    self._workers[worker_id],
+                ) = self._start_worker()
+                for name, assigned_id in self._assignments.items():
+                    if assigned_id != worker_id:
+                        continue
+                    # Results of a camera come back in order, so the lost
+                    # frames are the newest ones
+                    last_seq = self._next_seq[name]
+                    lost_results.extend(
+                        MotionResult(name, seq, [], 0.0)
+                        for seq in range(
+                            last_seq - self._in_flight[name] + 1, last_seq + 1
+                        )
+                    )
+                    self._in_flight[name] = 0
+                    self._add_to_worker(name)
+            for result in lost_results:
+                self._on_result(result)
+
+
+def default_num_processes() -> int:
+    """
+    Number of detection worker processes to use when none is given: one per core,
+    leaving a core free for capture and recording
+    """
+    return max(1, (mp.cpu_count() or 1) - 1)
+
+
+def default_num_threads(num_sources: int, num_processes: int = 0) -> int:
+    """
+    Number of OpenCV threads each process detecting motion should use.
+    Without worker processes cameras are handled one after the other and
+    every core is available to each frame. With workers, the cores are shared
+    by the workers that have cameras to process
+    """
+    concurrent = min(num_sources, num_processes) if num_processes > 0 else 1
+    return max(1, (mp.cpu_count() or 1) // max(1, concurrent))
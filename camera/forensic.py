@@ -0,0 +1,436 @@
+from __future__ import annotations
+
+import json
+import multiprocessing as mp
+import os
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Tuple
+
+import config
+import cv2 as cv
+import numpy as np
+
+from .analysis import IntruderAnalyzer, predict_labels, select_frame_indices
+from .detection import DetectionSource, IntruderDetector
+from .frame_buffer import FrameBuffer, FrameCursor
+from .frame_store import CompactFrameStore
+
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".m4v", ".ts")
+
+
+class ScanChunk(NamedTuple):
+    """
+    Part of a video file that is scanned as one task
+    """
+
+    # Path of the video relative to the scanned directory
+    path: str
+    index: int
+    start_frame: int
+    end_frame: int
+    fps: float
+
+
+class ArchiveSource:
+    """
+    Source that reads a video file one frame at a time, as fast as frames can
+    be decoded. Unlike VideoSource no frame is ever skipped
+    """
+
+    def __init__(
+        self, video_path: str, frame_size: Tuple[int, int] = config.FRAME_SIZE
+    ):
+        self.name = os.path.basename(video_path)
+        self.source = video_path
+        self.frame_size = frame_size
+        self.frames = FrameBuffer()
+        self._capture = cv.VideoCapture(video_path)
+
+    @property
+    def is_active(self) -> bool:
+        return self._capture is not None and self._capture.isOpened()
+
+    def start(self) -> ArchiveSource:
+        return self
+
+    def stop(self) -> None:
+        if self._capture is not None:
+            self._capture.release()
+        self._capture = None
+        self.frames.clear()
+
+    def seek(self, frame_index: int) -> None:
+        self._capture.set(cv.CAP_PROP_POS_FRAMES, frame_index)
+
+    def grab(self) -> np.ndarray | None:
+        """
+        Decodes the next frame and makes it the newest frame of the source.
+        Returns None at the end of the video
+        """
+        success, frame = self._capture.read()
+        if not success:
+            return None
+        if frame.shape[1::-1] != tuple(self.frame_size):
+            frame = cv.resize(frame, self.frame_size)
+        self.frames.put(frame)
+        return frame
+
+    def read(self, resize_frame: Tuple[int, int] | None = None) -> np.ndarray | None:
+        packet = self.frames.latest()
+        if packet is None:
+            return None
+        return packet.resized(resize_frame)
+
+    def cursor(self, name: str) -> FrameCursor:
+        return self.frames.cursor(name)
+
+
+def get_video_info(video_path: str) -> Tuple[int, float]:
+    """
+    Returns the number of frames and the frame rate of a video.
+    Containers that don't store the number of frames, such as some .ts and .mkv
+    files, are read to the end to count them
+    """
+    capture = cv.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"ERROR: Could not open {video_path}")
+    num_frames = int(capture.get(cv.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv.CAP_PROP_FPS) or config.FPS
+    if num_frames <= 0:
+        num_frames = 0
+        while capture.grab():
+            num_frames += 1
+    capture.release()
+    if num_frames == 0:
+        raise ValueError(f"ERROR: Could not read any frame of {video_path}")
+    return num_frames, fps
+
+
+def make_chunks(
+    path: str, num_frames: int, fps: float, chunk_seconds: float
+) -> List[ScanChunk]:
+    """
+    Splits a video into chunks of `chunk_seconds`
+    """
+    chunk_frames = max(1, int(chunk_seconds * fps))
+    return [
+        ScanChunk(path, index, start, min(start + chunk_frames, num_frames), fps)
+        for index, start in enumerate(range(0, num_frames, chunk_frames))
+    ]
+
+
+def scan_chunk(
+    video_path: str,
+    chunk: ScanChunk,
+    analyzer: IntruderAnalyzer | None = None,
+    min_conseq_frames: int = 10,
+    warmup_seconds: float = config.FORENSIC_WARMUP_SECONDS,
+) -> List[Dict[str, object]]:
+    """
+    Runs the motion detection of IntruderDetector over a chunk of a video.
+    An event starts once `min_conseq_frames` frames in a row have motion, at
+    the first of them, and ends with the first frame without motion. The
+    frames before the chunk are used to train the background model. Events
+    are classified with `analyzer` if it is given.
+    Returns the events with their offsets in seconds from the start of the video
+    """
+    source = ArchiveSource(video_path)
+    detection_source = DetectionSource(chunk.path, source)
+    stored_frames = CompactFrameStore()
+    warmup_frames = min(chunk.start_frame, int(warmup_seconds * chunk.fps))
+    if chunk.start_frame - warmup_frames > 0:
+        source.seek(chunk.start_frame - warmup_frames)
+
+    events: List[Dict[str, object]] = []
+    event_start: int | None = None
+
+    def end_event(end_frame: int) -> None:
+        labels: List[str] = []
+        if analyzer is not None:
+            frames = stored_frames.get_frames(chunk.path)
+            indices = select_frame_indices(
+                frames, frames.motion_energy, config.ANALYSIS_FRAMES_PER_EVENT
+            )
+            labels = predict_labels(
+                analyzer,
+                {chunk.path: [frames[index] for index in indices]},
+                {chunk.path: [frames.motion_boxes[index] for index in indices]},
+            )[chunk.path]
+        stored_frames.clear(chunk.path)
+        events.append(
+            {
+                "start_offset": round(event_start / chunk.fps, 3),
+                "end_offset": round(end_frame / chunk.fps, 3),
+                "labels": sorted(set(labels)),
+            }
+        )
+
+    frame_index = chunk.start_frame - warmup_frames
+    while frame_index < chunk.end_frame and source.grab() is not None:
+        frame = detection_source.read_new()
+        foreground_mask = detection_source.get_foreground_mask(frame)
+        detection_source.update_motion_energy(foreground_mask)
+        blobs = detection_source.find_blobs(foreground_mask)
+
+        if frame_index >= chunk.start_frame:
+            if IntruderDetector.is_motion_frame(blobs):
+                detection_source.conseq_motion_frames += 1
+            else:
+                if event_start is not None:
+                    end_event(frame_index)
+                    event_start = None
+                detection_source.conseq_motion_frames = 0
+
+            if detection_source.conseq_motion_frames >= min_conseq_frames:
+                if event_start is None:
+                    event_start = frame_index - min_conseq_frames + 1
+                stored_frames.add(
+                    chunk.path,
+                    frame,
+                    detection_source.motion_energy,
+                    detection_source.get_motion_boxes(blobs),
+                )
+        frame_index += 1
+
+    if event_start is not None:
+        end_event(frame_index)
+    source.stop()
+    return events
+
+
+def merge_events(
+    events: List[Dict[str, object]], max_gap: float
+) -> List[Dict[str, object]]:
+    """
+    Merges events of a video that are less than `max_gap` seconds apart, e.g.
+    an event that was split at the edge of a chunk
+    """
+    merged: List[Dict[str, object]] = []
+    for event in sorted(events, key=lambda event: event["start_offset"]):
+        if merged and event["start_offset"] - merged[-1]["end_offset"] <= max_gap:
+            last = merged[-1]
+            last["end_offset"] = max(last["end_offset"], event["end_offset"])
+            last["labels"] = sorted(set(last["labels"]) | set(event["labels"]))
+        else:
+            merged.append(dict(event))
+    return merged
+
+
+# Analyzer of a worker process, loaded once per process
+_analyzer: IntruderAnalyzer | None = None
+
+
+def _init_worker(analyze: bool, num_threads: int) -> None:
+    # pylint: disable=global-statement
+    global _analyzer
+    cv.setNumThreads(num_threads)
+    if analyze:
+        _analyzer = IntruderAnalyzer()
+
+
+def _scan_task(
+    task: Tuple[str, ScanChunk, int, float],
+) -> Tuple[ScanChunk, List[Dict[str, object]]]:
+    video_path, chunk, min_conseq_frames, warmup_seconds = task
+    events = scan_chunk(video_path, chunk, _analyzer, min_conseq_frames, warmup_seconds)
+    return chunk, events
+
+
+class ForensicScan:
+    """
+    Scans a directory of archived footage for intruders as fast as the CPU
+    allows. Videos are split into chunks which are scanned in parallel by a
+    pool of processes.
+    Progress is kept in an index with an entry per video, saved after every
+    chunk, so an interrupted scan picks up where it stopped. Videos that
+    changed since they were scanned are scanned again.
+    The events are written to `events.json` in `output_directory`
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        output_directory: str,
+        num_processes: int = -1,
+        min_conseq_frames: int = 10,
+        analyze: bool = True,
+        chunk_seconds: float = config.FORENSIC_CHUNK_SECONDS,
+        warmup_seconds: float = config.FORENSIC_WARMUP_SECONDS,
+        event_gap: float = config.FORENSIC_EVENT_GAP,
+    ):
+        """
+        `num_processes` of 0 scans in the calling process, a negative number
+        uses one process per core
+        """
+        if not os.path.isdir(directory):
+            raise ValueError(f"ERROR: {directory} is not a directory")
+
+        self.directory = directory
+        self.output_directory = output_directory
+        if num_processes < 0:
+            num_processes = mp.cpu_count() or 1
+        self.num_processes = num_processes
+        self.min_conseq_frames = min_conseq_frames
+        self.analyze = analyze
+        self.chunk_seconds = chunk_seconds
+        self.warmup_seconds = warmup_seconds
+        self.event_gap = event_gap
+        self.index_path = f"{output_directory}/progress.json"
+        self.events_path = f"{output_directory}/events.json"
+
+    def find_videos(self) -> List[str]:
+        """
+        Returns the paths of the videos in the directory, relative to it
+        """
+        videos: List[str] = []
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                if file_name.lower().endswith(VIDEO_EXTENSIONS):
+                    path = os.path.join(root, file_name)
+                    videos.append(os.path.relpath(path, self.directory))
+        return sorted(videos)
+
+    def load_index(self) -> Dict[str, Dict[str, object]]:
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, encoding="utf-8") as index_file:
+            return json.load(index_file)
+
+    def save_index(self, index: Dict[str, Dict[str, object]]) -> None:
+        """
+        Writes the index to a temporary file first so that an interruption
+        never leaves a truncated index behind
+        """
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as index_file:
+            json.dump(index, index_file)
+        os.replace(temp_path, self.index_path)
+
+    def get_pending_chunks(
+        self, index: Dict[str, Dict[str, object]]
+    ) -> List[ScanChunk]:
+        """
+        Adds new or changed videos to the index and returns the chunks that
+        still have to be scanned
+        """
+        pending: List[ScanChunk] = []
+        for path in self.find_videos():
+            video_path = os.path.join(self.directory, path)
+            stat = os.stat(video_path)
+            entry = index.get(path)
+            if (
+                entry is None
+                or entry["size"] != stat.st_size
+                or entry["mtime"] != stat.st_mtime
+            ):
+                try:
+                    num_frames, fps = get_video_info(video_path)
+                except ValueError as err:
+                    print(err)
+                    continue
+                entry = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "num_frames": num_frames,
+                    "fps": fps,
+                    # Exported footage is last modified when the recording ends
+                    "start_time": stat.st_mtime - num_frames / fps,
+                    "chunks": {},
+                }
+                index[path] = entry
+
+            chunks = make_chunks(
+                path, entry["num_frames"], entry["fps"], self.chunk_seconds
+            )
+            entry["num_chunks"] = len(chunks)
+            pending.extend(
+                chunk for chunk in chunks if str(chunk.index) not in entry["chunks"]
+            )
+        return pending
+
+    def run(self, restart: bool = False) -> List[Dict[str, object]]:
+        """
+        Scans the videos that haven't been scanned yet and returns the events
+        of every video in the directory. `restart` discards earlier progress
+        """
+        os.makedirs(self.output_directory, exist_ok=True)
+        index = {} if restart else self.load_index()
+        pending = self.get_pending_chunks(index)
+        self.save_index(index)
+        print(f"{len(pending)} chunks of {len(index)} videos left to scan")
+
+        tasks = [
+            (
+                os.path.join(self.directory, chunk.path),
+                chunk,
+                self.min_conseq_frames,
+                self.warmup_seconds,
+            )
+            for chunk in pending
+        ]
+        if self.num_processes == 0:
+            analyzer = IntruderAnalyzer() if self.analyze and tasks else None
+            results = (
+                (chunk, scan_chunk(path, chunk, analyzer, *settings))
+                for path, chunk, *settings in tasks
+            )
+            self._collect(index, results, len(tasks))
+        elif tasks:
+            # Each process scans a chunk on its own core
+            num_threads = 1 if self.num_processes > 1 else 0
+            context = mp.get_context("spawn")
+            with context.Pool(
+                min(self.num_processes, len(tasks)),
+                initializer=_init_worker,
+                initargs=(self.analyze, num_threads),
+            ) as pool:
+                self._collect(index, pool.imap_unordered(_scan_task, tasks), len(tasks))
+
+        events = self.get_events(index)
+        with open(self.events_path, "w", encoding="utf-8") as events_file:
+            json.dump(events, events_file, indent=2)
+        return events
+
+    def _collect(self, index, results, num_tasks: int) -> None:
+        """
+        Records the events of every scanned chunk in the index
+        """
+        for num_done, (chunk, events) in enumerate(results, start=1):
+            index[chunk.path]["chunks"][str(chunk.index)] = events
+            self.save_index(index)
+            print(
+                f"Scanned chunk {chunk.index + 1}/{index[chunk.path]['num_chunks']} "
+                f"of {chunk.path} ({num_done}/{num_tasks})"
+            )
+
+    def get_events(
+        self, index: Dict[str, Dict[str, object]]
+    ) -> List[Dict[str, object]]:
+        """
+        Returns the events of the videos in the index, merged across chunks,
+        with their wall clock times and intruder label
+        """
+        all_events: List[Dict[str, object]] = []
+        for path, entry in sorted(index.items()):
+            chunk_events = [
+                event for events in entry["chunks"].values() for event in events
+            ]
+            for event in merge_events(chunk_events, self.event_gap):
+                start = entry["start_time"] + event["start_offset"]
+                end = entry["start_time"] + event["end_offset"]
+                all_events.append(
+                    {
+                        "file": path,
+                        "start_offset": event["start_offset"],
+                        "end_offset": event["end_offset"],
+                        "start_time": datetime.fromtimestamp(start).isoformat(
+                            timespec="seconds"
+                        ),
+                        "end_time": datetime.fromtimestamp(end).isoformat(
+                            timespec="seconds"
+                        ),
+                        "label": IntruderDetector.get_intruder_label(event["labels"]),
+                        "labels": event["labels"],
+                    }
+                )
+        return all_events
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import time
+from collections import deque
+from threading import Condition, Event, Lock
+from typing import Any, Deque, Dict, List, NamedTuple, Set, Tuple
+
+import config
+import cv2 as cv
+import numpy as np
+
+
+class FramePacket(NamedTuple):
+    """
+    A decoded frame together with its sequence number and capture time.
+    The frame is shared between all consumers so it must not be modified in place.
+    Views derived from the frame (resized, grayscale) are computed once and
+    shared by every consumer that asks for them
+    """
+
+    seq: int
+    timestamp: float
+    frame: np.ndarray
+    views: Dict[Tuple[str, Tuple[int, int] | None], np.ndarray] = None
+
+    def resized(self, size: Tuple[int, int] | None = None) -> np.ndarray:
+        """
+        Returns the frame resized to `size` (width, height).
+        The frame itself is returned if it already has that size
+        """
+        if size is None or self.frame.shape[1::-1] == tuple(size):
+            return self.frame
+        return self._get_view("resized", tuple(size))
+
+    def gray(self, size: Tuple[int, int] | None = None) -> np.ndarray:
+        """
+        Returns the frame converted to grayscale, resized to `size` if given
+        """
+        if size is not None and self.frame.shape[1::-1] == tuple(size):
+            size = None
+        return self._get_view("gray", size and tuple(size))
+
+    def _get_view(self, kind: str, size: Tuple[int, int] | None) -> np.ndarray:
+
+        views = self.views if self.views is not None else {}
+        view = views.get((kind, size))
+        if view is None:
+            if kind == "resized":
+                view = cv.resize(self.frame, size)
+            else:
+                # Resizing first means fewer pixels to convert
+                view = cv.cvtColor(self.resized(size), cv.COLOR_BGR2GRAY)
+            # Consumers racing for the same view compute identical arrays,
+            # whichever is stored last wins
+            views[(kind, size)] = view
+        return view
+
+
+class FrameBuffer:
+    """
+    Fixed size ring buffer holding the last N decoded frames of a source.
+    Every frame gets a monotonically increasing sequence number (starting at 1)
+    which consumers can use to ask for frames they have not seen yet.
+    Consumers can block until a new frame arrives instead of polling the buffer
+    """
+
+    def __init__(self, capacity: int = config.FRAME_BUFFER_SIZE):
+        if capacity < 1:
+            raise ValueError("ERROR: Frame buffer capacity must be at least 1")
+
+        self.capacity = capacity
+        self._slots: List[FramePacket | None] = [None] * capacity
+        self._last_seq = 0
+        self._lock = Lock()
+        self._new_frame = Condition(self._lock)
+        self._listeners: Set[Event] = set()
+
+    @property
+    def last_seq(self) -> int:
+        """
+        Returns the sequence number of the newest frame (0 if the buffer is empty)
+        """
+        return self._last_seq
+
+    def put(self, frame: np.ndarray, timestamp: float | None = None) -> int:
+        """
+        Adds a frame to the buffer, overwriting the oldest one if the buffer is full.
+        Returns the sequence number given to the frame
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self._lock:
+            seq = self._last_seq + 1
+            self._slots[seq % self.capacity] = FramePacket(seq, timestamp, frame, {})
+            self._last_seq = seq
+            self._notify()
+        return seq
+
+    def wait_for_frame(self, seq: int, timeout: float | None = None) -> bool:
+        """
+        Blocks until a frame newer than `seq` is added or the timeout expires.
+        Returns whether a newer frame is available
+        """
+        with self._new_frame:
+            return self._new_frame.wait_for(lambda: self._last_seq > seq, timeout)
+
+    def subscribe(self, listener: Event) -> None:
+        """
+        Sets `listener` every time a frame is added or the buffer is cleared.
+        A single event can be shared between many buffers to wait on all of them
+        """
+        with self._lock:
+            self._listeners.add(listener)
+
+    def unsubscribe(self, listener: Event) -> None:
+        with self._lock:
+            self._listeners.discard(listener)
+
+    def _notify(self) -> None:
+        """
+        Wakes up everything waiting on the buffer. Must be called with the lock held
+        """
+        self._new_frame.notify_all()
+        for listener in self._listeners:
+            listener.set()
+
+    def latest(self) -> FramePacket | None:
+        """
+        Returns the newest frame in the buffer
+        """
+        with self._lock:
+            if self._last_seq == 0:
+                return None
+            return self._slots[self._last_seq % self.capacity]
+
+    def get_since(self, seq: int) -> List[FramePacket]:
+        """
+        Returns the frames newer than `seq` that are still in the buffer,
+        oldest first. No frame data is copied
+        """
+        with self._lock:
+            last_seq = self._last_seq
+            first_seq = max(seq + 1, last_seq - self.capacity + 1, 1)
+            packets = [
+                self._slots[slot_seq % self.capacity]
+                for slot_seq in range(first_seq, last_seq + 1)
+            ]
+        return [packet for packet in packets if packet is not None]
+
+    def clear(self) -> None:
+        """
+        Removes all frames from the buffer. Sequence numbers keep increasing
+        so that existing cursors stay valid
+        """
+        with self._lock:
+            self._slots = [None] * self.capacity
+            self._notify()
+
+    def cursor(self, name: str) -> FrameCursor:
+        """
+        Creates a cursor that only returns frames added after its creation
+        """
+        return FrameCursor(self, name)
+
+
+class FrameCursor:
+    """
+    Keeps track of the last frame a consumer has seen in a FrameBuffer and
+    of how many frames that consumer missed
+    """
+
+    def __init__(self, buffer: FrameBuffer, name: str):
+        self.buffer = buffer
+        self.name = name
+        self.last_seq = buffer.last_seq
+        self.last_timestamp: float | None = None
+        self.frames_read = 0
+        self.frames_dropped = 0
+
+    @property
+    def has_new_frames(self) -> bool:
+        """
+        Returns whether frames have been added since the last read
+        """
+        return self.buffer.last_seq > self.last_seq
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Blocks until there is a frame this cursor has not seen yet.
+        Returns False if the timeout expired first
+        """
+        return self.buffer.wait_for_frame(self.last_seq, timeout)
+
+    def read_new(self) -> List[FramePacket]:
+        """
+        Returns every unseen frame still in the buffer, oldest first.
+        Frames that were overwritten before they could be read are counted as dropped
+        """
+        packets = self.buffer.get_since(self.last_seq)
+        if packets:
+            self._advance(packets[-1], len(packets))
+        return packets
+
+    def read_latest(self) -> FramePacket | None:
+        """
+        Returns the newest frame if it has not been seen yet.
+        Any unseen frames older than it are skipped and counted as dropped
+        """
+        packet = self.buffer.latest()
+        if packet is None or packet.seq <= self.last_seq:
+            return None
+        self._advance(packet, 1)
+        return packet
+
+    def _advance(self, packet: FramePacket, num_read: int) -> None:
+        self.frames_dropped += packet.seq - self.last_seq - num_read
+        self.frames_read += num_read
+        self.last_seq = packet.seq
+        self.last_timestamp = packet.timestamp
+
+    def __str__(self) -> str:
+        return (
+            f"FrameCursor({self.name}, read={self.frames_read}, "
+            f"dropped={self.frames_dropped})"
+        )
+
+
+class PreRollFrame(NamedTuple):
+    """
+    A frame of the pre-roll buffer, either JPEG encoded to save memory or the
+    frame itself
+    """
+
+    data: np.ndarray
+    # Extra data stored with the frame, e.g. the motion found in it
+    info: Tuple[Any, ...]
+    encoded: bool = True
+
+    def decode(self) -> np.ndarray:
+        if not self.encoded:
+            return self.data
+        return cv.imdecode(self.data, cv.IMREAD_COLOR)
+
+
+class PreRollBuffer:
+    """
+    Keeps the last few seconds of frames of a source so that recordings can
+    start before motion was confirmed.
+    Frames are stored JPEG encoded by default, which takes about a twentieth of
+    the memory of the decoded frames
+    """
+
+    def __init__(
+        self,
+        seconds: float = config.PRE_ROLL_SECONDS,
+        fps: int = config.FPS,
+        jpeg_quality: int = config.PRE_ROLL_JPEG_QUALITY,
+    ):
+        self.capacity = int(seconds * fps)
+        self._encode_params = [cv.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        self._frames: Deque[PreRollFrame] = deque(maxlen=max(self.capacity, 1))
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the frames
+        """
+        return sum(frame.data.nbytes for frame in self._frames)
+
+    def push(self, frame: np.ndarray, *info: Any, encode: bool = True) -> None:
+        """
+        Adds a frame, dropping the oldest one if the buffer is full.
+        A frame that is not encoded is kept by reference and costs no CPU, so
+        it must not be modified afterwards
+        """
+        if self.capacity < 1:
+            return
+        if not encode:
+            self._frames.append(PreRollFrame(frame, info, encoded=False))
+            return
+        success, jpeg = cv.imencode(".jpg", frame, self._encode_params)
+        if success:
+            self._frames.append(PreRollFrame(jpeg, info))
+
+    def drain(self) -> List[Tuple[np.ndarray, Tuple[Any, ...]]]:
+        """
+        Removes every frame from the buffer and returns them decoded, oldest first,
+        together with the data they were pushed with
+        """
+        frames = [(frame.decode(), frame.info) for frame in self._frames]
+        self._frames.clear()
+        return frames
+
+    def clear(self) -> None:
+        self._frames.clear()
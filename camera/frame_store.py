@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from threading import Lock
+from typing import Dict, List, NamedTuple, Sequence
+
+import config
+import cv2 as cv
+import numpy as np
+
+from .analysis import Box
+
+
+class StoredFrame(NamedTuple):
+    """
+    A recorded frame kept for thumbnails and analysis, JPEG encoded
+    """
+
+    jpeg: np.ndarray
+    motion_energy: float
+    motion_boxes: List[Box]
+
+    def decode(self) -> np.ndarray:
+        return cv.imdecode(self.jpeg, cv.IMREAD_COLOR)
+
+
+class StoredFrames(Sequence[np.ndarray]):
+    """
+    Read only view of the frames stored for a source.
+    Frames are only decoded when they are accessed
+    """
+
+    def __init__(self, frames: List[StoredFrame]):
+        self._frames = frames
+        self._decoded: Dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(len(self))[index]
+        if index not in self._decoded:
+            self._decoded[index] = self._frames[index].decode()
+        return self._decoded[index]
+
+    @property
+    def motion_energy(self) -> List[float]:
+        return [frame.motion_energy for frame in self._frames]
+
+    @property
+    def motion_boxes(self) -> List[List[Box]]:
+        return [frame.motion_boxes for frame in self._frames]
+
+
+class CompactFrameStore:
+    """
+    Keeps the frames of ongoing recordings JPEG encoded, within a memory budget
+    shared by every source.
+    When the budget is exceeded, frames are evicted from the source that uses
+    the most memory, starting with the frames with the least motion
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = config.RECORDER_MEMORY_BUDGET,
+        max_frames_per_source: int = 80,
+        jpeg_quality: int = config.RECORDER_JPEG_QUALITY,
+    ):
+        self.memory_budget = memory_budget
+        self.max_frames_per_source = max_frames_per_source
+        self._encode_params = [cv.IMWRITE_JPEG_QUALITY, jpeg_quality]
+
+        self._frames: Dict[str, List[StoredFrame]] = {}
+        self._num_frames: Dict[str, int] = {}
+        self._memory_used: Dict[str, int] = {}
+        self._lock = Lock()
+        self.frames_evicted = 0
+
+    @property
+    def memory_used(self) -> int:
+        """
+        Number of bytes used by the stored frames of all sources
+        """
+        with self._lock:
+            return sum(self._memory_used.values())
+
+    def get_memory_usage(self) -> Dict[str, int]:
+        """
+        Returns the number of bytes used by the stored frames of each source
+        """
+        with self._lock:
+            return dict(self._memory_used)
+
+    def num_frames(self, name: str) -> int:
+        """
+        Number of frames that were stored for a source since it was last cleared,
+        including frames that have been evicted
+        """
+        return self._num_frames.get(name, 0)
+
+    def add(
+        self,
+        name: str,
+        frame: np.ndarray,
+        motion_energy: float = 0.0,
+        motion_boxes: List[Box] | None = None,
+    ) -> bool:
+        """
+        Stores a frame of a source. Returns False if the source already has
+        `max_frames_per_source` frames
+        """
+        if self.num_frames(name) >= self.max_frames_per_source:
+            return False
+
+        success, jpeg = cv.imencode(".jpg", frame, self._encode_params)
+        if not success:
+            return False
+
+        stored_frame = StoredFrame(jpeg, motion_energy, list(motion_boxes or []))
+        with self._lock:
+            self._frames.setdefault(name, []).append(stored_frame)
+            self._num_frames[name] = self._num_frames.get(name, 0) + 1
+            self._memory_used[name] = self._memory_used.get(name, 0) + jpeg.nbytes
+            self._evict()
+        return True
+
+    def get_frames(self, name: str) -> StoredFrames:
+        """
+        Returns the frames that are still stored for a source, oldest first
+        """
+        with self._lock:
+            return StoredFrames(list(self._frames.get(name, [])))
+
+    def clear(self, name: str) -> None:
+        """
+        Drops the stored frames of a source, e.g. once its recording is saved
+        """
+        with self._lock:
+            self._frames[name] = []
+            self._num_frames[name] = 0
+            self._memory_used[name] = 0
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._frames.pop(name, None)
+            self._num_frames.pop(name, None)
+            self._memory_used.pop(name, None)
+
+    def _evict(self) -> None:
+        """
+        Evicts frames until the store fits in its memory budget.
+        Must be called with the lock held
+        """
+        while sum(self._memory_used.values()) > self.memory_budget:
+            name = max(self._memory_used, key=self._memory_used.get)
+            frames = self._frames[name]
+            if len(frames) <= 1:
+                # A single frame per source is always kept for the thumbnail
+                break
+
+            index = min(range(len(frames)), key=lambda i: frames[i].motion_energy)
+            evicted = frames.pop(index)
+            self._memory_used[name] -= evicted.jpeg.nbytes
+            self.frames_evicted += 1
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import os
+import queue
+import re
+import shutil
+import subprocess
+from functools import lru_cache
+from threading import Thread
+from typing import List, Optional, Tuple
+
+import config
+import numpy as np
+
+from .segment_recorder import SEGMENT_NAME_FORMAT
+
+
+def get_hls_args(
+    playlist_path: str,
+    segment_duration: float | None = None,
+    low_latency: bool = False,
+) -> List[str]:
+    """
+    Returns the ffmpeg output options of a live feed.
+    The low latency mode uses short CMAF (fMP4) segments, a short playlist and
+    wall clock timestamps so that players can stay close to the live edge
+    """
+    if segment_duration is None:
+        segment_duration = (
+            config.LOW_LATENCY_SEGMENT_DURATION
+            if low_latency
+            else config.HLS_SEGMENT_DURATION
+        )
+
+    args = ["-f", "hls", "-hls_time", str(segment_duration)]
+    if low_latency:
+        args += [
+            "-hls_list_size",
+            "6",
+            "-hls_segment_type",
+            "fmp4",
+            "-hls_flags",
+            "delete_segments+independent_segments+program_date_time",
+        ]
+    else:
+        args += ["-hls_list_size", "10", "-hls_flags", "delete_segments"]
+    return args + [playlist_path]
+
+
+@lru_cache(maxsize=1)
+def get_ffmpeg_major_version() -> int | None:
+    """
+    Returns the major version of the installed ffmpeg, None if it can't be
+    told, e.g. for builds from git which are named after a commit
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg, "-version"], capture_output=True, text=True, check=False
+        )
+    except OSError:
+        return None
+    match = re.match(r"ffmpeg version n?(\d+)\.", result.stdout)
+    return int(match.group(1)) if match else None
+
+
+def get_rtsp_input_args(
+    read_timeout: float, ffmpeg_version: int | None = None
+) -> List[str]:
+    """
+    Returns the ffmpeg input options of an RTSP camera, which give up on the
+    camera if it sends nothing for `read_timeout` seconds.
+    Before ffmpeg 5.0 `-timeout` made RTSP wait for an incoming connection
+    and the socket timeout was `-stimeout`. Unknown versions are assumed to
+    be recent
+    """
+    timeout_option = (
+        "-stimeout" if ffmpeg_version is not None and ffmpeg_version < 5 else "-timeout"
+    )
+    # The timeout is in µs
+    return [
+        "-rtsp_transport",
+        "tcp",
+        timeout_option,
+        str(int(read_timeout * 1_000_000)),
+    ]
+
+
+class StreamIngest:
+    """
+    Single connection to the stream of a camera, shared by everything that
+    needs it.
+    One ffmpeg process demuxes the stream once and fans it out to:
+    - an HLS playlist for the live feed (stream copy)
+    - optionally, segments for stream-copy recording (stream copy)
+    - decoded frames, scaled to `frame_size`, piped to detection
+    It has the same `read` and `stop` methods as VideoGear so CameraSource can
+    use it in its place
+    """
+
+    def __init__(
+        self,
+        stream_url: str,
+        hls_directory: str | None = None,
+        segment_directory: str | None = None,
+        low_latency: bool = False,
+        hls_segment_duration: float | None = None,
+        frame_size: Tuple[int, int] = config.FRAME_SIZE,
+        read_timeout: float = config.CAMERA_READ_TIMEOUT,
+        segment_seconds: int = config.SEGMENT_SECONDS,
+        input_args: Optional[List[str]] = None,
+    ):
+        self.stream_url = stream_url
+        self.hls_directory = hls_directory
+        self.segment_directory = segment_directory
+        self.low_latency = low_latency
+        self.hls_segment_duration = hls_segment_duration
+        self.frame_size = frame_size
+        self.read_timeout = read_timeout
+        self.segment_seconds = segment_seconds
+        if input_args is None:
+            input_args = []
+            if stream_url.startswith("rtsp"):
+                input_args = get_rtsp_input_args(
+                    read_timeout, get_ffmpeg_major_version()
+                )
+        self.input_args = input_args
+
+        self._process: subprocess.Popen | None = None
+        self._frames: queue.Queue[np.ndarray | None] = queue.Queue(maxsize=2)
+        self._reader_thread: Thread | None = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def get_args(self) -> List[str]:
+        """
+        Returns the ffmpeg command line of the ingest process
+        """
+        args = [shutil.which("ffmpeg"), *self.input_args, "-i", self.stream_url]
+
+        if self.hls_directory is not None:
+            args += [
+                "-map",
+                "0:v:0",
+                "-c:v",
+                "copy",
+                "-an",
+                *get_hls_args(
+                    f"{self.hls_directory}/index.m3u8",
+                    self.hls_segment_duration,
+                    self.low_latency,
+                ),
+            ]
+
+        if self.segment_directory is not None:
+            args += [
+                "-map",
+                "0:v:0",
+                "-c:v",
+                "copy",
+                "-an",
+                "-f",
+                "segment",
+                "-segment_time",
+                str(self.segment_seconds),
+                "-segment_format",
+                "matroska",
+                "-reset_timestamps",
+                "1",
+                "-strftime",
+                "1",
+                f"{self.segment_directory}/{SEGMENT_NAME_FORMAT}.mkv",
+            ]
+
+        width, height = self.frame_size
+        args += [
+            "-map",
+            "0:v:0",
+            "-an",
+            "-vf",
+            f"scale={width}:{height}",
+            "-pix_fmt",
+            "bgr24",
+            "-f",
+            "rawvideo",
+            "pipe:1",
+        ]
+        return args
+
+    def start(self) -> StreamIngest:
+        """
+        Starts the ingest process.
+        Raises a RuntimeError if ffmpeg is not installed
+        """
+        if not shutil.which("ffmpeg"):
+            raise RuntimeError("ERROR: Please install ffmpeg/ffprobe.")
+
+        for directory in (self.hls_directory, self.segment_directory):
+            if directory is None:
+                continue
+            if os.path.exists(directory):
+                # Leftovers of a previous connection
+                for file in os.listdir(directory):
+                    os.remove(f"{directory}/{file}")
+            else:
+                os.makedirs(directory)
+
+        self._process = subprocess.Popen(
+            self.get_args(),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self._reader_thread = Thread(
+            target=self._read_frames, args=(self._process,), daemon=True
+        )
+        self._reader_thread.start()
+        return self
+
+    def read(self) -> np.ndarray | None:
+        """
+        Blocks until the next frame is decoded. Returns None once the stream has
+        ended and raises queue.Empty if no frame arrives within `read_timeout`
+        """
+        return self._frames.get(timeout=self.read_timeout)
+
+    def stop(self) -> None:
+        """
+        Stops the ingest process
+        """
+        process, self._process = self._process, None
+        if process is None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if self._reader_thread is not None:
+            self._reader_thread.join(timeout=5)
+
+    def _read_frames(self, process: subprocess.Popen) -> None:
+        """
+        Reads decoded frames from the pipe of the ingest process.
+        If detection falls behind the oldest frame is dropped
+        """
+        width, height = self.frame_size
+        frame_bytes = width * height * 3
+        while True:
+            data = process.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+            self._put(frame)
+
+        process.stdout.close()
+        # Tell the reader that the stream has ended
+        self._put(None)
+
+    def _put(self, frame: np.ndarray | None) -> None:
+
+        while True:
+            try:
+                self._frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self._frames.get_nowait()
+                except queue.Empty:
+                    pass
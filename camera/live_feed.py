@@ -3,11 +3,14 @@ from __future__ import annotations
 import os
 import shutil
 import subprocess
+from typing import Dict, Tuple
 
 import config
 
+from camera import metrics
 from camera.camera import CameraSource
 from camera.detection import DetectionSource
+from camera.ingest import get_hls_args
 
 
 class LiveFeed:
@@ -19,18 +22,47 @@ class LiveFeed:
         self.source = source
         self.stream_directory = f"{config.STREAM_DIRECTORY}/{source.name}"
         self._stream_process: subprocess.Popen | None = None
-        self._make_dir()
+        if self._get_ingest_directory() is None:
+            self._make_dir()
+        metrics.FFMPEG_UP.add_callback(self, LiveFeed._get_ffmpeg_metrics)
 
     def is_streaming(self) -> bool:
+        if self._get_ingest_directory() is not None:
+            return True
         if self._stream_process is None or self._stream_process.poll() is not None:
             return False
         return True
 
+    def _get_ffmpeg_metrics(self) -> Dict[Tuple[str, ...], float]:
+        """
+        Reports whether the process streaming the live feed is running, if the
+        live feed has a process of its own
+        """
+        if self._stream_process is None:
+            return {}
+        return {(self.source.name, "live_feed"): float(self.is_streaming())}
+
+    def _get_ingest_directory(self) -> str | None:
+        """
+        Returns the directory of the HLS playlist written by the connection of
+        the camera, if it writes one. In that case no extra connection is needed
+        """
+        camera = self._get_camera()
+        if isinstance(camera, CameraSource):
+            return camera.hls_directory
+        return None
+
+    def _get_camera(self) -> CameraSource:
+        if isinstance(self.source, DetectionSource):
+            return self.source.source
+        return self.source
+
     def start_streaming(self) -> None:
         """
         Starts streaming the live feed of a camera source
         """
         rtsp_link = self.source.get_rtsp_link()
+        camera = self._get_camera()
         stream_args = [
             shutil.which("ffmpeg"),
             "-i",
@@ -40,15 +72,11 @@ class LiveFeed:
             "-an",
             "-sc_threshold",
             "0",
-            "-f",
-            "hls",
-            "-hls_time",
-            "10",
-            "-hls_list_size",
-            "10",
-            "-hls_flags",
-            "delete_segments",
-            f"{self.stream_directory}/index.m3u8",
+            *get_hls_args(
+                f"{self.stream_directory}/index.m3u8",
+                camera.hls_segment_duration,
+                camera.low_latency,
+            ),
         ]
 
         self._stream_process = subprocess.Popen(
@@ -61,6 +89,10 @@ class LiveFeed:
         """
         Starts the live feed
         """
+        ingest_directory = self._get_ingest_directory()
+        if ingest_directory is not None:
+            return f"/media/stream/{os.path.basename(ingest_directory)}/index.m3u8"
+
         if self._stream_process is None:
             self.start_streaming()
         return f"/media/stream/{self.source.name}/index.m3u8"
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, Tuple
+from weakref import ReferenceType, ref
+
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# Label values of a single series, in the order of the label names of its metric
+LabelValues = Tuple[str, ...]
+
+# Buckets (in seconds) of histograms timing a stage of the pipeline
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+# Buckets (in seconds) of slower operations such as SSD forward passes
+SLOW_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Metrics of the pipeline, rendered by prometheus_client.generate_latest
+REGISTRY = CollectorRegistry()
+
+
+class CallbackGauge(Collector):
+    """
+    Gauge whose values are reported by callbacks, which are only called when
+    the metrics are scraped. Used for values that are cheap to read but change
+    all the time, such as the depth of a queue
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Tuple[str, ...] = (),
+        registry: CollectorRegistry | None = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        # Callbacks by the id of their owner. Owners such as CameraSource define
+        # __eq__ without being hashable, so they can't be used as keys
+        self._callbacks: Dict[
+            int, Tuple[ReferenceType, Callable[[Any], Dict[LabelValues, float]]]
+        ] = {}
+        self._lock = Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def add_callback(
+        self, owner: Any, callback: Callable[[Any], Dict[LabelValues, float]]
+    ) -> None:
+        """
+        Reports the values returned by `callback(owner)` every time the metrics
+        are scraped, as long as `owner` exists. The callback is given the
+        owner instead of keeping a reference to it, so that it can be collected
+        """
+        key = id(owner)
+        with self._lock:
+            self._callbacks[key] = (
+                ref(owner, lambda owner_ref: self._remove_callback(key, owner_ref)),
+                callback,
+            )
+
+    def remove_callback(self, owner: Any) -> None:
+        self._remove_callback(id(owner))
+
+    def _remove_callback(self, key: int, owner_ref: ReferenceType = None) -> None:
+        with self._lock:
+            entry = self._callbacks.get(key)
+            # The id of a collected owner may have been reused by a new owner
+            if entry is not None and owner_ref in (None, entry[0]):
+                del self._callbacks[key]
+
+    def describe(self) -> Iterator[GaugeMetricFamily]:
+        yield GaugeMetricFamily(self.name, self.documentation, labels=self.label_names)
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        family = GaugeMetricFamily(
+            self.name, self.documentation, labels=self.label_names
+        )
+        with self._lock:
+            callbacks = list(self._callbacks.values())
+        for owner_ref, callback in callbacks:
+            owner = owner_ref()
+            if owner is None:
+                continue
+            try:
+                values = callback(owner)
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"ERROR: Could not collect {self.name}: {err}")
+                continue
+            for label_values, value in values.items():
+                family.add_metric(list(label_values), value)
+        yield family
+
+
+def remove_camera(name: str) -> None:
+    """
+    Drops the series of a camera from every metric, e.g. once the camera
+    has been removed or renamed
+    """
+    for metric in CAMERA_METRICS:
+        # Samples list their labels in the order of the label names of their
+        # metric, histogram buckets add "le" at the end
+        series = {
+            tuple(value for label, value in sample.labels.items() if label != "le")
+            for family in metric.collect()
+            for sample in family.samples
+            if sample.labels.get("camera") == name
+        }
+        for label_values in series:
+            metric.remove(*label_values)
+
+
+# Capture
+FRAMES_CAPTURED = Counter(
+    "opensec_frames_captured_total",
+    "Frames decoded from each camera",
+    ("camera",),
+    registry=REGISTRY,
+)
+CAMERA_STALLS = Counter(
+    "opensec_camera_stalls_total",
+    "Times a camera sent no frame within CAMERA_READ_TIMEOUT",
+    ("camera",),
+    registry=REGISTRY,
+)
+CAMERA_DISCONNECTS = Counter(
+    "opensec_camera_disconnects_total",
+    "Times the stream of a camera ended or stalled",
+    ("camera",),
+    registry=REGISTRY,
+)
+CAMERA_CONNECTS = Counter(
+    "opensec_camera_connection_attempts_total",
+    "Connection and reconnection attempts by result",
+    ("camera", "result"),
+    registry=REGISTRY,
+)
+CAMERA_CONNECTED = CallbackGauge(
+    "opensec_camera_connected", "Whether the stream of a camera is open", ("camera",)
+)
+FFMPEG_UP = CallbackGauge(
+    "opensec_ffmpeg_up",
+    "Whether an ffmpeg process of a camera is running, by what it is used for",
+    ("camera", "role"),
+)
+
+# Detection
+FRAMES_PROCESSED = Counter(
+    "opensec_frames_processed_total",
+    "Frames motion detection was run on",
+    ("camera",),
+    registry=REGISTRY,
+)
+FRAMES_DROPPED = Counter(
+    "opensec_frames_dropped_total",
+    "Frames replaced by newer ones before detection read them",
+    ("camera",),
+    registry=REGISTRY,
+)
+FRAMES_STALE = Counter(
+    "opensec_frames_stale_total",
+    "Frames older than STALE_FRAME_SECONDS when detection read them",
+    ("camera",),
+    registry=REGISTRY,
+)
+FRAME_AGE = Histogram(
+    "opensec_frame_age_seconds",
+    "Time from a frame being captured to detection reading it",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    registry=REGISTRY,
+)
+STAGE_SECONDS = Histogram(
+    "opensec_stage_seconds",
+    "Time spent on each stage of the pipeline, per frame or per recording",
+    ("stage",),
+    buckets=STAGE_BUCKETS,
+    registry=REGISTRY,
+)
+MOTION_EVENTS = Counter(
+    "opensec_motion_events_total",
+    "Recordings started because motion was confirmed",
+    ("camera",),
+    registry=REGISTRY,
+)
+
+# Recording and analysis
+RECORDINGS_SAVED = Counter(
+    "opensec_recordings_saved_total",
+    "Intruder recordings saved",
+    ("camera",),
+    registry=REGISTRY,
+)
+RECORDER_FRAMES = CallbackGauge(
+    "opensec_recorder_frames",
+    "Frames kept by the ongoing recording of each camera",
+    ("camera",),
+)
+ANALYSIS_QUEUE_DEPTH = CallbackGauge(
+    "opensec_analysis_queue_depth", "Recordings waiting to be analyzed"
+)
+ANALYSIS_JOBS = Counter(
+    "opensec_analysis_jobs_total",
+    "Analysis jobs by result",
+    ("result",),
+    registry=REGISTRY,
+)
+ANALYSIS_LATENCY = Histogram(
+    "opensec_analysis_latency_seconds",
+    "Time from a recording being saved to its labels being ready",
+    buckets=SLOW_BUCKETS,
+    registry=REGISTRY,
+)
+SSD_SECONDS = Histogram(
+    "opensec_ssd_forward_seconds",
+    "Duration of each forward pass of the object detector",
+    buckets=SLOW_BUCKETS,
+    registry=REGISTRY,
+)
+SSD_IMAGES = Counter(
+    "opensec_ssd_images_total",
+    "Frames and crops analyzed by the object detector",
+    registry=REGISTRY,
+)
+
+# Metrics with a camera label, whose series are dropped by `remove_camera`.
+# Gauges reported by callbacks drop a camera once their owner stops reporting it
+CAMERA_METRICS = (
+    FRAMES_CAPTURED,
+    CAMERA_STALLS,
+    CAMERA_DISCONNECTS,
+    CAMERA_CONNECTS,
+    FRAMES_PROCESSED,
+    FRAMES_DROPPED,
+    FRAMES_STALE,
+    MOTION_EVENTS,
+    RECORDINGS_SAVED,
+)
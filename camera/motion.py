@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+from typing import Dict, List, NamedTuple, Tuple
+
+import config
+import cv2 as cv
+import numpy as np
+
+from .zones import DetectionZones
+
+NOISE_KERNEL = cv.getStructuringElement(cv.MORPH_ELLIPSE, (3, 3))
+
+
+class MotionBlobs:
+    """
+    Table of the moving objects found in a foreground mask, largest first.
+    `areas` holds the number of pixels of each blob, `boxes` their bounding
+    boxes (x, y, width, height) and `centroids` their centers (x, y)
+    """
+
+    def __init__(
+        self,
+        areas: np.ndarray | None = None,
+        boxes: np.ndarray | None = None,
+        centroids: np.ndarray | None = None,
+    ):
+        self.areas = np.empty(0, np.int32) if areas is None else areas
+        self.boxes = np.empty((0, 4), np.int32) if boxes is None else boxes
+        self.centroids = (
+            np.empty((0, 2), np.float64) if centroids is None else centroids
+        )
+
+    def __len__(self) -> int:
+        return len(self.areas)
+
+    def scaled(self, scale: Tuple[float, float]) -> MotionBlobs:
+        """
+        Returns the blobs in coordinates scaled by `scale` (x, y)
+        """
+        if scale == (1.0, 1.0) or not len(self):
+            return self
+        scale_x, scale_y = scale
+        box_scale = np.array([scale_x, scale_y, scale_x, scale_y])
+        return MotionBlobs(
+            np.rint(self.areas * (scale_x * scale_y)).astype(np.int32),
+            np.rint(self.boxes * box_scale).astype(np.int32),
+            self.centroids * np.array([scale_x, scale_y]),
+        )
+
+    def box_list(self) -> List[Tuple[int, int, int, int]]:
+        return [tuple(box) for box in self.boxes.tolist()]
+
+
+def find_blobs(foreground_mask: np.ndarray, min_area: float) -> MotionBlobs:
+    """
+    Finds the connected areas of a foreground mask that cover at least
+    `min_area` pixels. The statistics of every area come out of a single
+    OpenCV call and are filtered without looping in Python
+    """
+    if not cv.countNonZero(foreground_mask):
+        return MotionBlobs()
+
+    _, _, stats, centroids = cv.connectedComponentsWithStats(
+        foreground_mask, connectivity=8, ltype=cv.CV_32S
+    )
+    # The first component is the background
+    areas = stats[1:, cv.CC_STAT_AREA]
+    keep = np.flatnonzero(areas >= min_area)
+    keep = keep[np.argsort(-areas[keep], kind="stable")]
+    return MotionBlobs(
+        areas[keep],
+        stats[1:, : cv.CC_STAT_AREA][keep],
+        centroids[1:][keep],
+    )
+
+
+class MotionState(NamedTuple):
+    """
+    Result of the last batch for a single camera
+    """
+
+    # Motion frame the mask was computed from
+    frame: np.ndarray
+    # Fraction of the frame that differs from the background, inside of the
+    # detection zones
+    motion_fraction: float
+    # Denoised foreground mask, all zeros if the camera was gated out
+    mask: np.ndarray
+
+
+class BatchedMotionEngine:
+    """
+    Motion detection backend that processes the frames of every camera at once.
+    The grayscale motion frames of all cameras are stacked into one array and
+    compared with a running average background model in a few vectorized
+    operations per tick. Motion outside of the detection zones of a camera is
+    dropped first, and only the cameras whose motion fraction then reaches
+    `gate_threshold` get a denoised mask, so contours are only searched for
+    where something moves. All frames must have the same size
+    """
+
+    def __init__(
+        self,
+        learning_rate: float = config.MOTION_LEARNING_RATE,
+        diff_threshold: int = config.MOTION_DIFF_THRESHOLD,
+        gate_threshold: float = config.MOTION_GATE_THRESHOLD,
+    ):
+        self.learning_rate = learning_rate
+        self.diff_threshold = diff_threshold
+        self.gate_threshold = gate_threshold
+
+        self._names: List[str] = []
+        # Background model of every camera, one row per name in _names
+        self._background: np.ndarray | None = None
+        self._states: Dict[str, MotionState] = {}
+        self._empty_mask: np.ndarray | None = None
+
+    @property
+    def sources(self) -> List[str]:
+        return list(self._names)
+
+    def remove_source(self, name: str) -> None:
+        """
+        Forgets the background model of a camera
+        """
+        if name not in self._names:
+            return
+        row = self._names.index(name)
+        self._names.pop(row)
+        self._background = np.delete(self._background, row, axis=0)
+        self._states.pop(name, None)
+
+    def rename_source(self, name: str, new_name: str) -> None:
+        if name in self._names:
+            self._names[self._names.index(name)] = new_name
+        if name in self._states:
+            self._states[new_name] = self._states.pop(name)
+
+    def process(
+        self,
+        frames: Dict[str, np.ndarray],
+        zones: Dict[str, DetectionZones] | None = None,
+    ) -> Dict[str, float]:
+        """
+        Updates the background models with the grayscale motion frame of each
+        camera and returns the motion fraction of each camera, counting only
+        the motion inside its detection `zones`.
+        Cameras that are seen for the first time start with their frame as
+        background
+        """
+        if not frames:
+            return {}
+
+        names = list(frames)
+        for name in names:
+            if name not in self._names:
+                self._add_source(name, frames[name].astype(np.float32))
+            elif frames[name].shape != self._background.shape[1:]:
+                raise ValueError(
+                    f"ERROR: Motion frames of {name} must be "
+                    f"{self._background.shape[1:]}"
+                )
+        stacked = np.stack([frames[name] for name in names])
+        rows = [self._names.index(name) for name in names]
+        # Usually every camera is in the batch, in order, and the background
+        # can be updated in place
+        in_order = rows == list(range(len(self._names)))
+        background = self._background if in_order else self._background[rows]
+
+        # The stacks are viewed as one tall image so that each step is a
+        # single OpenCV call over every camera
+        num_frames, height, width = stacked.shape
+        frames_2d = stacked.reshape(num_frames * height, width)
+        background_2d = background.reshape(num_frames * height, width)
+        difference = cv.absdiff(frames_2d, cv.convertScaleAbs(background_2d))
+        foreground = cv.threshold(
+            difference, self.diff_threshold, 255, cv.THRESH_BINARY
+        )[1].reshape(num_frames, height, width)
+        cv.accumulateWeighted(frames_2d, background_2d, self.learning_rate)
+        if not in_order:
+            self._background[rows] = background
+
+        # Motion outside of the zones doesn't count towards the gate
+        zone_masks: List[np.ndarray | None] = []
+        for index, name in enumerate(names):
+            camera_zones = zones.get(name) if zones else None
+            zone_mask = camera_zones.get_mask((width, height)) if camera_zones else None
+            if zone_mask is not None:
+                np.bitwise_and(foreground[index], zone_mask, out=foreground[index])
+            zone_masks.append(zone_mask)
+
+        motion_fractions = np.count_nonzero(
+            foreground.reshape(num_frames, -1), axis=1
+        ) / (height * width)
+
+        for index, name in enumerate(names):
+            motion_fraction = float(motion_fractions[index])
+            if motion_fraction >= self.gate_threshold:
+                mask = self._clean_mask(foreground[index])
+                if zone_masks[index] is not None:
+                    # Dilating the mask grows it past the edges of the zones
+                    mask = cv.bitwise_and(mask, zone_masks[index])
+            else:
+                mask = self._get_empty_mask(foreground.shape[1:])
+            self._states[name] = MotionState(frames[name], motion_fraction, mask)
+        return dict(zip(names, motion_fractions.tolist()))
+
+    def has_motion(self, name: str) -> bool:
+        """
+        Returns whether the motion fraction of a camera reached the gate
+        threshold in the last batch
+        """
+        state = self._states.get(name)
+        return state is not None and state.motion_fraction >= self.gate_threshold
+
+    def get_foreground_mask(
+        self, name: str, frame: np.ndarray, zones: DetectionZones | None = None
+    ) -> np.ndarray:
+        """
+        Returns the foreground mask of a camera for `frame`. Frames that were
+        not part of the last batch are processed in a batch of their own
+        """
+        state = self._states.get(name)
+        if state is None or state.frame is not frame:
+            self.process({name: frame}, {name: zones} if zones else None)
+            state = self._states[name]
+        return state.mask
+
+    def _add_source(self, name: str, frame: np.ndarray) -> None:
+
+        if self._background is None or not self._names:
+            self._background = frame[np.newaxis].copy()
+        elif frame.shape != self._background.shape[1:]:
+            raise ValueError(
+                f"ERROR: Motion frames of {name} must be {self._background.shape[1:]}"
+            )
+        else:
+            self._background = np.concatenate([self._background, frame[np.newaxis]])
+        self._names.append(name)
+
+    def _get_empty_mask(self, shape) -> np.ndarray:
+        """
+        Mask shared by every camera without motion. It must not be modified
+        """
+        if self._empty_mask is None or self._empty_mask.shape != shape:
+            self._empty_mask = np.zeros(shape, dtype=np.uint8)
+        return self._empty_mask
+
+    @staticmethod
+    def _clean_mask(foreground: np.ndarray) -> np.ndarray:
+
+        mask = cv.morphologyEx(foreground, cv.MORPH_OPEN, NOISE_KERNEL)
+        return cv.dilate(mask, None, iterations=2)
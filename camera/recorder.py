@@ -0,0 +1,405 @@
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+import config
+import cv2 as cv
+import numpy as np
+from vidgear.gears import WriteGear
+
+from . import CameraSource, metrics
+from .analysis import Box, IntruderAnalyzer, predict_labels, select_frame_indices
+from .frame_store import CompactFrameStore
+from .segment_recorder import SegmentRecorder
+from .tracing import TRACER
+
+if TYPE_CHECKING:
+    from .detection import DetectionSource
+
+
+class IntruderRecorder:
+    """
+    This class is used to record videos of detected intruders
+    """
+
+    num_frames_to_analyze = config.ANALYSIS_FRAMES_PER_EVENT
+
+    def __init__(
+        self,
+        detection_sources: List[DetectionSource],
+        recording_directory: str,
+        max_stored_frames: int = 80,
+        memory_budget: int = config.RECORDER_MEMORY_BUDGET,
+        recording_mode: str = config.RECORDING_MODE,
+    ):
+        if recording_mode not in ("encode", "copy"):
+            raise ValueError(f"ERROR: Unknown recording mode {recording_mode}")
+
+        self.sources = list(detection_sources)
+        self.recordings_directory = recording_directory
+        self.max_stored_frames = max_stored_frames
+        self.recording_mode = recording_mode
+
+        self._video_writers: Dict[str, WriteGear] = {}
+        # Used instead of a video writer for cameras in "copy" mode
+        self._segment_recorders: Dict[str, SegmentRecorder] = {}
+        # Clips that are still being cut, by the path they are written to
+        self._pending_clips: Dict[str, Future] = {}
+        self._start_times: Dict[str, str] = {}
+        # Wall clock time at which each recording started
+        self._start_clocks: Dict[str, float | None] = {}
+        # Frames kept for thumbnails and analysis
+        self._stored_frames = CompactFrameStore(memory_budget, max_stored_frames)
+        self._intruder_labels: Dict[str, List[str]] = {}
+        # Only loaded if the recorder analyzes recordings itself
+        self._analyzer: IntruderAnalyzer | None = None
+        self._is_analyzing = False
+        self._setup()
+        metrics.RECORDER_FRAMES.add_callback(self, IntruderRecorder._get_frame_metrics)
+        metrics.FFMPEG_UP.add_callback(self, IntruderRecorder._get_ffmpeg_metrics)
+
+    def get_labels(self) -> Dict[str, List[str]] | None:
+        if self._is_analyzing:
+            return None
+        return self._intruder_labels
+
+    def start(self) -> None:
+        """
+        Starts buffering the streams of cameras recorded in "copy" mode
+        """
+        for segment_recorder in self._segment_recorders.values():
+            segment_recorder.start()
+
+    def stop(self) -> None:
+        """
+        Stops buffering the streams of cameras once their clips have been saved
+        """
+        for segment_recorder in self._segment_recorders.values():
+            segment_recorder.stop()
+
+    def get_num_frames_recorded(self, source: DetectionSource) -> int:
+        return self._stored_frames.num_frames(source.name)
+
+    def is_recording(self, source: DetectionSource) -> bool:
+        """
+        Returns whether a recording of the source has been started
+        """
+        return self._start_times.get(source.name) is not None
+
+    def get_memory_usage(self) -> Dict[str, int]:
+        """
+        Returns the number of bytes used by the stored frames of each source
+        """
+        return self._stored_frames.get_memory_usage()
+
+    def _get_frame_metrics(self) -> Dict[Tuple[str, ...], float]:
+        return {
+            (name,): self._stored_frames.num_frames(name)
+            for name in list(self._start_times)
+        }
+
+    def _get_ffmpeg_metrics(self) -> Dict[Tuple[str, ...], float]:
+        """
+        Reports whether the processes buffering the streams of cameras in "copy"
+        mode are running. Segments written by the ingest process are reported
+        by the camera
+        """
+        return {
+            (name, "segments"): float(segment_recorder.is_recording())
+            for name, segment_recorder in list(self._segment_recorders.items())
+            if segment_recorder.stream_url is not None
+        }
+
+    def add_frame(
+        self,
+        frame: np.ndarray | None,
+        source: DetectionSource,
+        motion_energy: float = 0.0,
+        motion_boxes: Optional[List[Box]] = None,
+    ) -> None:
+        """
+        Adds a frame to be written to a video file.
+        `motion_energy` and `motion_boxes` are used to pick the frames that are
+        analyzed and the regions of them the analyzer looks at
+        """
+        if self._start_times[source.name] is None:
+            current_date_time = datetime.now().strftime("%Y_%m_%d %Hh %Mm %Ss")
+            self._start_times[source.name] = current_date_time
+            self._start_clocks[source.name] = time.time()
+
+        if frame is not None:
+            self._stored_frames.add(source.name, frame, motion_energy, motion_boxes)
+
+            writer = self._video_writers.get(source.name)
+            if writer is not None:
+                start = time.perf_counter()
+                with TRACER.span("write", source.name):
+                    writer.write(frame)
+                metrics.STAGE_SECONDS.labels("write").observe(
+                    time.perf_counter() - start
+                )
+
+    def save(self, source: DetectionSource, thumb: bool = True) -> List[str]:
+        """
+        Stops adding frames to video and writes it to the disk.
+        If `thumb` is True then a thumbnail is also produced from the recorded frames
+        Returns paths to the thumbnail and video
+        """
+        return self.save_all([source], thumb)[0]
+
+    def get_frames_to_analyze(
+        self, source: DetectionSource
+    ) -> Tuple[List[np.ndarray], List[List[Box]]]:
+        """
+        Returns a few representative frames of the recording of a source, ordered
+        from most to least motion, and the moving objects in each of them.
+        These are used to classify the intruder
+        """
+        stored_frames = self._stored_frames.get_frames(source.name)
+        motion_boxes = stored_frames.motion_boxes
+        indices = select_frame_indices(
+            stored_frames, stored_frames.motion_energy, self.num_frames_to_analyze
+        )
+        return (
+            [stored_frames[index] for index in indices],
+            [motion_boxes[index] for index in indices],
+        )
+
+    def save_all(
+        self, sources: List[DetectionSource], thumb: bool = True, analyze: bool = True
+    ) -> List[List[str]]:
+        """
+        Saves the recordings of several sources at once.
+        If `analyze` is True the stored frames of every source are analyzed
+        together so that events that end at the same time share SSD forward passes.
+        Returns the paths to the video and thumbnail of each source
+        """
+        start = time.perf_counter()
+        all_paths: List[List[str]] = []
+        frames_to_analyze: Dict[str, List[np.ndarray]] = {}
+        regions_to_analyze: Dict[str, List[List[Box]]] = {}
+        for source in sources:
+            if source.name in self._segment_recorders:
+                video_path = self._save_clip(source)
+            else:
+                writer = self._video_writers[source.name]
+                writer.close()
+                video_path = self._rename_video(source)
+                if source.is_active:
+                    print("Creating video writer")
+                    self._video_writers[source.name] = self._make_video_writer(source)
+
+            paths = [video_path]
+            if thumb:
+                print("Creating thumbnail")
+                thumb_path = self._save_thumb(source)
+                paths.append(thumb_path)
+            all_paths.append(paths)
+
+            if analyze:
+                (
+                    frames_to_analyze[source.name],
+                    regions_to_analyze[source.name],
+                ) = self.get_frames_to_analyze(source)
+
+        if analyze:
+            self._analyze_intruders(frames_to_analyze, regions_to_analyze)
+        for source in sources:
+            self._start_times[source.name] = None
+            self._start_clocks[source.name] = None
+            self._stored_frames.clear(source.name)
+            metrics.RECORDINGS_SAVED.labels(source.name).inc()
+        metrics.STAGE_SECONDS.labels("save").observe(time.perf_counter() - start)
+        return all_paths
+
+    def _save_clip(self, source: DetectionSource) -> str:
+        """
+        Cuts the clip of a recording out of the buffered stream of a camera.
+        The clip is written in the background once the stream has been buffered
+        up to now. Returns the path the clip will be written to
+        """
+
+        video_path = (
+            f"{self.recordings_directory}/videos/{source.name}/"
+            f"{self._start_times[source.name]}.mp4"
+        )
+        end = time.time()
+        start = self._start_clocks[source.name] or end
+        # Include the frames of the pre-roll
+        start -= config.PRE_ROLL_SECONDS
+        future = self._segment_recorders[source.name].save_clip(start, end, video_path)
+        self._pending_clips[video_path] = future
+        future.add_done_callback(lambda _: self._pending_clips.pop(video_path, None))
+        return video_path
+
+    def when_saved(
+        self, video_path: str | None, callback: Callable[[str | None], None]
+    ) -> None:
+        """
+        Calls `callback` with the path of a video once it has been written to
+        disk, or with None if it could not be saved. Clips that are still being
+        cut call it from the thread that cuts them
+        """
+        future = self._pending_clips.get(video_path)
+        if future is not None:
+            future.add_done_callback(lambda done: callback(done.result()))
+        elif video_path is not None and os.path.exists(video_path):
+            callback(video_path)
+        else:
+            callback(None)
+
+    def _rename_video(self, source: DetectionSource) -> str:
+        """
+        Renames a video from the default `intruder.mp4` to a name containing
+        the time the intruder was detected.
+        Returns the new name of the video
+        """
+
+        videos_directory = f"{self.recordings_directory}/videos"
+        base_name = f"{videos_directory}/{source.name}"
+        old_file_path = f"{base_name}/intruder.mp4"
+        new_file_path = f"{base_name}/{self._start_times[source.name]}.mp4"
+
+        rename_tries = 0
+        while not os.path.exists(old_file_path):
+            if rename_tries == 3:
+                return None
+            time.sleep(2)
+            rename_tries += 1
+        os.rename(old_file_path, new_file_path)
+        return new_file_path
+
+    def _save_thumb(self, source: DetectionSource) -> str | None:
+        """
+        Creates a thumbnail from the recorded frames and saves it to disk
+        """
+
+        thumbnails_directory = f"{self.recordings_directory}/thumbnails"
+        base_dir = f"{thumbnails_directory}/{source.name}"
+        thumb_name = self._start_times[source.name]
+        thumb_path = f"{base_dir}/{thumb_name}.jpg"
+        stored_frames = self._stored_frames.get_frames(source.name)
+        if len(stored_frames) != 0:
+            thumb_frame = stored_frames[len(stored_frames) // 2]
+            if thumb_frame is not None:
+                cv.imwrite(thumb_path, thumb_frame)
+                return thumb_path
+        return None
+
+    def add_source(self, source: DetectionSource) -> None:
+        """
+        Starts recording a new source without affecting the other sources
+        """
+        self.sources.append(source)
+        self._make_paths()
+        self._setup_source(source)
+
+    def remove_source(self, source: DetectionSource) -> None:
+        """
+        Stops recording a source. Frames that have not been saved are discarded
+        """
+        if source in self.sources:
+            self.sources.remove(source)
+
+        segment_recorder = self._segment_recorders.pop(source.name, None)
+        if segment_recorder is not None:
+            segment_recorder.stop()
+
+        writer = self._video_writers.pop(source.name, None)
+        if writer is not None:
+            writer.close()
+            unsaved_video = (
+                f"{self.recordings_directory}/videos/{source.name}/intruder.mp4"
+            )
+            if os.path.exists(unsaved_video):
+                os.remove(unsaved_video)
+
+        self._start_times.pop(source.name, None)
+        self._start_clocks.pop(source.name, None)
+        self._stored_frames.remove(source.name)
+        self._intruder_labels.pop(source.name, None)
+
+    def _setup(self) -> None:
+        """
+        Sets up the video writers and creates directories for each
+        source to store recorded videos
+        """
+
+        self._make_paths()
+        for source in self.sources:
+            self._setup_source(source)
+
+    def _setup_source(self, source: DetectionSource) -> None:
+        """
+        Creates the video writer of a source and resets its recording state.
+        In "copy" mode cameras buffer their stream instead, other sources such as
+        videos are always re-encoded
+        """
+        if self.recording_mode == "copy" and isinstance(source.source, CameraSource):
+            segment_directory = source.source.segment_directory
+            if segment_directory is not None:
+                # The connection of the camera already writes the segments
+                segment_recorder = SegmentRecorder(None, segment_directory)
+            else:
+                segment_recorder = SegmentRecorder(
+                    source.get_rtsp_link(),
+                    f"{self.recordings_directory}/segments/{source.name}",
+                )
+            self._segment_recorders[source.name] = segment_recorder.start()
+        else:
+            self._video_writers[source.name] = self._make_video_writer(source)
+        self._start_times[source.name] = None
+        self._start_clocks[source.name] = None
+        self._stored_frames.clear(source.name)
+
+    def _make_video_writer(self, source: DetectionSource) -> WriteGear:
+        """
+        Used by _setup_source() to create video writers
+        """
+        output_params = {"-input_framerate": config.FPS}
+        return WriteGear(
+            f"{self.recordings_directory}/videos/{source.name}/intruder.mp4",
+            **output_params,
+        )
+
+    def _make_paths(self) -> None:
+        """
+        Used by _setup() to make directories to store videos
+        """
+        if not os.path.exists(self.recordings_directory):
+            os.mkdir(self.recordings_directory)
+
+        directories = [
+            f"{self.recordings_directory}/videos",
+            f"{self.recordings_directory}/thumbnails",
+        ]
+        for directory in directories:
+            if not os.path.exists(directory):
+                os.mkdir(directory)
+
+            for source in self.sources:
+                if source is not None and not os.path.exists(
+                    f"{directory}/{source.name}"
+                ):
+                    os.mkdir(f"{directory}/{source.name}")
+
+    def _analyze_intruders(
+        self,
+        frames: Dict[str, List[np.ndarray]],
+        regions: Optional[Dict[str, List[List[Box]]]] = None,
+    ) -> None:
+        """
+        Uses the IntruderAnalyzer class to get predictions on what the type of
+        the intruder is. `frames` maps source names to the frames to analyze
+        and `regions` to the moving objects in them
+        """
+        self._is_analyzing = True
+        if self._analyzer is None:
+            self._analyzer = IntruderAnalyzer()
+        predictions = predict_labels(self._analyzer, frames, regions)
+        self._intruder_labels.update(predictions)
+        self._is_analyzing = False
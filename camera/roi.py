@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+from typing import List, Tuple
+
+import numpy as np
+
+# Bounding box (x, y, width, height) of a moving object
+Box = Tuple[int, int, int, int]
+# Crop (x1, y1, x2, y2) of a frame
+Region = Tuple[int, int, int, int]
+
+
+def get_regions_of_interest(
+    boxes: List[Box],
+    frame_shape: Tuple[int, ...],
+    padding: float,
+    min_size: int,
+    max_coverage: float,
+) -> List[Region]:
+    """
+    Turns the bounding boxes of moving objects into square crops of a frame,
+    padded by `padding` times their size on every side and at least `min_size`
+    pixels wide. Overlapping crops are merged. The whole frame is returned if
+    there are no boxes or the crops would cover more than `max_coverage` of it
+    """
+
+    height, width = frame_shape[:2]
+    whole_frame = [(0, 0, width, height)]
+    if not boxes:
+        return whole_frame
+
+    crops: List[List[int]] = []
+    for x_coord, y_coord, box_width, box_height in boxes:
+        size = max(box_width, box_height) * (1 + 2 * padding)
+        size = int(min(max(size, min_size), width, height))
+        center_x = x_coord + box_width // 2
+        center_y = y_coord + box_height // 2
+        # Keep the crop square and shift it inside the frame
+        x1 = min(max(center_x - size // 2, 0), width - size)
+        y1 = min(max(center_y - size // 2, 0), height - size)
+        crops.append([x1, y1, x1 + size, y1 + size])
+
+    merged = True
+    while merged:
+        merged = False
+        for i, crop in enumerate(crops):
+            for other in crops[i + 1 :]:
+                if (
+                    crop[0] < other[2]
+                    and other[0] < crop[2]
+                    and crop[1] < other[3]
+                    and other[1] < crop[3]
+                ):
+                    crop[:] = [
+                        min(crop[0], other[0]),
+                        min(crop[1], other[1]),
+                        max(crop[2], other[2]),
+                        max(crop[3], other[3]),
+                    ]
+                    crops.remove(other)
+                    merged = True
+                    break
+            if merged:
+                break
+
+    area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in crops)
+    if area > max_coverage * width * height:
+        return whole_frame
+    return [tuple(crop) for crop in crops]
+
+
+def crop_regions(
+    frames: List[np.ndarray],
+    regions: List[List[Box]],
+    padding: float,
+    min_size: int,
+    max_coverage: float,
+) -> Tuple[List[np.ndarray], List[Tuple[int, int]], np.ndarray]:
+    """
+    Cuts the regions of interest around the moving objects `regions` out of
+    each frame, so that the crops of every frame can be analyzed in one batch.
+    Returns the crops, the top left corner of each crop in its frame and the
+    index of the frame each crop was cut from. Every frame has at least one crop
+    """
+
+    crops: List[np.ndarray] = []
+    crop_origins: List[Tuple[int, int]] = []
+    crop_frame_ids: List[int] = []
+    for frame_id, (frame, boxes) in enumerate(zip(frames, regions)):
+        for x1, y1, x2, y2 in get_regions_of_interest(
+            boxes, frame.shape, padding, min_size, max_coverage
+        ):
+            crops.append(frame[y1:y2, x1:x2])
+            crop_origins.append((x1, y1))
+            crop_frame_ids.append(frame_id)
+    return crops, crop_origins, np.array(crop_frame_ids, dtype=np.intp)
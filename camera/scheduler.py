@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import time
+from collections import deque
+from typing import Deque, Dict
+
+import config
+
+
+class DetectionScheduler:
+    """
+    Gives each camera its own detection rate.
+    Idle cameras only get a frame processed every 1 / `idle_fps` seconds.
+    A camera runs at the full rate of its stream from the moment motion is
+    seen until `cooldown` seconds after the last motion
+    """
+
+    def __init__(
+        self,
+        idle_fps: float = config.IDLE_DETECTION_FPS,
+        cooldown: float = config.DETECTION_COOLDOWN,
+        rate_window: float = 5.0,
+    ):
+        self.idle_fps = idle_fps
+        self.cooldown = cooldown
+        self.rate_window = rate_window
+
+        # Time from which the next frame of an idle camera is processed
+        self._next_due: Dict[str, float] = {}
+        self._active_until: Dict[str, float] = {}
+        # Times at which frames were processed, over the last `rate_window`
+        self._processed: Dict[str, Deque[float]] = {}
+
+    def is_active(self, name: str, now: float | None = None) -> bool:
+        """
+        Returns whether a camera runs at full rate
+        """
+        if now is None:
+            now = time.monotonic()
+        return now < self._active_until.get(name, 0.0)
+
+    def should_process(self, name: str, now: float | None = None) -> bool:
+        """
+        Returns whether the new frame of a camera should be processed
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.idle_fps <= 0 or self.is_active(name, now):
+            return True
+        return now >= self._next_due.get(name, now)
+
+    def mark_processed(self, name: str, now: float | None = None) -> None:
+        """
+        Records that a frame of a camera was processed
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.idle_fps > 0:
+            # Deadlines are spaced evenly so that frames arriving a little late
+            # don't lower the rate, without bursts to catch up
+            period = 1 / self.idle_fps
+            self._next_due[name] = max(self._next_due.get(name, now), now - period)
+            self._next_due[name] += period
+        processed = self._processed.setdefault(name, deque())
+        processed.append(now)
+        while processed[0] < now - self.rate_window:
+            processed.popleft()
+
+    def update_activity(
+        self, name: str, motion: bool, now: float | None = None
+    ) -> None:
+        """
+        Moves a camera to full rate if there is motion. It drops back to the
+        idle rate once there has been no motion for `cooldown` seconds
+        """
+        if not motion:
+            return
+        if now is None:
+            now = time.monotonic()
+        self._active_until[name] = now + self.cooldown
+
+    def get_rates(self, now: float | None = None) -> Dict[str, float]:
+        """
+        Returns the number of frames per second processed for each camera over
+        the last `rate_window` seconds
+        """
+        if now is None:
+            now = time.monotonic()
+        rates: Dict[str, float] = {}
+        for name, processed in self._processed.items():
+            recent = [t for t in processed if t >= now - self.rate_window]
+            if len(recent) < 2:
+                rates[name] = 0.0
+                continue
+            # Measured up to now so that the rate drops if frames stop coming
+            period = now - recent[0]
+            rates[name] = (len(recent) - 1) / period if period > 0 else 0.0
+        return rates
+
+    def remove_source(self, name: str) -> None:
+        self._next_due.pop(name, None)
+        self._active_until.pop(name, None)
+        self._processed.pop(name, None)
+
+    def rename_source(self, name: str, new_name: str) -> None:
+        for state in (self._next_due, self._active_until, self._processed):
+            if name in state:
+                state[new_name] = state.pop(name)
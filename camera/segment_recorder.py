@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from threading import Event, Lock, Thread
+from typing import List, Optional, Tuple
+
+import config
+
+# Segments are named after the wall clock time they start at
+SEGMENT_NAME_FORMAT = "%Y%m%d-%H%M%S"
+
+
+class SegmentRecorder:
+    """
+    Keeps a rolling buffer of the compressed video of a camera.
+    ffmpeg copies the stream of the camera into short segments without
+    decoding it, and clips are cut from these segments by joining them, again
+    without re-encoding. Since segments always start on a keyframe the clips do
+    as well. ffmpeg is restarted if it stops, e.g. when the camera disconnects.
+    If `stream_url` is None the segments are written by another process, such
+    as the StreamIngest of the camera, and are only pruned and cut from here
+    """
+
+    def __init__(
+        self,
+        stream_url: str | None,
+        directory: str,
+        segment_seconds: int = config.SEGMENT_SECONDS,
+        buffer_seconds: int = config.SEGMENT_BUFFER_SECONDS,
+        input_args: Optional[List[str]] = None,
+    ):
+        self.stream_url = stream_url
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.buffer_seconds = buffer_seconds
+        if input_args is None:
+            is_rtsp = stream_url is not None and stream_url.startswith("rtsp")
+            input_args = ["-rtsp_transport", "tcp"] if is_rtsp else []
+        self.input_args = input_args
+
+        self._process: subprocess.Popen | None = None
+        self._process_lock = Lock()
+        self._stopped = Event()
+        self._housekeeping_thread: Thread | None = None
+        self._clip_threads: List[Thread] = []
+
+    def is_recording(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self) -> SegmentRecorder:
+        """
+        Starts buffering the stream
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopped.clear()
+        self._start_process()
+        if (
+            self._housekeeping_thread is None
+            or not self._housekeeping_thread.is_alive()
+        ):
+            self._housekeeping_thread = Thread(target=self._housekeeping, daemon=True)
+            self._housekeeping_thread.start()
+        return self
+
+    def stop(self, delete_segments: bool = True) -> None:
+        """
+        Stops buffering the stream once the clips that are being saved are done
+        """
+        for thread in self._clip_threads:
+            thread.join()
+        self._clip_threads = []
+
+        self._stopped.set()
+        with self._process_lock:
+            if self._process is not None:
+                self._process.terminate()
+                try:
+                    self._process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+            self._process = None
+        # Segments written by another process are left to it
+        owns_segments = self.stream_url is not None
+        if delete_segments and owns_segments and os.path.exists(self.directory):
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def get_segments(self) -> List[Tuple[float, float | None, str]]:
+        """
+        Returns the (start time, end time, path) of every buffered segment,
+        oldest first. The newest segment is still being written, so it has no
+        end time
+        """
+        starts: List[Tuple[float, str]] = []
+        if not os.path.exists(self.directory):
+            return []
+        for file_name in os.listdir(self.directory):
+            name, extension = os.path.splitext(file_name)
+            if extension != ".mkv":
+                continue
+            try:
+                start = datetime.strptime(name, SEGMENT_NAME_FORMAT).timestamp()
+            except ValueError:
+                continue
+            starts.append((start, f"{self.directory}/{file_name}"))
+
+        starts.sort()
+        ends: List[float | None] = [start for start, _ in starts[1:]] + [None]
+        return [(start, end, path) for (start, path), end in zip(starts, ends)]
+
+    def cut_clip(self, start: float, end: float, output_path: str) -> str | None:
+        """
+        Joins the finished segments that overlap the time range [start, end]
+        into a clip. Returns the path to the clip, or None if there is no video
+        of that time
+        """
+        segments = [
+            path
+            for segment_start, segment_end, path in self.get_segments()
+            if segment_end is not None and segment_start < end and segment_end > start
+        ]
+        if not segments:
+            return None
+
+        list_path = f"{output_path}.txt"
+        with open(list_path, "w", encoding="utf-8") as segment_list:
+            for path in segments:
+                segment_list.write(f"file '{os.path.abspath(path)}'\n")
+
+        clip_args = [
+            shutil.which("ffmpeg"),
+            "-y",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_path,
+            "-c",
+            "copy",
+            "-movflags",
+            "+faststart",
+            output_path,
+        ]
+        try:
+            result = subprocess.run(
+                clip_args,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=False,
+            )
+        finally:
+            os.remove(list_path)
+
+        if result.returncode != 0:
+            print(f"ERROR: Could not cut clip {output_path}")
+            return None
+        return output_path
+
+    def save_clip(self, start: float, end: float, output_path: str) -> Future:
+        """
+        Cuts a clip in the background once the segment containing `end` has
+        been written. Returns a future of the path to the clip, which is None
+        if the clip could not be cut
+        """
+        future: Future = Future()
+        thread = Thread(
+            target=self._save_clip,
+            args=(start, end, output_path, future),
+            daemon=True,
+        )
+        thread.start()
+        self._clip_threads = [
+            clip_thread for clip_thread in self._clip_threads if clip_thread.is_alive()
+        ]
+        self._clip_threads.append(thread)
+        return future
+
+    def _save_clip(
+        self, start: float, end: float, output_path: str, future: Future
+    ) -> None:
+
+        deadline = time.time() + self.segment_seconds * 3 + 5
+        while time.time() < deadline:
+            segments = self.get_segments()
+            # A segment that starts after the clip means that the last segment
+            # of the clip is complete
+            if segments and segments[-1][0] > end:
+                break
+            time.sleep(0.5)
+        try:
+            future.set_result(self.cut_clip(start, end, output_path))
+        except Exception as err:  # pylint: disable=broad-except
+            print(f"ERROR: Could not cut clip {output_path}: {err}")
+            future.set_result(None)
+
+    def _start_process(self) -> None:
+
+        if self.stream_url is None:
+            return
+        segment_args = [
+            shutil.which("ffmpeg"),
+            *self.input_args,
+            "-i",
+            self.stream_url,
+            "-c:v",
+            "copy",
+            "-an",
+            "-f",
+            "segment",
+            "-segment_time",
+            str(self.segment_seconds),
+            "-segment_format",
+            "matroska",
+            "-reset_timestamps",
+            "1",
+            "-strftime",
+            "1",
+            f"{self.directory}/{SEGMENT_NAME_FORMAT}.mkv",
+        ]
+        with self._process_lock:
+            if self._stopped.is_set() or self.is_recording():
+                return
+            self._process = subprocess.Popen(
+                segment_args,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+
+    def _housekeeping(self) -> None:
+        """
+        Deletes segments that are older than the buffer and restarts ffmpeg
+        if it stopped
+        """
+        while not self._stopped.wait(timeout=self.segment_seconds):
+            oldest_kept = time.time() - self.buffer_seconds
+            for _, end, path in self.get_segments():
+                if end is not None and end < oldest_kept:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+            if self.stream_url is not None and not self.is_recording():
+                self._start_process()
@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import os
+import queue
+import random
+import shutil
+import subprocess
+import time
+from threading import Event, Thread
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import config
+import cv2 as cv
+import numpy as np
+
+from .camera import register_backend
+from .ingest import get_hls_args
+
+SCHEME = "sim"
+
+
+class SimulationSettings:
+    """
+    Behaviour of a simulated camera, given by the query of its URL:
+
+        sim://<name>?size=640x360&fps=15&motion=5/30&stall=60/3&disconnect=300&fail=0.2
+
+    - size, fps: resolution and frame rate of the stream
+    - motion=on/period: an object moves through the scene for `on` seconds
+      every `period` seconds. 0 disables motion
+    - stall=every/duration: the stream stops sending frames for `duration`
+      seconds every `every` seconds. Stalls longer than CAMERA_READ_TIMEOUT
+      disconnect the camera
+    - disconnect=seconds: the stream ends after this many seconds
+    - fail: probability that a connection attempt fails
+    - hls=1: encodes the frames into the HLS playlist of the live feed
+    - seed: shifts the motion schedule and picks the background
+    """
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        if parts.scheme != SCHEME:
+            raise ValueError(f"ERROR: {url} is not a {SCHEME}:// URL")
+        query: Dict[str, str] = {
+            key: values[-1] for key, values in parse_qs(parts.query).items()
+        }
+
+        try:
+            width, height = (int(value) for value in query.get("size", "").split("x"))
+        except ValueError:
+            width, height = config.FRAME_SIZE
+        self.frame_size: Tuple[int, int] = (width, height)
+        self.fps = float(query.get("fps", config.FPS))
+        self.motion_on, self.motion_period = self._parse_pair(
+            query.get("motion", "5/30")
+        )
+        self.stall_every, self.stall_duration = self._parse_pair(
+            query.get("stall", "0")
+        )
+        self.disconnect_after = float(query.get("disconnect", 0))
+        self.fail_probability = float(query.get("fail", 0))
+        self.hls = query.get("hls", "0") == "1"
+        self.seed = int(query.get("seed", sum(map(ord, parts.netloc))))
+
+        if self.fps <= 0 or width <= 0 or height <= 0:
+            raise ValueError(f"ERROR: Invalid size or fps in {url}")
+
+    @staticmethod
+    def _parse_pair(value: str) -> Tuple[float, float]:
+        first, _, second = value.partition("/")
+        try:
+            return float(first), float(second or 0)
+        except ValueError as err:
+            raise ValueError(
+                f"ERROR: Expected <seconds>/<seconds>, got {value}"
+            ) from err
+
+    def has_motion(self, now: float) -> bool:
+        """
+        Returns whether the object is in the scene at time `now`
+        """
+        if self.motion_on <= 0 or self.motion_period <= 0:
+            return False
+        return (now + self.seed) % self.motion_period < self.motion_on
+
+    def is_stalled(self, elapsed: float) -> bool:
+        """
+        Returns whether the stream is stalled `elapsed` seconds after it started
+        """
+        if self.stall_every <= 0 or self.stall_duration <= 0:
+            return False
+        return elapsed % self.stall_every >= self.stall_every - self.stall_duration
+
+
+class SimulatedStream:
+    """
+    Stream of synthetic frames following SimulationSettings.
+    It has the same `read` and `stop` methods as StreamIngest, so CameraSource
+    handles stalls and disconnects of simulated cameras the same way as those
+    of real cameras. No ffmpeg process runs unless the live feed is encoded
+    """
+
+    def __init__(
+        self,
+        settings: SimulationSettings,
+        hls_directory: str | None = None,
+        read_timeout: float = config.CAMERA_READ_TIMEOUT,
+        low_latency: bool = False,
+        hls_segment_duration: float | None = None,
+    ):
+        self.settings = settings
+        # Set even if no playlist is written, so LiveFeed never tries to open
+        # the URL with ffmpeg
+        self.hls_directory = hls_directory
+        self.segment_directory = None
+        self.read_timeout = read_timeout
+        self.low_latency = low_latency
+        self.hls_segment_duration = hls_segment_duration
+
+        self._frames: queue.Queue[np.ndarray | None] = queue.Queue(maxsize=2)
+        self._stopped = Event()
+        self._thread: Thread | None = None
+        self._encoder: subprocess.Popen | None = None
+        self._backgrounds = self._make_backgrounds()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> SimulatedStream:
+        if self.settings.hls and self.hls_directory is not None:
+            self._start_encoder()
+        self._thread = Thread(target=self._generate_frames, daemon=True)
+        self._thread.start()
+        return self
+
+    def read(self) -> np.ndarray | None:
+        """
+        Blocks until the next frame is generated. Returns None once the stream
+        has ended and raises queue.Empty if no frame arrives within `read_timeout`
+        """
+        return self._frames.get(timeout=self.read_timeout)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        encoder, self._encoder = self._encoder, None
+        if encoder is not None:
+            encoder.stdin.close()
+            try:
+                encoder.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                encoder.kill()
+
+    def make_frame(self, index: int, now: float) -> np.ndarray:
+        """
+        Draws the frame shown at time `now`
+        """
+        # The background changes slightly from frame to frame, like sensor noise
+        frame = self._backgrounds[index % len(self._backgrounds)].copy()
+        if self.settings.has_motion(now):
+            width, height = self.settings.frame_size
+            progress = (
+                (now + self.settings.seed) % self.settings.motion_period
+            ) / self.settings.motion_on
+            object_width, object_height = width // 12, height // 3
+            x_coord = int(progress * (width + object_width)) - object_width
+            y_coord = height // 2 - object_height // 2
+            cv.rectangle(
+                frame,
+                (x_coord, y_coord),
+                (x_coord + object_width, y_coord + object_height),
+                (210, 210, 210),
+                -1,
+            )
+        return frame
+
+    def _make_backgrounds(self, num_variants: int = 4) -> List[np.ndarray]:
+        width, height = self.settings.frame_size
+        rng = np.random.default_rng(self.settings.seed)
+        base = cv.GaussianBlur(
+            rng.integers(40, 200, (height, width, 3), dtype=np.uint8), (0, 0), 8
+        )
+        base = cv.normalize(base, None, 50, 180, cv.NORM_MINMAX)
+        backgrounds = []
+        for _ in range(num_variants):
+            noise = rng.integers(-3, 4, base.shape, dtype=np.int16)
+            backgrounds.append(np.clip(base + noise, 0, 255).astype(np.uint8))
+        return backgrounds
+
+    def _generate_frames(self) -> None:
+        """
+        Generates frames at the frame rate of the camera until the stream is
+        stopped or disconnects
+        """
+        frame_interval = 1 / self.settings.fps
+        start = time.monotonic()
+        next_frame_time = start
+        index = 0
+        while not self._stopped.is_set():
+            elapsed = time.monotonic() - start
+            if 0 < self.settings.disconnect_after <= elapsed:
+                break
+
+            delay = next_frame_time - time.monotonic()
+            if delay > 0 and self._stopped.wait(delay):
+                break
+            next_frame_time += frame_interval
+            if self.settings.is_stalled(elapsed):
+                continue
+
+            frame = self.make_frame(index, time.time())
+            index += 1
+            self._put(frame)
+            self._encode(frame)
+
+        # Tell the reader that the stream has ended
+        self._put(None)
+
+    def _start_encoder(self) -> None:
+        """
+        Starts an ffmpeg process that encodes the frames into the HLS playlist
+        of the live feed
+        """
+        if not shutil.which("ffmpeg"):
+            raise RuntimeError("ERROR: Please install ffmpeg/ffprobe.")
+        if os.path.exists(self.hls_directory):
+            for file in os.listdir(self.hls_directory):
+                os.remove(f"{self.hls_directory}/{file}")
+        else:
+            os.makedirs(self.hls_directory)
+
+        width, height = self.settings.frame_size
+        fps = self.settings.fps
+        self._encoder = subprocess.Popen(
+            [
+                shutil.which("ffmpeg"),
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "bgr24",
+                "-s",
+                f"{width}x{height}",
+                "-r",
+                str(fps),
+                "-i",
+                "pipe:0",
+                "-c:v",
+                "libx264",
+                "-preset",
+                "ultrafast",
+                "-tune",
+                "zerolatency",
+                "-pix_fmt",
+                "yuv420p",
+                "-g",
+                str(int(fps)),
+                *get_hls_args(
+                    f"{self.hls_directory}/index.m3u8",
+                    self.hls_segment_duration,
+                    self.low_latency,
+                ),
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def _encode(self, frame: np.ndarray) -> None:
+
+        encoder = self._encoder
+        if encoder is None:
+            return
+        try:
+            encoder.stdin.write(frame.tobytes())
+        except (BrokenPipeError, ValueError):
+            self._encoder = None
+
+    def _put(self, frame: np.ndarray | None) -> None:
+        """
+        Queues a frame, dropping the oldest one if the reader falls behind
+        """
+        while True:
+            try:
+                self._frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self._frames.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+def open_stream(camera_source) -> SimulatedStream:
+    """
+    Opens the stream of a CameraSource with a sim:// URL
+    """
+    try:
+        settings = SimulationSettings(camera_source.source)
+    except ValueError as err:
+        raise RuntimeError(str(err)) from err
+    return SimulatedStream(
+        settings,
+        hls_directory=f"{config.STREAM_DIRECTORY}/{camera_source.name}",
+        low_latency=camera_source.low_latency,
+        hls_segment_duration=camera_source.hls_segment_duration,
+    ).start()
+
+
+def check_alive(source: str, timeout: int = 5) -> bool:
+    """
+    Simulated cameras fail to answer with the probability given by `fail`
+    """
+    # pylint: disable=unused-argument
+    try:
+        settings = SimulationSettings(source)
+    except ValueError:
+        return False
+    return random.random() >= settings.fail_probability
+
+
+register_backend(SCHEME, open_stream, check_alive)
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import heapq
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from threading import Condition, Lock, Thread
+from typing import Callable, Dict, Hashable, List, Tuple
+
+import config
+
+from .camera import CameraSource
+
+
+class _Watch:
+    """
+    Connection state of a single source watched by the supervisor
+    """
+
+    def __init__(
+        self,
+        source: CameraSource,
+        on_connected: Callable[[CameraSource], None],
+        on_disconnected: Callable[[CameraSource], None] | None,
+        generation: int,
+    ):
+        self.source = source
+        self.on_connected = on_connected
+        self.on_disconnected = on_disconnected
+        self.generation = generation
+        self.failed_attempts = 0
+        self.connecting = False
+        self.next_attempt: float | None = None
+
+
+class ConnectionSupervisor:
+    """
+    Connects to camera sources in the background.
+    Connections are attempted concurrently on a thread pool so that slow or
+    offline cameras don't hold up the others. Cameras that can't be reached, or
+    that disconnect later on, are retried forever with exponential backoff and
+    jitter. `on_connected` is called (from a pool thread) every time a camera
+    comes online and `on_disconnected` (from the capture thread of the camera)
+    every time it goes offline
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = config.MAX_CONCURRENT_CONNECTIONS,
+        base_delay: float = config.RECONNECT_BASE_DELAY,
+        max_delay: float = config.RECONNECT_MAX_DELAY,
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="camera-connect"
+        )
+        self._watches: Dict[Hashable, _Watch] = {}
+        self._lock = Lock()
+        self._generations = count()
+
+        self._retries: List[Tuple[float, int, Hashable, int]] = []
+        self._retry_counter = count()
+        self._retry_condition = Condition()
+        self._retry_thread: Thread | None = None
+        self._running = True
+
+    def watch(
+        self,
+        key: Hashable,
+        source: CameraSource,
+        on_connected: Callable[[CameraSource], None],
+        on_disconnected: Callable[[CameraSource], None] | None = None,
+    ) -> None:
+        """
+        Starts connecting to `source` in the background and keeps it connected
+        until `unwatch` is called with the same key
+        """
+        with self._lock:
+            watch = _Watch(
+                source, on_connected, on_disconnected, next(self._generations)
+            )
+            self._watches[key] = watch
+
+        source.on_disconnect = lambda _: self._on_disconnect(key, watch.generation)
+        self._submit(key, watch.generation)
+
+    def unwatch(self, key: Hashable) -> None:
+        """
+        Stops reconnecting the source registered under `key`.
+        Attempts that are already running will not call `on_connected`
+        """
+        with self._lock:
+            watch = self._watches.pop(key, None)
+        if watch is not None:
+            watch.source.on_disconnect = None
+
+    def is_watching(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._watches
+
+    def get_status(self) -> Dict[Hashable, Dict[str, float | int | bool | None]]:
+        """
+        Returns the connection state of every watched source
+        """
+        with self._lock:
+            return {
+                key: {
+                    "connected": watch.source.is_connected,
+                    "connecting": watch.connecting,
+                    "failed_attempts": watch.failed_attempts,
+                    "next_attempt_in": (
+                        max(0.0, watch.next_attempt - time.monotonic())
+                        if watch.next_attempt is not None
+                        else None
+                    ),
+                }
+                for key, watch in self._watches.items()
+            }
+
+    def shutdown(self) -> None:
+        """
+        Stops all pending and scheduled connection attempts
+        """
+        with self._lock:
+            self._watches.clear()
+        with self._retry_condition:
+            self._running = False
+            self._retries.clear()
+            self._retry_condition.notify_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_backoff(self, failed_attempts: int) -> float:
+        """
+        Returns how long to wait before the next attempt.
+        The delay doubles with every failed attempt up to `max_delay`, and half of
+        it is randomized so that cameras behind the same switch don't retry in sync
+        """
+        delay = min(self.max_delay, self.base_delay * 2**failed_attempts)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _get_watch(self, key: Hashable, generation: int) -> _Watch | None:
+        watch = self._watches.get(key)
+        if watch is None or watch.generation != generation:
+            return None
+        return watch
+
+    def _submit(self, key: Hashable, generation: int) -> None:
+        with self._lock:
+            watch = self._get_watch(key, generation)
+            if watch is None or watch.connecting or not self._running:
+                return
+            watch.connecting = True
+            watch.next_attempt = None
+        self._executor.submit(self._attempt, key, generation)
+
+    def _attempt(self, key: Hashable, generation: int) -> None:
+        """
+        Tries to connect to a source once. Runs on the thread pool
+        """
+        with self._lock:
+            watch = self._get_watch(key, generation)
+        if watch is None:
+            return
+
+        try:
+            watch.source.connect()
+            connected = True
+        except RuntimeError as err:
+            print(err)
+            connected = False
+        except Exception as err:  # pylint: disable=broad-except
+            # Anything else would be lost in the executor and leave the source
+            # marked as connecting, which blocks every later attempt
+            print(f"ERROR: Could not connect to camera {watch.source.name}: {err}")
+            connected = False
+
+        with self._lock:
+            watch.connecting = False
+            unwatched = self._get_watch(key, generation) is None
+            if connected:
+                watch.failed_attempts = 0
+            else:
+                delay = self.get_backoff(watch.failed_attempts)
+                watch.failed_attempts += 1
+
+        if unwatched:
+            # The source was unwatched while connecting
+            if connected:
+                watch.source.stop()
+        elif connected:
+            try:
+                watch.on_connected(watch.source)
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"ERROR: Could not start camera {watch.source.name}: {err}")
+        else:
+            print(f"Retrying {watch.source.name} in {delay:.1f}s")
+            self._schedule(key, generation, delay)
+
+    def _on_disconnect(self, key: Hashable, generation: int) -> None:
+        """
+        Called from the capture thread of a source that stopped sending frames
+        """
+        with self._lock:
+            watch = self._get_watch(key, generation)
+            if watch is None:
+                return
+        print(f"{watch.source.name} disconnected. Reconnecting in the background")
+        if watch.on_disconnected is not None:
+            try:
+                watch.on_disconnected(watch.source)
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"ERROR: {err}")
+        self._schedule(key, generation, self.get_backoff(0))
+
+    def _schedule(self, key: Hashable, generation: int, delay: float) -> None:
+        due = time.monotonic() + delay
+        with self._lock:
+            watch = self._get_watch(key, generation)
+            if watch is not None:
+                watch.next_attempt = due
+
+        with self._retry_condition:
+            if not self._running:
+                return
+            heapq.heappush(
+                self._retries, (due, next(self._retry_counter), key, generation)
+            )
+            if self._retry_thread is None:
+                self._retry_thread = Thread(target=self._run_retries, daemon=True)
+                self._retry_thread.start()
+            self._retry_condition.notify()
+
+    def _run_retries(self) -> None:
+        """
+        Submits scheduled retries to the thread pool once they are due
+        """
+        with self._retry_condition:
+            while self._running:
+                if not self._retries:
+                    self._retry_condition.wait()
+                    continue
+
+                due, _, key, generation = self._retries[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._retry_condition.wait(timeout=delay)
+                    continue
+
+                heapq.heappop(self._retries)
+                self._retry_condition.release()
+                try:
+                    self._submit(key, generation)
+                finally:
+                    self._retry_condition.acquire()
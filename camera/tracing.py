@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Any, Deque, Dict, List, NamedTuple
+
+import config
+
+# Returned by Tracer.span and Tracer.tick when nothing is recorded
+_NOT_RECORDED = nullcontext()
+
+
+class Span(NamedTuple):
+    """
+    A timed stage of the pipeline. Times are in microseconds
+    """
+
+    name: str
+    camera: str | None
+    start: float
+    duration: float
+    thread_id: int
+    # Detection loop iteration the span belongs to, None outside of the loop
+    tick: int | None
+
+
+class _ThreadState(threading.local):
+    """
+    Detection loop iteration running in the current thread
+    """
+
+    tick: int | None = None
+    sampled: bool = False
+
+
+class _RecordedSpan:
+    """
+    Context manager that adds a span to the ring of a Tracer once it exits
+    """
+
+    __slots__ = ("_tracer", "_name", "_camera", "_tick", "_start")
+
+    def __init__(self, tracer: Tracer, name: str, camera: str | None, tick: int | None):
+        self._tracer = tracer
+        self._name = name
+        self._camera = camera
+        self._tick = tick
+        self._start = 0.0
+
+    def __enter__(self) -> _RecordedSpan:
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        end = time.perf_counter()
+        self._tracer.add_span(
+            self._name, self._camera, self._start, end - self._start, self._tick
+        )
+
+
+class _RecordedTick(_RecordedSpan):
+    """
+    Span of a whole detection loop iteration. Spans started in the same thread
+    while it is open belong to it, and are recorded only if it is
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> _RecordedTick:
+        self._tracer.state.tick = self._tick
+        self._tracer.state.sampled = True
+        return super().__enter__()
+
+    def __exit__(self, *exc_info) -> None:
+        super().__exit__(*exc_info)
+        self._tracer.state.tick = None
+        self._tracer.state.sampled = False
+
+
+class _SkippedTick:
+    """
+    Keeps the spans of an iteration that is not sampled from being recorded
+    """
+
+    __slots__ = ("_state",)
+
+    def __init__(self, state: _ThreadState):
+        self._state = state
+
+    def __enter__(self) -> None:
+        self._state.tick = -1
+        self._state.sampled = False
+
+    def __exit__(self, *exc_info) -> None:
+        self._state.tick = None
+
+
+class Tracer:
+    """
+    Records how long each stage of the detection loop takes, per camera.
+    Whole iterations of the loop ("ticks") are sampled with the probability
+    `sample_rate`, so a recorded tick always has all of its spans and shows
+    why it was slow. Spans outside of a tick, e.g. in the analysis workers,
+    are sampled on their own. Only the last `capacity` spans are kept.
+    A `sample_rate` of 0 turns tracing off, which costs one comparison per span
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = config.TRACE_SAMPLE_RATE,
+        capacity: int = config.TRACE_BUFFER_SIZE,
+    ):
+        if capacity < 1:
+            raise ValueError("ERROR: The trace buffer must hold at least one span")
+        self.sample_rate = sample_rate
+        self.state = _ThreadState()
+        self._spans: Deque[Span] = deque(maxlen=capacity)
+        self._thread_names: Dict[int, str] = {}
+        self._next_tick = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._spans.maxlen
+
+    def set_sample_rate(self, sample_rate: float) -> None:
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("ERROR: The sample rate must be between 0 and 1")
+        self.sample_rate = sample_rate
+
+    def tick(self):
+        """
+        Returns a context manager around one iteration of the detection loop
+        """
+        if self.sample_rate <= 0:
+            return _NOT_RECORDED
+        if random.random() >= self.sample_rate:
+            return _SkippedTick(self.state)
+        self._next_tick += 1
+        return _RecordedTick(self, "tick", None, self._next_tick)
+
+    def span(self, name: str, camera: str | None = None):
+        """
+        Returns a context manager that times a stage of the pipeline
+        """
+        if self.sample_rate <= 0:
+            return _NOT_RECORDED
+        state = self.state
+        if state.tick is None:
+            if random.random() >= self.sample_rate:
+                return _NOT_RECORDED
+        elif not state.sampled:
+            return _NOT_RECORDED
+        return _RecordedSpan(self, name, camera, state.tick)
+
+    def add_span(
+        self,
+        name: str,
+        camera: str | None,
+        start: float,
+        duration: float,
+        tick: int | None = None,
+    ) -> None:
+        """
+        Adds a span that was timed elsewhere. `start` and `duration` are in
+        seconds, `start` as given by time.perf_counter()
+        """
+        thread = threading.current_thread()
+        if thread.ident not in self._thread_names:
+            self._thread_names[thread.ident] = thread.name
+        self._spans.append(
+            Span(name, camera, start * 1e6, duration * 1e6, thread.ident, tick)
+        )
+
+    def get_spans(self) -> List[Span]:
+        return list(self._spans)
+
+    def clear(self) -> None:
+        self._spans.clear()
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """
+        Returns the recorded spans in the Chrome trace event format, which can
+        be opened in chrome://tracing or https://ui.perfetto.dev
+        """
+        pid = os.getpid()
+        events: List[Dict[str, Any]] = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": thread_id,
+                "args": {"name": thread_name},
+            }
+            for thread_id, thread_name in list(self._thread_names.items())
+        ]
+        for span in self.get_spans():
+            args: Dict[str, Any] = {}
+            if span.camera is not None:
+                args["camera"] = span.camera
+            if span.tick is not None:
+                args["tick"] = span.tick
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.camera or "detection",
+                    "ph": "X",
+                    "ts": span.start,
+                    "dur": span.duration,
+                    "pid": pid,
+                    "tid": span.thread_id,
+                    "args": args,
+                }
+            )
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"sample_rate": self.sample_rate},
+        }
+
+
+TRACER = Tracer()
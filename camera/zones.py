@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+from typing import Any, List, NamedTuple, Tuple
+
+import cv2 as cv
+import numpy as np
+
+ZONE_KINDS = ("include", "exclude")
+
+
+class Zone(NamedTuple):
+    """
+    Polygon in which motion is either looked for or ignored.
+    Points are fractions of the width and height of the frame, so that zones
+    don't depend on the resolution motion is detected at
+    """
+
+    kind: str
+    points: List[Tuple[float, float]]
+
+
+def parse_zones(data: Any) -> List[Zone]:
+    """
+    Validates zones stored as JSON, e.g.
+    [{"kind": "exclude", "points": [[0.1, 0.2], [0.5, 0.2], [0.3, 0.6]]}].
+    Raises a ValueError if they are malformed
+    """
+    if data is None:
+        return []
+    if not isinstance(data, list):
+        raise ValueError("ERROR: Detection zones must be a list")
+
+    zones: List[Zone] = []
+    for zone in data:
+        if not isinstance(zone, dict) or zone.get("kind") not in ZONE_KINDS:
+            raise ValueError(f"ERROR: Zones must have a kind in {ZONE_KINDS}")
+        points = zone.get("points")
+        if not isinstance(points, list) or len(points) < 3:
+            raise ValueError("ERROR: Zones need at least 3 points")
+
+        parsed_points: List[Tuple[float, float]] = []
+        for point in points:
+            try:
+                x_coord, y_coord = (float(value) for value in point)
+            except (TypeError, ValueError) as err:
+                raise ValueError("ERROR: Zone points must be [x, y] pairs") from err
+            if not (0 <= x_coord <= 1 and 0 <= y_coord <= 1):
+                raise ValueError("ERROR: Zone points must be between 0 and 1")
+            parsed_points.append((x_coord, y_coord))
+        zones.append(Zone(zone["kind"], parsed_points))
+    return zones
+
+
+class DetectionZones:
+    """
+    The detection zones of a camera, rasterized into a mask that is ANDed with
+    the foreground mask.
+    Without include zones the whole frame is included. Exclude zones are
+    removed from the included area. The mask is only rebuilt when the size of
+    the foreground mask changes
+    """
+
+    def __init__(self, data: Any = None):
+        self.zones = parse_zones(data)
+        # Zones as they were given, to send them to detection processes
+        self.data = [
+            {"kind": zone.kind, "points": [list(point) for point in zone.points]}
+            for zone in self.zones
+        ]
+        self._mask: np.ndarray | None = None
+
+    def __bool__(self) -> bool:
+        return bool(self.zones)
+
+    def get_mask(self, size: Tuple[int, int]) -> np.ndarray | None:
+        """
+        Returns the zone mask for foreground masks of `size` (width, height),
+        or None if there are no zones
+        """
+        if not self.zones:
+            return None
+        width, height = size
+        if self._mask is not None and self._mask.shape == (height, width):
+            return self._mask
+
+        has_include_zones = any(zone.kind == "include" for zone in self.zones)
+        mask = np.full((height, width), 0 if has_include_zones else 255, np.uint8)
+        # Exclude zones are drawn last so that they win where zones overlap
+        for kind, color in (("include", 255), ("exclude", 0)):
+            polygons = [
+                np.array(
+                    [
+                        (x_coord * width, y_coord * height)
+                        for x_coord, y_coord in zone.points
+                    ],
+                    dtype=np.int32,
+                )
+                for zone in self.zones
+                if zone.kind == kind
+            ]
+            if polygons:
+                cv.fillPoly(mask, polygons, color)
+
+        self._mask = mask
+        return mask
+
+    def apply(self, foreground_mask: np.ndarray) -> np.ndarray:
+        """
+        Removes the motion outside of the zones from a foreground mask
+        """
+        mask = self.get_mask(foreground_mask.shape[1::-1])
+        if mask is None:
+            return foreground_mask
+        return cv.bitwise_and(foreground_mask, mask)
@@ -8,11 +8,117 @@ ROOT_DIR = Path(__file__).parent
 HOST_NAME = socket.gethostname()
 LOCAL_IP_ADDRESS = socket.gethostbyname(HOST_NAME)
 STREAM_DIRECTORY = "media/stream"
+# Length (in seconds) of the HLS segments of the live feed.
+# The live view lags behind by a few segments
+HLS_SEGMENT_DURATION = 10
+# Segments used by cameras with a low latency live view. Since the stream of the
+# camera is copied, segments can't be shorter than its keyframe interval
+LOW_LATENCY_SEGMENT_DURATION = 1
 CAM_DEBUG = True
 PORT = 8080
 FPS = 15
+# Number of decoded frames kept in memory for each source
+FRAME_BUFFER_SIZE = 30
+# Seconds without a new frame before a camera is considered disconnected
+CAMERA_READ_TIMEOUT = 10
+# Number of worker processes used for motion detection.
+# 0 runs detection in the detection thread, -1 uses one process per spare core
+DETECTION_PROCESSES = 0
+# Number of cameras that can be connected to at the same time
+MAX_CONCURRENT_CONNECTIONS = 8
+# Delay (in seconds) before the first reconnection attempt.
+# It doubles with every failed attempt up to RECONNECT_MAX_DELAY
+RECONNECT_BASE_DELAY = 2
+RECONNECT_MAX_DELAY = 120
+# Number of threads that classify recorded intruders, each with its own network
+ANALYSIS_WORKERS = 1
+# Number of recordings that can wait for analysis before saving a recording
+# blocks the detection thread
+ANALYSIS_QUEUE_SIZE = 8
+# Number of representative frames of a recording that are classified
+ANALYSIS_FRAMES_PER_EVENT = 6
+# Analysis of a recording stops once a person is detected with this confidence
+PERSON_CONFIDENCE_THRESHOLD = 0.6
+# Classify crops around the moving objects instead of whole frames
+ANALYSIS_ROI = True
+# Padding added around each moving object, as a fraction of its size
+ROI_PADDING = 0.25
+# Smallest crop (in pixels) so that objects keep some context around them
+ROI_MIN_SIZE = 120
+# Seconds of video before motion is confirmed that are added to recordings
+PRE_ROLL_SECONDS = 2
+# JPEG quality of the frames kept for the pre-roll
+PRE_ROLL_JPEG_QUALITY = 80
+# Memory (in bytes) shared by the frames that all recordings keep for
+# thumbnails and analysis
+RECORDER_MEMORY_BUDGET = 64 * 1024 * 1024
+# JPEG quality of the frames kept by recordings
+RECORDER_JPEG_QUALITY = 85
+# How intruder clips of cameras are made.
+# "encode" re-encodes the analyzed frames, "copy" cuts the clips out of the
+# compressed stream of the camera without decoding it
+RECORDING_MODE = "encode"
+# Length of the segments the stream is buffered in when RECORDING_MODE is "copy"
+SEGMENT_SECONDS = 2
+# Seconds of stream kept in the buffer
+SEGMENT_BUFFER_SECONDS = 60
+# Open each camera once with ffmpeg and share the connection between the live
+# feed, detection and stream-copy recording, instead of connecting separately
+CAMERA_INGEST = True
+# Working resolution of the capture layer. Frames are scaled to this size as
+# they are decoded, so consumers never handle full resolution frames
+FRAME_SIZE = (640, 360)
+# Directory in which the ingest process of each camera writes its segments
+SEGMENT_DIRECTORY = "media/segments"
+
+# Resolution motion is detected at. Contours are scaled back up to FRAME_SIZE.
+# None detects motion on the frames as they are read
+MOTION_FRAME_SIZE = (320, 180)
+# Detect motion on grayscale frames
+MOTION_GRAYSCALE = True
+# Let the background subtractor split each frame across OpenCV threads
+MOTION_PARALLEL = False
+# OpenCV threads used by each process that detects motion. Negative sizes it to
+# the number of cameras processed at the same time, 0 keeps OpenCV's default
+MOTION_THREADS = -1
+# Motion detection backend: "cnt" runs a CNT background subtractor per camera,
+# "batched" compares the frames of every camera with a running average
+# background in one vectorized step, which can't be combined with
+# DETECTION_PROCESSES
+MOTION_BACKEND = "cnt"
+# Settings of the batched backend: how fast the background adapts, how much a
+# pixel must change to be foreground, and the fraction of the frame that must
+# change before contours are searched for
+MOTION_LEARNING_RATE = 0.05
+MOTION_DIFF_THRESHOLD = 25
+MOTION_GATE_THRESHOLD = 0.002
+# Moving areas smaller than this many pixels, at FRAME_SIZE, are not treated as
+# motion. Cameras can override it
+MIN_MOTION_AREA = 1000
+# Frames per second processed for cameras without motion. 0 processes every frame
+IDLE_DETECTION_FPS = 3
+# Seconds a camera stays at full rate after the last motion
+DETECTION_COOLDOWN = 10
+# Forensic scans split videos into chunks of this many seconds, which are
+# scanned in parallel and are the unit an interrupted scan resumes from
+FORENSIC_CHUNK_SECONDS = 600
+# Seconds of video before a chunk used to train the background model
+FORENSIC_WARMUP_SECONDS = 2
+# Events of a forensic scan less than this many seconds apart are merged
+FORENSIC_EVENT_GAP = 2
+# Frames older than this many seconds when detection reads them are counted as
+# stale by the metrics
+STALE_FRAME_SECONDS = 1
+# Fraction of the iterations of the detection loop whose stages are traced.
+# 0 turns tracing off. Traces are downloaded from /trace/ by staff users
+TRACE_SAMPLE_RATE = 0
+# Number of traced stages kept in memory, the oldest ones are dropped first
+TRACE_BUFFER_SIZE = 20000
 
 load_dotenv()
+# Token Prometheus must send as "Authorization: Bearer <token>" to read /metrics.
+# If it is not set only staff users that are logged in can read the metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 TEST_CAMS = [
     os.getenv("TEST_CAM_1"),
     os.getenv("TEST_CAM_2"),
@@ -1,3 +1,4 @@
+from camera.zones import parse_zones
 from django import forms
 
 from .models import Camera
@@ -6,7 +7,15 @@ from .models import Camera
 class EditCameraForm(forms.ModelForm):
     class Meta:
         model = Camera
-        fields = ("name", "rtsp_url")
+        fields = (
+            "name",
+            "rtsp_url",
+            "live_view_mode",
+            "segment_duration",
+            "detection_zones",
+            "min_motion_area",
+        )
+        widgets = {"detection_zones": forms.HiddenInput()}
 
     def __init__(self, *args, **kwargs):
         super(EditCameraForm, self).__init__(*args, **kwargs)
@@ -15,8 +24,21 @@ class EditCameraForm(forms.ModelForm):
 
         self.fields["rtsp_url"].widget.attrs["class"] = "input"
         self.fields["name"].widget.attrs["class"] = "input"
+        self.fields["segment_duration"].widget.attrs["class"] = "input"
+        self.fields["min_motion_area"].widget.attrs["class"] = "input"
         self.fields["name"].widget.attrs["placeholder"] = "Camera name"
         self.fields["rtsp_url"].widget.attrs["placeholder"] = rtsp_placeholder
+        self.fields["segment_duration"].widget.attrs["placeholder"] = "Default"
+        self.fields["segment_duration"].widget.attrs["min"] = "0.5"
+        self.fields["min_motion_area"].widget.attrs["placeholder"] = "Default"
+
+    def clean_detection_zones(self):
+        zones = self.cleaned_data["detection_zones"] or []
+        try:
+            parse_zones(zones)
+        except ValueError as err:
+            raise forms.ValidationError(str(err).replace("ERROR: ", "")) from err
+        return zones
 
 
 class AddCameraForm(forms.ModelForm):
@@ -0,0 +1,63 @@
+import config
+from camera.forensic import ForensicScan
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Scans a directory of archived footage for intruders as fast as the CPU "
+        "allows and writes the events to events.json. Interrupted scans resume "
+        "where they stopped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="directory of video files to scan")
+        parser.add_argument(
+            "--output",
+            default="media/forensic",
+            help="directory for the event list and the progress index",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=-1,
+            help="scanning processes, one per core by default",
+        )
+        parser.add_argument("--min-conseq-frames", type=int, default=10)
+        parser.add_argument(
+            "--chunk-seconds", type=float, default=config.FORENSIC_CHUNK_SECONDS
+        )
+        parser.add_argument(
+            "--no-analysis",
+            action="store_true",
+            help="only detect motion, don't classify the intruders",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="discard the progress of earlier scans",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            scan = ForensicScan(
+                options["directory"],
+                options["output"],
+                num_processes=options["processes"],
+                min_conseq_frames=options["min_conseq_frames"],
+                analyze=not options["no_analysis"],
+                chunk_seconds=options["chunk_seconds"],
+            )
+        except ValueError as err:
+            raise CommandError(str(err)) from err
+
+        events = scan.run(restart=options["restart"])
+        for event in events:
+            self.stdout.write(
+                f"{event['start_time']}  {event['file']} "
+                f"{event['start_offset']:.1f}-{event['end_offset']:.1f} s  "
+                f"{event['label'] or '-'}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"{len(events)} events written to {scan.events_path}")
+        )
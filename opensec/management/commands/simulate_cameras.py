@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from opensec.models import Camera
+
+from camera.simulated import SCHEME, SimulationSettings
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds simulated cameras (sim:// URLs) so that the system can be load "
+        "tested without real cameras. See camera/simulated.py for the options. "
+        "The cameras are changed in the database only, a server that is running "
+        "has to be restarted to pick them up"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("count", type=int, nargs="?", default=0)
+        parser.add_argument(
+            "--options",
+            default="motion=5/30",
+            help='query of the camera URLs, e.g. "fps=15&motion=5/30&stall=120/15"',
+        )
+        parser.add_argument(
+            "--remove", action="store_true", help="removes every simulated camera"
+        )
+
+    def handle(self, *args, **options):
+        simulated_cameras = Camera.objects.filter(rtsp_url__startswith=f"{SCHEME}://")
+        if options["remove"]:
+            count = simulated_cameras.count()
+            simulated_cameras.delete()
+            self.stdout.write(self.style.SUCCESS(f"Removed {count} simulated cameras"))
+            self._remind_to_restart()
+            return
+
+        first = simulated_cameras.count()
+        for index in range(first, first + options["count"]):
+            name = f"sim-{index + 1:02d}"
+            url = f"{SCHEME}://{name}?{options['options']}"
+            try:
+                SimulationSettings(url)
+            except ValueError as err:
+                raise CommandError(str(err)) from err
+            Camera.objects.create(name=name, rtsp_url=url)
+        self.stdout.write(
+            self.style.SUCCESS(f"Added {options['count']} simulated cameras")
+        )
+        self._remind_to_restart()
+
+    def _remind_to_restart(self):
+        # The camera manager only hears about changes to cameras made in the
+        # server process, this command runs in its own
+        self.stdout.write(
+            self.style.WARNING("Restart the server for the change to take effect")
+        )
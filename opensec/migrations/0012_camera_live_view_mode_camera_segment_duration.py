@@ -0,0 +1,23 @@
+# Generated by Django 4.0.3 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opensec', '0011_camera_stream_link'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='live_view_mode',
+            field=models.CharField(choices=[('standard', 'Standard'), ('low_latency', 'Low latency')], default='standard', max_length=20, verbose_name='Live view mode'),
+        ),
+        migrations.AddField(
+            model_name='camera',
+            name='segment_duration',
+            field=models.FloatField(blank=True, help_text='Leave empty to use the default of the live view mode', null=True, verbose_name='Live view segment duration (seconds)'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-17 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opensec', '0012_camera_live_view_mode_camera_segment_duration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='detection_zones',
+            field=models.JSONField(blank=True, default=list, help_text='Polygons in which motion is looked for or ignored', verbose_name='Detection zones'),
+        ),
+    ]
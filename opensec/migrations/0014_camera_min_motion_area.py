@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-17 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opensec', '0013_camera_detection_zones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='min_motion_area',
+            field=models.PositiveIntegerField(blank=True, help_text='Smallest moving area, in pixels of a 640x360 frame, treated as motion. Leave empty to use the default', null=True, verbose_name='Minimum motion area'),
+        ),
+    ]
@@ -3,6 +3,11 @@ from django.utils import timezone
 
 
 class Camera(models.Model):
+    LIVE_VIEW_MODES = [
+        ("standard", "Standard"),
+        ("low_latency", "Low latency"),
+    ]
+
     name = models.CharField("Camera name", max_length=200, blank=False, null=False)
     rtsp_url = models.CharField(
         "RTSP URL",
@@ -14,11 +19,40 @@ class Camera(models.Model):
     stream_link = models.CharField(
         "Link to camera stream", blank=True, null=True, max_length=500
     )
+    live_view_mode = models.CharField(
+        "Live view mode",
+        max_length=20,
+        choices=LIVE_VIEW_MODES,
+        default="standard",
+    )
+    segment_duration = models.FloatField(
+        "Live view segment duration (seconds)",
+        blank=True,
+        null=True,
+        help_text="Leave empty to use the default of the live view mode",
+    )
+    detection_zones = models.JSONField(
+        "Detection zones",
+        default=list,
+        blank=True,
+        help_text="Polygons in which motion is looked for or ignored",
+    )
+    min_motion_area = models.PositiveIntegerField(
+        "Minimum motion area",
+        blank=True,
+        null=True,
+        help_text="Smallest moving area, in pixels of a 640x360 frame, "
+        "treated as motion. Leave empty to use the default",
+    )
     date_added = models.DateTimeField("Camera addition date", default=timezone.now)
     snapshot = models.ImageField(
         "Camera snapshot", upload_to="camera_snaps", blank=True
     )
 
+    @property
+    def low_latency(self):
+        return self.live_view_mode == "low_latency"
+
     def __str__(self):
         return self.name
 
@@ -9,6 +9,8 @@ from .views import (
     IntruderListView,
     DeleteIntruderView,
     IntruderView,
+    MetricsView,
+    TraceView,
 )
 
 urlpatterns = [
@@ -28,4 +30,6 @@ urlpatterns = [
         IntruderView.as_view(),
         name="view_intruder",
     ),
+    path("metrics", MetricsView.as_view(), name="metrics"),
+    path("trace/", TraceView.as_view(), name="trace"),
 ]
@@ -1,7 +1,15 @@
-from django.contrib.auth.mixins import LoginRequiredMixin
+import hmac
+
+import config
+from camera.metrics import REGISTRY
+from camera.tracing import TRACER
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import HttpResponse, JsonResponse
 from django.urls import reverse
+from django.views import View
 from django.views.generic import DetailView, ListView
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from .forms import AddCameraForm, EditCameraForm
 from .models import Camera, Intruder
@@ -75,3 +83,44 @@ class IntruderView(LoginRequiredMixin, DetailView):
     template_name = "view_intruder.html"
     context_object_name = "intruder"
     login_url = "account/login"
+
+
+class MetricsView(View):
+    """
+    Metrics of the camera pipeline in the Prometheus text format.
+    Prometheus can't log in, so it authenticates with METRICS_TOKEN instead.
+    Staff users that are logged in can read the metrics as well
+    """
+
+    content_type = CONTENT_TYPE_LATEST
+
+    def get(self, request):
+        if not self._has_token(request) and not request.user.is_staff:
+            return HttpResponse("Unauthorized", status=401)
+        return HttpResponse(generate_latest(REGISTRY), content_type=self.content_type)
+
+    @staticmethod
+    def _has_token(request) -> bool:
+        if not config.METRICS_TOKEN:
+            return False
+        authorization = request.headers.get("Authorization", "")
+        return hmac.compare_digest(
+            authorization.encode(), f"Bearer {config.METRICS_TOKEN}".encode()
+        )
+
+
+class TraceView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Downloads the sampled traces of the detection loop in the Chrome trace
+    format. Tracing is turned on with TRACE_SAMPLE_RATE
+    """
+
+    login_url = "account/login"
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        response = JsonResponse(TRACER.to_chrome_trace())
+        response["Content-Disposition"] = 'attachment; filename="opensec_trace.json"'
+        return response
@@ -1,17 +1,22 @@
-function loadVideo(video, source) {
-  const hls = new Hls();
+function loadVideo(video, source, lowLatency) {
+  // Stay close to the live edge instead of buffering several segments,
+  // speeding playback up slightly to catch up after a stall
+  const hls = new Hls({
+    lowLatencyMode: lowLatency,
+    liveSyncDurationCount: lowLatency ? 2 : 3,
+    liveMaxLatencyDurationCount: lowLatency ? 4 : 6,
+    maxLiveSyncPlaybackRate: lowLatency ? 1.1 : 1,
+    backBufferLength: lowLatency ? 10 : 30,
+  });
   hls.attachMedia(video);
   hls.on(Hls.Events.MEDIA_ATTACHED, function () {
     hls.loadSource(source);
   });
 }
 let STREAM_URL = JSON.parse(document.getElementById('liveFeedUrl').textContent);
+let LIVE_VIEW_MODE = JSON.parse(document.getElementById('liveViewMode').textContent);
 const video = document.getElementById('video');
 const playBtn = document.getElementById('play-btn');
-loadVideo(video, STREAM_URL);
+loadVideo(video, STREAM_URL, LIVE_VIEW_MODE === 'low_latency');
 
 video.play();
-
-setInterval(() => {
-  video.currentTime = video.duration - 10;
-}, 10000);
@@ -0,0 +1,72 @@
+// Draws the detection zones of a camera over its snapshot and lets them be
+// edited. Points are stored as fractions of the width and height of the frame
+const ZONE_COLORS = {
+  include: 'rgba(72, 199, 142, 0.35)',
+  exclude: 'rgba(241, 70, 104, 0.35)',
+};
+const zonesInput = document.getElementById('id_detection_zones');
+const canvas = document.getElementById('zoneCanvas');
+const context = canvas.getContext('2d');
+const finishZoneBtn = document.getElementById('finishZoneBtn');
+
+let zones = JSON.parse(zonesInput.value || '[]');
+let currentZone = null;
+
+function drawZone(zone) {
+  if (zone.points.length === 0) {
+    return;
+  }
+  context.beginPath();
+  zone.points.forEach(([x, y], index) => {
+    const method = index === 0 ? 'moveTo' : 'lineTo';
+    context[method](x * canvas.width, y * canvas.height);
+  });
+  context.closePath();
+  context.fillStyle = ZONE_COLORS[zone.kind];
+  context.strokeStyle = ZONE_COLORS[zone.kind].replace('0.35', '1');
+  context.lineWidth = 3;
+  context.fill();
+  context.stroke();
+}
+
+function draw() {
+  context.clearRect(0, 0, canvas.width, canvas.height);
+  zones.forEach(drawZone);
+  if (currentZone !== null) {
+    drawZone(currentZone);
+  }
+  finishZoneBtn.disabled = currentZone === null || currentZone.points.length < 3;
+}
+
+function startZone(kind) {
+  currentZone = { kind: kind, points: [] };
+  draw();
+}
+
+canvas.addEventListener('click', (event) => {
+  if (currentZone === null) {
+    return;
+  }
+  const rect = canvas.getBoundingClientRect();
+  const x = (event.clientX - rect.left) / rect.width;
+  const y = (event.clientY - rect.top) / rect.height;
+  currentZone.points.push([Number(x.toFixed(4)), Number(y.toFixed(4))]);
+  draw();
+});
+
+document.getElementById('includeZoneBtn').addEventListener('click', () => startZone('include'));
+document.getElementById('excludeZoneBtn').addEventListener('click', () => startZone('exclude'));
+finishZoneBtn.addEventListener('click', () => {
+  zones.push(currentZone);
+  currentZone = null;
+  zonesInput.value = JSON.stringify(zones);
+  draw();
+});
+document.getElementById('clearZonesBtn').addEventListener('click', () => {
+  zones = [];
+  currentZone = null;
+  zonesInput.value = JSON.stringify(zones);
+  draw();
+});
+
+draw();
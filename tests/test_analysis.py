@@ -0,0 +1,145 @@
+import queue
+import time
+import unittest
+from threading import Event, Thread
+
+import numpy as np
+from camera.analysis import (
+    AnalysisWorkerPool,
+    FrameDetections,
+    predict_labels,
+    select_frames,
+)
+
+
+class FakeAnalyzer:
+    """
+    Stands in for an IntruderAnalyzer that finds a person in every bright frame
+    """
+
+    def __init__(self, delay: float = 0.0, gate: Event | None = None):
+        self.delay = delay
+        self.gate = gate
+
+    def analyze_frames(self, frames, regions=None):
+        self.num_analyzed = getattr(self, "num_analyzed", 0) + len(frames)
+        if self.gate is not None:
+            self.gate.wait(timeout=5)
+        time.sleep(self.delay)
+        return [
+            FrameDetections(
+                np.array(["person"] if frame.mean() > 127 else [], dtype=str),
+                np.array([0.9] if frame.mean() > 127 else []),
+                np.zeros((1 if frame.mean() > 127 else 0, 4)),
+            )
+            for frame in frames
+        ]
+
+
+def make_frame(value: int) -> np.ndarray:
+    return np.full((10, 10, 3), value, dtype=np.uint8)
+
+
+def make_event_frame(x_coord: int) -> np.ndarray:
+    frame = np.zeros((360, 640, 3), dtype=np.uint8)
+    frame[100:250, x_coord : x_coord + 80] = 200
+    return frame
+
+
+class TestFrameSelection(unittest.TestCase):
+    def test_selects_high_motion_frames_across_event(self):
+        frames = [make_event_frame(x_coord * 10) for x_coord in range(50)]
+        energy = [i % 10 + i / 100 for i in range(50)]
+
+        selected = select_frames(frames, energy, 5)
+
+        self.assertEqual(len(selected), 5)
+        # The frame with the most motion comes first
+        self.assertIs(selected[0], frames[49])
+        self.assertTrue(all(any(s is f for f in frames[9::10]) for s in selected))
+
+    def test_drops_duplicate_frames(self):
+        frames = [make_event_frame(0)] * 20 + [make_event_frame(300)] * 20
+        energy = [1.0] * 40
+
+        selected = select_frames(frames, energy, 6)
+
+        self.assertEqual(len(selected), 2)
+
+    def test_stops_once_person_is_found(self):
+        analyzer = FakeAnalyzer()
+        frames = {
+            "person": [make_frame(255)] * 6,
+            "nobody": [make_frame(0)] * 6,
+        }
+
+        predictions = predict_labels(analyzer, frames, frames_per_round=2)
+
+        self.assertIn("person", predictions["person"])
+        self.assertEqual(predictions["nobody"], [])
+        # Two frames of the first source and all six of the second
+        self.assertEqual(analyzer.num_analyzed, 8)
+
+
+class TestAnalysisWorkerPool(unittest.TestCase):
+    def test_labels_are_returned_per_source(self):
+        results = queue.Queue()
+        pool = AnalysisWorkerPool(FakeAnalyzer, num_workers=2).start()
+
+        pool.submit(
+            {"cam-1": [make_frame(255), make_frame(0)], "cam-2": [make_frame(0)]},
+            results.put,
+        )
+        predictions = results.get(timeout=5)
+        pool.stop()
+
+        self.assertEqual(predictions, {"cam-1": ["person"], "cam-2": []})
+        stats = pool.get_stats()
+        self.assertEqual(stats["completed"], 1)
+        self.assertEqual(stats["queued"], 0)
+
+    def test_submit_applies_backpressure(self):
+        gate = Event()
+        pool = AnalysisWorkerPool(
+            lambda: FakeAnalyzer(gate=gate), num_workers=1, max_queued=1
+        )
+        done = []
+
+        # One job is taken by the worker and one fills the queue
+        pool.submit({"cam": [make_frame(255)]}, done.append)
+        time.sleep(0.1)
+        pool.submit({"cam": [make_frame(255)]}, done.append)
+
+        submitted = Event()
+        Thread(
+            target=lambda: (
+                pool.submit({"cam": [make_frame(255)]}, done.append),
+                submitted.set(),
+            )
+        ).start()
+        # The queue is full until the worker finishes its job
+        self.assertFalse(submitted.wait(timeout=0.2))
+        self.assertEqual(pool.queue_depth, 1)
+        gate.set()
+        self.assertTrue(submitted.wait(timeout=5))
+
+        pool.stop()
+        stats = pool.get_stats()
+        self.assertEqual(len(done), 3)
+        self.assertEqual(stats["completed"], 3)
+        self.assertEqual(stats["blocked_submits"], 1)
+        self.assertGreater(stats["max_wait"], 0)
+
+    def test_stop_waits_for_queued_jobs(self):
+        pool = AnalysisWorkerPool(lambda: FakeAnalyzer(delay=0.05), num_workers=2)
+        done = []
+        for _ in range(6):
+            pool.submit({"cam": [make_frame(255)]}, done.append)
+        pool.stop()
+
+        self.assertEqual(len(done), 6)
+        self.assertFalse(pool.is_running)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+
+import numpy as np
+from camera.analysis import FrameDetections, IntruderAnalyzer
+
+
+class TestIntruderAnalyzer(unittest.TestCase):
+    def test_parse_batched_detections(self):
+        person = IntruderAnalyzer.ssd_classes.index("person")
+        dog = IntruderAnalyzer.ssd_classes.index("dog")
+        car = IntruderAnalyzer.ssd_classes.index("car")
+        # Rows of (frame index, class id, confidence, box) as returned by SSD
+        rows = [
+            [0, person, 0.9, 0.1, 0.1, 0.5, 0.5],
+            [0, car, 0.1, 0.1, 0.1, 0.5, 0.5],
+            [2, dog, 0.6, 0.2, 0.2, 0.4, 0.4],
+            [2, person, 0.3, 0.2, 0.2, 0.4, 0.4],
+        ]
+        detections = np.array(rows, dtype=np.float32).reshape(1, 1, -1, 7)
+
+        results = IntruderAnalyzer.parse_detections(detections, 3, 0.25)
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0].labels.tolist(), ["person"])
+        self.assertEqual(results[1].labels.tolist(), [])
+        self.assertEqual(results[2].labels.tolist(), ["dog", "person"])
+        np.testing.assert_allclose(results[2].confidences, [0.6, 0.3])
+
+    def test_batch_matches_single_frames(self):
+        analyzer = IntruderAnalyzer()
+        analyzer.batch_size = 2
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 255, (360, 640, 3), dtype=np.uint8) for _ in range(5)]
+
+        batched = analyzer.analyze_frames(frames)
+        self.assertEqual(len(batched), 5)
+        for frame, detections in zip(frames, batched):
+            self.assertEqual(
+                analyzer.analyze_frame(frame) or [], detections.labels.tolist()
+            )
+
+    def test_regions_of_interest(self):
+        analyzer = IntruderAnalyzer(roi_padding=0.25, roi_min_size=120)
+        shape = (360, 640, 3)
+
+        # A small object gets a square crop of the minimum size around it
+        self.assertEqual(
+            analyzer.get_regions_of_interest([(300, 200, 20, 40)], shape),
+            [(250, 160, 370, 280)],
+        )
+        # Crops are kept inside the frame
+        self.assertEqual(
+            analyzer.get_regions_of_interest([(0, 340, 20, 20)], shape),
+            [(0, 240, 120, 360)],
+        )
+        # Overlapping crops are merged
+        self.assertEqual(
+            analyzer.get_regions_of_interest(
+                [(300, 200, 20, 40), (340, 200, 20, 40)], shape
+            ),
+            [(250, 160, 410, 280)],
+        )
+        # Large objects are analyzed on the whole frame
+        self.assertEqual(
+            analyzer.get_regions_of_interest([(100, 50, 300, 250)], shape),
+            [(0, 0, 640, 360)],
+        )
+        self.assertEqual(
+            analyzer.get_regions_of_interest([], shape), [(0, 0, 640, 360)]
+        )
+
+    def test_roi_detections_are_mapped_to_the_frame(self):
+        class CropAnalyzer(IntruderAnalyzer):
+            def _analyze_images(self, frames):
+                # A person in the top left corner of every crop
+                return [
+                    FrameDetections(
+                        np.array(["person"]),
+                        np.array([0.9]),
+                        np.array([[10, 10, 20, 20]], dtype=np.float32),
+                    )
+                    for _ in frames
+                ]
+
+        analyzer = CropAnalyzer(roi_min_size=120)
+        frames = [np.zeros((360, 640, 3), dtype=np.uint8)] * 2
+        regions = [[(300, 200, 20, 40)], [(10, 10, 20, 20), (500, 200, 20, 20)]]
+
+        results = analyzer.analyze_frames(frames, regions)
+
+        self.assertEqual(len(results), 2)
+        np.testing.assert_array_equal(results[0].boxes, [[260, 170, 270, 180]])
+        np.testing.assert_array_equal(
+            results[1].boxes, [[10, 10, 20, 20], [460, 160, 470, 170]]
+        )
+        self.assertEqual(results[1].labels.tolist(), ["person", "person"])
+
+
+if __name__ == "__main__":
+    unittest.main()
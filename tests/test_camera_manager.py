@@ -0,0 +1,84 @@
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+import config
+from camera import CameraManager
+
+
+class FakeCamera:
+    """
+    Stands in for a Camera row of the database
+    """
+
+    def __init__(self, pk: int, name: str, rtsp_url: str):
+        self.pk = pk
+        self.name = name
+        self.rtsp_url = rtsp_url
+        self.low_latency = False
+        self.segment_duration = None
+        self.live_view_mode = "standard"
+        self.detection_zones = None
+        self.min_motion_area = None
+        self.is_active = False
+        self.stream_link = None
+        self.snapshot = None
+
+    def save(self):
+        pass
+
+    def copy(self, **changes):
+        camera = FakeCamera(self.pk, self.name, self.rtsp_url)
+        camera.__dict__.update(self.__dict__)
+        camera.__dict__.update(changes)
+        return camera
+
+
+class TestCameraManager(unittest.TestCase):
+    def wait_for(self, condition, timeout: float = 10) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_rename_moves_live_feed(self):
+        camera = FakeCamera(1, "front", "sim://front?fps=10&motion=0")
+        cameras = [camera]
+        manager = CameraManager()
+        manager.camera_model = SimpleNamespace(
+            objects=SimpleNamespace(all=lambda: list(cameras))
+        )
+        manager.django_settings = SimpleNamespace(MEDIA_ROOT=tempfile.mkdtemp())
+
+        manager.update_camera_list()
+        manager.connect_to_sources()
+        self.assertTrue(self.wait_for(lambda: camera.is_active))
+        self.assertEqual(camera.stream_link, "/media/stream/front/index.m3u8")
+
+        renamed = camera.copy(name="back")
+        cameras[0] = renamed
+        manager.update_source(renamed)
+
+        # The camera reconnects so that its stream is written under the new name
+        self.assertTrue(
+            self.wait_for(
+                lambda: renamed.stream_link == "/media/stream/back/index.m3u8"
+            )
+        )
+        source = manager.cameras[1][1]
+        self.assertEqual(source.name, "back")
+        # Cameras without a minimum motion area use the default of the config
+        self.assertEqual(source.min_motion_area, config.MIN_MOTION_AREA)
+        self.assertTrue(source.source.hls_directory.endswith("/back"))
+        self.assertTrue(self.wait_for(lambda: source.read() is not None))
+
+        manager.detector.stop_detection()
+        manager.supervisor.shutdown()
+        source.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,19 @@
 import os
+from threading import Thread
 from time import sleep
 import unittest
 
 import numpy as np
-from camera import VideoSource, DetectionSource, IntruderDetector
+from camera import (
+    CameraSource,
+    VideoSource,
+    DetectionSource,
+    IntruderDetector,
+    metrics,
+)
+from camera.motion import MotionBlobs
 from config import TEST_VID_DIRECTORY, TEST_VIDEO_OUTPUT_DIRECTORY
+from prometheus_client import generate_latest
 
 
 class TestDetection(unittest.TestCase):
@@ -23,11 +32,39 @@ class TestDetection(unittest.TestCase):
             fg_mask = detection_source.get_foreground_mask(frame)
             self.assertIsInstance(fg_mask, np.ndarray)
 
-            contours = detection_source.find_contours(fg_mask)
-            self.assertIsInstance(contours, list)
+            blobs = detection_source.find_blobs(fg_mask)
+            self.assertIsInstance(blobs, MotionBlobs)
 
         detection_source.stop()
 
+    def test_low_resolution_motion(self):
+        vid_name = os.listdir(TEST_VID_DIRECTORY)[0]
+        vid_source = VideoSource(f"{TEST_VID_DIRECTORY}/{vid_name}")
+        detection_sources = [
+            DetectionSource("Full size", vid_source, motion_frame_size=None),
+            DetectionSource("Low res", vid_source, motion_frame_size=(320, 180)),
+        ]
+
+        for step in range(30):
+            frame = np.full((360, 640, 3), 40, dtype=np.uint8)
+            if step >= 20:
+                # Moving object once the background model has settled
+                x_coord = (step - 20) * 15
+                frame[100:250, x_coord : x_coord + 80] = 255
+            masks = [source.get_foreground_mask(frame) for source in detection_sources]
+
+        self.assertEqual(masks[0].shape, (360, 640))
+        self.assertEqual(masks[1].shape, (180, 320))
+        boxes = [
+            source.get_motion_boxes(source.find_blobs(mask))
+            for source, mask in zip(detection_sources, masks)
+        ]
+        # Boxes are in the coordinates of the frame at both resolutions
+        self.assertEqual(len(boxes[1]), 1)
+        for full_size, low_res in zip(boxes[0][0], boxes[1][0]):
+            self.assertAlmostEqual(full_size, low_res, delta=8)
+        vid_source.stop()
+
     def test_intruder_detector(self):
         vid_names = os.listdir(TEST_VID_DIRECTORY)[:3]
         vid_paths = [f"{TEST_VID_DIRECTORY}/{vid_name}" for vid_name in vid_names]
@@ -60,6 +97,103 @@ class TestDetection(unittest.TestCase):
             os.path.exists(f"{TEST_VIDEO_OUTPUT_DIRECTORY}/detection_intruder_test")
         )
 
+    def test_add_and_remove_sources(self):
+        vid_names = os.listdir(TEST_VID_DIRECTORY)[:2]
+        vid_paths = [f"{TEST_VID_DIRECTORY}/{vid_name}" for vid_name in vid_names]
+        first, second = [
+            DetectionSource(vid_source.name, vid_source)
+            for vid_source in (VideoSource(vid_path) for vid_path in vid_paths)
+        ]
+        recording_directory = f"{TEST_VIDEO_OUTPUT_DIRECTORY}/detection_hot_add_test"
+
+        detector = IntruderDetector(
+            [first],
+            recording_directory,
+            None,
+            None,
+            stop_when_inactive=False,
+        )
+        detect_thread = Thread(target=detector.detect, args=(5,))
+        detect_thread.start()
+        sleep(1)
+        frames_before_add = first.frame_cursor.frames_read
+        self.assertGreater(frames_before_add, 0)
+
+        second.start()
+        detector.add_source(second)
+        sleep(1)
+        self.assertGreater(second.frame_cursor.frames_read, 0)
+        self.assertGreater(first.frame_cursor.frames_read, frames_before_add)
+        self.assertTrue(os.path.exists(f"{recording_directory}/videos/{second.name}"))
+
+        detector.rename_source(second, "renamed")
+        sleep(0.5)
+        self.assertEqual(second.name, "renamed")
+        self.assertTrue(os.path.exists(f"{recording_directory}/videos/renamed"))
+
+        detector.remove_source(second)
+        sleep(0.5)
+        self.assertNotIn(second, detector.detection_sources)
+        frames_after_remove = second.frame_cursor.frames_read
+        sleep(0.5)
+        self.assertEqual(second.frame_cursor.frames_read, frames_after_remove)
+
+        detector.stop_detection()
+        detect_thread.join()
+        first.stop()
+        second.stop()
+
+    def test_idle_pre_roll(self):
+        for num_processes in (0, 1):
+            name = f"idle-{num_processes}"
+            source = DetectionSource(
+                name, CameraSource(name, f"sim://{name}?fps=15&motion=0")
+            )
+            detector = IntruderDetector(
+                [source],
+                f"{TEST_VIDEO_OUTPUT_DIRECTORY}/detection_idle_test",
+                None,
+                None,
+                num_processes=num_processes,
+                stop_when_inactive=False,
+                idle_fps=2,
+            )
+            # Stay at the idle rate while the background model settles, the
+            # motion it sees at first is saved as a recording
+            detector.scheduler.cooldown = 0
+            detect_thread = Thread(target=detector.detect, args=(5,))
+            detect_thread.start()
+            sleep(6)
+            detection_rate = detector.get_detection_rates()[name]
+            pre_roll_length = len(source.pre_roll)
+            detector.stop_detection()
+            detect_thread.join()
+            source.stop()
+
+            # Only a few frames are processed, but the pre-roll has every frame
+            # of the last 2 seconds
+            self.assertLess(detection_rate, 4)
+            self.assertGreater(pre_roll_length, 20)
+
+    def test_short_motion_is_not_saved(self):
+        vid_name = os.listdir(TEST_VID_DIRECTORY)[0]
+        source = DetectionSource(
+            "blip", VideoSource(f"{TEST_VID_DIRECTORY}/{vid_name}")
+        )
+        recording_directory = f"{TEST_VIDEO_OUTPUT_DIRECTORY}/detection_blip_test"
+        detector = IntruderDetector([source], recording_directory, None, None)
+        # Motion in fewer frames than needed to start a recording
+        detector.update_conseq_frames(source, [(10, 10, 50, 50)])
+        detector.update_conseq_frames(source, [])
+        detector.stop_detection()
+
+        self.assertNotIn(
+            'opensec_recordings_saved_total{camera="blip"}',
+            generate_latest(metrics.REGISTRY).decode(),
+        )
+        videos = os.listdir(f"{recording_directory}/videos/blip")
+        self.assertEqual([video for video in videos if video != "intruder.mp4"], [])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,81 @@
+import queue
+import unittest
+
+import numpy as np
+from camera.detection_pool import DetectionProcessPool
+
+
+def make_frame(step: int) -> np.ndarray:
+    frame = np.full((360, 640, 3), 40, dtype=np.uint8)
+    if step >= 20:
+        # Moving object once the background model has settled
+        x_coord = (step - 20) * 15
+        frame[100:250, x_coord : x_coord + 80] = 255
+    return frame
+
+
+class TestDetectionProcessPool(unittest.TestCase):
+    def test_results_come_back_in_order(self):
+        results = queue.Queue()
+        pool = DetectionProcessPool(2, results.put).start()
+        names = ["cam-1", "cam-2", "cam-3"]
+        for name in names:
+            pool.add_source(name)
+
+        received = {name: [] for name in names}
+        for step in range(40):
+            for name in names:
+                self.assertIsNotNone(pool.submit(name, make_frame(step)))
+            # Wait for the results so that no frame gets skipped
+            for _ in names:
+                result = results.get(timeout=30)
+                received[result.name].append(result)
+
+        pool.remove_source("cam-1")
+        pool.stop()
+
+        for name in names:
+            seqs = [result.seq for result in received[name]]
+            self.assertEqual(seqs, list(range(1, 41)))
+            motion_frames = [result for result in received[name] if result.boxes]
+            self.assertGreater(len(motion_frames), 0)
+            self.assertEqual(pool.frames_skipped[name], 0)
+
+    def test_failed_task_does_not_stop_detection(self):
+        results = queue.Queue()
+        pool = DetectionProcessPool(1, results.put).start()
+        pool.add_source("cam")
+        # Malformed zones make the task fail in the worker
+        pool.set_zones("cam", [{"points": "not a polygon"}])
+        try:
+            for step in range(5):
+                seq = pool.submit("cam", make_frame(step))
+                self.assertEqual(results.get(timeout=30).seq, seq)
+        finally:
+            pool.stop()
+
+    def test_dead_worker_is_restarted(self):
+        results = queue.Queue()
+        pool = DetectionProcessPool(1, results.put).start()
+        pool.add_source("cam")
+        try:
+            seq = pool.submit("cam", make_frame(0))
+            self.assertEqual(results.get(timeout=30).seq, seq)
+
+            pool._workers[0].kill()
+            pool._workers[0].join()
+            for step in range(1, 3):
+                pool.submit("cam", make_frame(step))
+            # The frames lost with the worker come back without motion
+            for _ in range(2):
+                self.assertEqual(results.get(timeout=30).boxes, [])
+
+            seq = pool.submit("cam", make_frame(3))
+            self.assertEqual(results.get(timeout=30).seq, seq)
+            self.assertTrue(pool._workers[0].is_alive())
+        finally:
+            pool.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
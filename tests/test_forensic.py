@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import cv2 as cv
+import numpy as np
+from camera.forensic import ForensicScan, make_chunks, merge_events
+
+
+def make_video(path: str, seconds: int, motion: tuple) -> None:
+    """
+    Writes a 15 fps video with an object moving between `motion` seconds
+    """
+    rng = np.random.default_rng(0)
+    writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*"mp4v"), 15, (640, 360))
+    for index in range(seconds * 15):
+        frame = np.full((360, 640, 3), 90, dtype=np.int16)
+        frame += rng.normal(0, 3, frame.shape).astype(np.int16)
+        if motion[0] * 15 <= index < motion[1] * 15:
+            x_coord = (index - motion[0] * 15) * 8
+            frame[120:240, x_coord : x_coord + 60] = 230
+        writer.write(np.clip(frame, 0, 255).astype(np.uint8))
+    writer.release()
+
+
+class TestForensicScan(unittest.TestCase):
+    def test_chunks_and_merging(self):
+        chunks = make_chunks("a.mp4", 100, 10, 4)
+        self.assertEqual(
+            [(c.start_frame, c.end_frame) for c in chunks],
+            [(0, 40), (40, 80), (80, 100)],
+        )
+
+        events = merge_events(
+            [
+                {"start_offset": 4.0, "end_offset": 6.0, "labels": ["person"]},
+                {"start_offset": 1.0, "end_offset": 3.5, "labels": ["cat"]},
+                {"start_offset": 20.0, "end_offset": 21.0, "labels": []},
+            ],
+            max_gap=1,
+        )
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0]["end_offset"], 6.0)
+        self.assertEqual(events[0]["labels"], ["cat", "person"])
+
+    def test_scan_and_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            video_directory = f"{directory}/videos"
+            os.mkdir(video_directory)
+            make_video(f"{video_directory}/cam.mp4", 12, (4, 8))
+            output_directory = f"{directory}/scan"
+
+            # The event crosses the edge of the first chunk
+            scan = ForensicScan(
+                video_directory,
+                output_directory,
+                num_processes=0,
+                analyze=False,
+                chunk_seconds=6,
+            )
+            events = scan.run()
+            self.assertEqual(len(events), 1)
+            self.assertEqual(events[0]["file"], "cam.mp4")
+            self.assertAlmostEqual(events[0]["start_offset"], 4, delta=1)
+            self.assertAlmostEqual(events[0]["end_offset"], 8, delta=1)
+            with open(scan.events_path, encoding="utf-8") as events_file:
+                self.assertEqual(json.load(events_file), events)
+
+            # Chunks in the index are not scanned again
+            index = scan.load_index()
+            self.assertEqual(len(index["cam.mp4"]["chunks"]), 2)
+            index["cam.mp4"]["chunks"]["1"] = []
+            scan.save_index(index)
+            self.assertEqual(len(scan.get_pending_chunks(scan.load_index())), 0)
+            self.assertEqual(scan.run()[0]["end_offset"], 6)
+
+    def test_unreadable_video(self):
+        with tempfile.TemporaryDirectory() as directory:
+            video_directory = f"{directory}/videos"
+            os.mkdir(video_directory)
+            subprocess.run(
+                [
+                    shutil.which("ffmpeg"),
+                    "-y",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    "testsrc=size=320x240:rate=15:duration=2",
+                    "-c:v",
+                    "libx264",
+                    "-pix_fmt",
+                    "yuv420p",
+                    f"{video_directory}/cam.ts",
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+            # A stream cut off before its first frame, whose number of frames
+            # isn't known to OpenCV
+            with open(f"{video_directory}/cam.ts", "rb") as video:
+                header = video.read(564)
+            with open(f"{video_directory}/cut.ts", "wb") as video:
+                video.write(header)
+
+            scan = ForensicScan(
+                video_directory, f"{directory}/scan", num_processes=0, analyze=False
+            )
+            scan.run()
+            index = scan.load_index()
+            self.assertEqual(index["cam.ts"]["num_frames"], 30)
+            # The video is left to be scanned again rather than marked as done
+            self.assertNotIn("cut.ts", index)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+import unittest
+from threading import Event, Timer
+
+import numpy as np
+from camera.frame_buffer import FrameBuffer, PreRollBuffer
+
+
+class TestFrameBuffer(unittest.TestCase):
+    def test_sequence_numbers(self):
+        buffer = FrameBuffer(capacity=4)
+        self.assertIsNone(buffer.latest())
+        for i in range(6):
+            seq = buffer.put(np.full((2, 2, 3), i, dtype=np.uint8))
+            self.assertEqual(seq, i + 1)
+
+        self.assertEqual(buffer.last_seq, 6)
+        self.assertEqual(buffer.latest().seq, 6)
+        self.assertEqual([packet.seq for packet in buffer.get_since(0)], [3, 4, 5, 6])
+        self.assertEqual([packet.seq for packet in buffer.get_since(5)], [6])
+        self.assertEqual(buffer.get_since(6), [])
+
+    def test_frames_are_not_copied(self):
+        buffer = FrameBuffer(capacity=2)
+        frame = np.zeros((2, 2, 3), dtype=np.uint8)
+        buffer.put(frame)
+        self.assertIs(buffer.latest().frame, frame)
+        self.assertIs(buffer.get_since(0)[0].frame, frame)
+
+    def test_derived_views_are_shared(self):
+        buffer = FrameBuffer(capacity=2)
+        frame = np.random.randint(0, 255, (360, 640, 3), dtype=np.uint8)
+        buffer.put(frame)
+        packet = buffer.latest()
+
+        # The frame already has the working size
+        self.assertIs(packet.resized((640, 360)), frame)
+        small = packet.resized((320, 180))
+        self.assertEqual(small.shape, (180, 320, 3))
+        self.assertIs(buffer.latest().resized((320, 180)), small)
+
+        gray = packet.gray((320, 180))
+        self.assertEqual(gray.shape, (180, 320))
+        self.assertIs(packet.gray((320, 180)), gray)
+        self.assertIs(packet.gray((640, 360)), packet.gray())
+
+        # A new frame gets new views
+        buffer.put(frame.copy())
+        self.assertIsNot(buffer.latest().resized((320, 180)), small)
+
+    def test_cursor_counts_dropped_frames(self):
+        buffer = FrameBuffer(capacity=3)
+        cursor = buffer.cursor("test")
+        self.assertFalse(cursor.has_new_frames)
+        self.assertIsNone(cursor.read_latest())
+
+        for _ in range(5):
+            buffer.put(np.zeros((1, 1, 3), dtype=np.uint8))
+        self.assertTrue(cursor.has_new_frames)
+
+        # Frames 1 and 2 were overwritten before the cursor read them
+        packets = cursor.read_new()
+        self.assertEqual([packet.seq for packet in packets], [3, 4, 5])
+        self.assertEqual(cursor.frames_read, 3)
+        self.assertEqual(cursor.frames_dropped, 2)
+
+        # The same frame is never returned twice
+        self.assertEqual(cursor.read_new(), [])
+        self.assertIsNone(cursor.read_latest())
+
+        for _ in range(3):
+            buffer.put(np.zeros((1, 1, 3), dtype=np.uint8))
+        self.assertEqual(cursor.read_latest().seq, 8)
+        self.assertEqual(cursor.frames_read, 4)
+        self.assertEqual(cursor.frames_dropped, 4)
+
+    def test_clear_keeps_sequence(self):
+        buffer = FrameBuffer(capacity=3)
+        cursor = buffer.cursor("test")
+        buffer.put(np.zeros((1, 1, 3), dtype=np.uint8))
+        buffer.clear()
+        self.assertIsNone(buffer.latest())
+        self.assertEqual(cursor.read_new(), [])
+        self.assertEqual(buffer.put(np.zeros((1, 1, 3), dtype=np.uint8)), 2)
+
+    def test_wait_for_frame(self):
+        buffer = FrameBuffer(capacity=3)
+        cursor = buffer.cursor("test")
+        self.assertFalse(cursor.wait(timeout=0.01))
+
+        Timer(0.05, buffer.put, args=(np.zeros((1, 1, 3), dtype=np.uint8),)).start()
+        self.assertTrue(cursor.wait(timeout=5))
+        self.assertEqual(cursor.read_latest().seq, 1)
+        self.assertIsNotNone(cursor.last_timestamp)
+
+    def test_listeners_are_notified(self):
+        buffers = [FrameBuffer(capacity=3) for _ in range(2)]
+        listener = Event()
+        for buffer in buffers:
+            buffer.subscribe(listener)
+
+        buffers[1].put(np.zeros((1, 1, 3), dtype=np.uint8))
+        self.assertTrue(listener.is_set())
+
+        listener.clear()
+        buffers[1].unsubscribe(listener)
+        buffers[1].put(np.zeros((1, 1, 3), dtype=np.uint8))
+        self.assertFalse(listener.is_set())
+        buffers[0].clear()
+        self.assertTrue(listener.is_set())
+
+
+class TestPreRollBuffer(unittest.TestCase):
+    def test_keeps_last_seconds_compressed(self):
+        pre_roll = PreRollBuffer(seconds=1, fps=5)
+        frames = [np.full((360, 640, 3), i * 20, dtype=np.uint8) for i in range(8)]
+        for i, frame in enumerate(frames):
+            pre_roll.push(frame, float(i), [(i, i, 10, 10)])
+
+        self.assertEqual(len(pre_roll), 5)
+        self.assertLess(pre_roll.nbytes, frames[0].nbytes // 20)
+
+        drained = pre_roll.drain()
+        self.assertEqual(len(pre_roll), 0)
+        self.assertEqual([info[0] for _, info in drained], [3.0, 4.0, 5.0, 6.0, 7.0])
+        for (frame, _), original in zip(drained, frames[3:]):
+            self.assertEqual(frame.shape, original.shape)
+            self.assertLess(np.abs(frame.astype(int) - original).max(), 5)
+
+    def test_keeps_frames_without_encoding(self):
+        pre_roll = PreRollBuffer(seconds=1, fps=5)
+        frames = [np.full((360, 640, 3), i * 20, dtype=np.uint8) for i in range(3)]
+        pre_roll.push(frames[0], 0.0)
+        for i, frame in enumerate(frames[1:], 1):
+            pre_roll.push(frame, float(i), encode=False)
+
+        self.assertGreater(pre_roll.nbytes, 2 * frames[1].nbytes)
+        drained = pre_roll.drain()
+        self.assertEqual([info[0] for _, info in drained], [0.0, 1.0, 2.0])
+        # Frames that weren't encoded are not copied either
+        self.assertIs(drained[1][0], frames[1])
+        self.assertIs(drained[2][0], frames[2])
+        self.assertLess(np.abs(drained[0][0].astype(int) - frames[0]).max(), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
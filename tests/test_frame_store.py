@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+from camera.frame_store import CompactFrameStore
+
+
+def make_frame(x_coord: int) -> np.ndarray:
+    frame = np.zeros((360, 640, 3), dtype=np.uint8)
+    frame[100:250, x_coord : x_coord + 80] = 200
+    return frame
+
+
+class TestCompactFrameStore(unittest.TestCase):
+    def test_frames_are_stored_compressed(self):
+        store = CompactFrameStore(memory_budget=10**9, max_frames_per_source=5)
+        frames = [make_frame(i * 50) for i in range(7)]
+        for i, frame in enumerate(frames):
+            store.add("cam", frame, motion_energy=float(i), motion_boxes=[(i, 0, 1, 1)])
+
+        self.assertEqual(store.num_frames("cam"), 5)
+        self.assertLess(
+            store.memory_used, sum(frame.nbytes for frame in frames[:5]) // 20
+        )
+
+        stored = store.get_frames("cam")
+        self.assertEqual(len(stored), 5)
+        self.assertEqual(stored.motion_energy, [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(stored.motion_boxes[2], [(2, 0, 1, 1)])
+        self.assertLess(np.abs(stored[3].astype(int) - frames[3]).mean(), 2)
+
+        store.clear("cam")
+        self.assertEqual(store.num_frames("cam"), 0)
+        self.assertEqual(store.memory_used, 0)
+
+    def test_budget_evicts_low_motion_frames_of_largest_source(self):
+        # Room for about six frames
+        probe = CompactFrameStore(memory_budget=10**9)
+        probe.add("probe", make_frame(0))
+        budget = probe.memory_used * 6
+        store = CompactFrameStore(memory_budget=budget)
+
+        for i in range(6):
+            store.add("busy", make_frame(i * 50), motion_energy=float(i % 3))
+        for i in range(2):
+            store.add("quiet", make_frame(i * 50), motion_energy=1.0)
+
+        self.assertLessEqual(store.memory_used, budget)
+        self.assertGreater(store.frames_evicted, 0)
+        usage = store.get_memory_usage()
+        self.assertEqual(len(store.get_frames("quiet")), 2)
+        self.assertGreater(usage["busy"], usage["quiet"])
+        # The frames with the least motion were evicted first
+        self.assertNotIn(0.0, store.get_frames("busy").motion_energy)
+        # Evicted frames still count towards the length of the recording
+        self.assertEqual(store.num_frames("busy"), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+import config
+import numpy as np
+from camera.ingest import StreamIngest, get_rtsp_input_args
+
+
+class TestStreamIngest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # H.264 stream standing in for a camera
+        self.stream_path = f"{self.directory}/stream.mp4"
+        subprocess.run(
+            [
+                shutil.which("ffmpeg"),
+                "-y",
+                "-f",
+                "lavfi",
+                "-i",
+                "testsrc=size=1280x720:rate=15:duration=3",
+                "-c:v",
+                "libx264",
+                "-g",
+                "15",
+                "-pix_fmt",
+                "yuv420p",
+                self.stream_path,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_one_connection_feeds_every_output(self):
+        ingest = StreamIngest(
+            self.stream_path,
+            hls_directory=f"{self.directory}/hls",
+            segment_directory=f"{self.directory}/segments",
+            frame_size=(640, 360),
+            read_timeout=5,
+            segment_seconds=1,
+            input_args=["-re"],
+        ).start()
+
+        frames = []
+        while True:
+            frame = ingest.read()
+            if frame is None:
+                break
+            frames.append(frame)
+        ingest.stop()
+
+        # Frames may be dropped when the reader falls behind
+        self.assertGreater(len(frames), 30)
+        self.assertEqual(frames[0].shape, (360, 640, 3))
+        self.assertEqual(frames[0].dtype, np.uint8)
+        self.assertTrue(os.path.exists(f"{self.directory}/hls/index.m3u8"))
+        self.assertGreater(len(os.listdir(f"{self.directory}/segments")), 0)
+        self.assertFalse(ingest.is_running)
+
+    def test_low_latency_live_view(self):
+        hls_directory = f"{self.directory}/hls"
+        ingest = StreamIngest(
+            self.stream_path,
+            hls_directory=hls_directory,
+            low_latency=True,
+            read_timeout=5,
+            input_args=["-re"],
+        )
+        self.assertIn("fmp4", ingest.get_args())
+        ingest.start()
+        start = time.monotonic()
+
+        # The stream is read in real time, so the frame at time t of the stream
+        # stands in for one captured t seconds after the start. The newest
+        # frame a player can load is at the end of the published segments, and
+        # its age against the wall clock is how far the live view lags behind
+        # the camera, not counting the buffer of the player
+        ages = []
+        ended = False
+        playlist_path = f"{hls_directory}/index.m3u8"
+        while not ended and time.monotonic() - start < 10:
+            published = 0.0
+            if os.path.exists(playlist_path):
+                with open(playlist_path, encoding="utf-8") as playlist:
+                    lines = playlist.read().splitlines()
+                # The 3 s stream fits in the playlist, so every segment is listed
+                published = sum(
+                    float(line[len("#EXTINF:") :].rstrip(","))
+                    for line in lines
+                    if line.startswith("#EXTINF:")
+                )
+                ended = "#EXT-X-ENDLIST" in lines
+            if not ended:
+                ages.append(time.monotonic() - start - published)
+            time.sleep(0.05)
+        ingest.stop()
+
+        # The live view lags by about one segment. With the default 10 s
+        # segments nothing would be published before the 3 s stream ends
+        self.assertTrue(ended)
+        self.assertLess(max(ages), config.LOW_LATENCY_SEGMENT_DURATION + 0.5)
+
+    def test_rtsp_timeout_args(self):
+        # ffmpeg 4 waits for an incoming connection if it is given -timeout
+        self.assertEqual(
+            get_rtsp_input_args(2, 4),
+            ["-rtsp_transport", "tcp", "-stimeout", "2000000"],
+        )
+        self.assertEqual(
+            get_rtsp_input_args(2, 5),
+            ["-rtsp_transport", "tcp", "-timeout", "2000000"],
+        )
+        self.assertIn("-timeout", get_rtsp_input_args(2, None))
+
+        args = StreamIngest("rtsp://camera/stream", read_timeout=3).get_args()
+        self.assertIn("3000000", args)
+        self.assertLess(args.index("3000000"), args.index("-i"))
+        # Files and other URLs get no RTSP options
+        self.assertNotIn("-rtsp_transport", StreamIngest(self.stream_path).get_args())
+
+    def test_end_of_stream(self):
+        ingest = StreamIngest(
+            self.stream_path, read_timeout=0.5, input_args=["-re", "-ss", "100"]
+        ).start()
+        start = time.monotonic()
+        frame = ingest.read()
+        ingest.stop()
+        # The stream ends without frames
+        self.assertIsNone(frame)
+        self.assertLess(time.monotonic() - start, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
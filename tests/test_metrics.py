@@ -0,0 +1,107 @@
+import time
+import unittest
+
+from camera import CameraSource, DetectionSource, metrics
+from camera.metrics import CallbackGauge
+from prometheus_client import CollectorRegistry, generate_latest
+
+
+def get_sample(name: str, registry=metrics.REGISTRY, **labels) -> float | None:
+    """
+    Returns the value of a sample of a registry, the global one by default
+    """
+    label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    prefix = f"{name}{{{label_text}}} " if labels else f"{name} "
+    for line in generate_latest(registry).decode().splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix) :])
+    return None
+
+
+class TestMetrics(unittest.TestCase):
+    def test_gauge_callbacks(self):
+        class Owner:
+            depth = 2
+
+        registry = CollectorRegistry()
+        gauge = CallbackGauge("depth", "Depth", ("camera",), registry=registry)
+        owner = Owner()
+        gauge.add_callback(owner, lambda owner: {("cam",): owner.depth})
+        self.assertIn("# TYPE depth gauge", generate_latest(registry).decode())
+        self.assertEqual(get_sample("depth", registry, camera="cam"), 2)
+
+        # Callbacks don't keep their owner alive
+        del owner
+        self.assertIsNone(get_sample("depth", registry, camera="cam"))
+
+        with self.assertRaises(ValueError):
+            CallbackGauge("depth", "Depth again", registry=registry)
+
+    def test_failing_callback(self):
+        class Owner:
+            pass
+
+        registry = CollectorRegistry()
+        gauge = CallbackGauge("depth", "Depth", registry=registry)
+        owners = [Owner(), Owner()]
+        gauge.add_callback(owners[0], lambda owner: {(): 1 / 0})
+        gauge.add_callback(owners[1], lambda owner: {(): 3})
+
+        # The other callbacks are still reported
+        self.assertEqual(get_sample("depth", registry), 3)
+
+    def test_camera_metrics(self):
+        camera = CameraSource("metrics-cam", "sim://metrics-cam?fps=20&motion=0")
+        source = DetectionSource("metrics-cam", camera)
+        source.start()
+        time.sleep(0.5)
+        self.assertIsNotNone(source.read_new())
+        time.sleep(0.3)
+        source.read_new()
+
+        self.assertGreater(
+            get_sample("opensec_frames_captured_total", camera="metrics-cam"), 5
+        )
+        # Frames that arrived between the two reads were skipped
+        self.assertGreater(
+            get_sample("opensec_frames_dropped_total", camera="metrics-cam"), 0
+        )
+        self.assertEqual(
+            get_sample(
+                "opensec_camera_connection_attempts_total",
+                camera="metrics-cam",
+                result="success",
+            ),
+            1,
+        )
+        self.assertEqual(
+            get_sample("opensec_camera_connected", camera="metrics-cam"), 1
+        )
+
+        source.stop()
+        self.assertIsNone(get_sample("opensec_camera_connected", camera="metrics-cam"))
+
+    def test_remove_camera(self):
+        metrics.FRAMES_CAPTURED.labels("remove-front").inc()
+        metrics.FRAMES_CAPTURED.labels("remove-back").inc()
+        metrics.CAMERA_CONNECTS.labels("remove-front", "success").inc()
+        metrics.CAMERA_CONNECTS.labels("remove-front", "failure").inc()
+        metrics.ANALYSIS_JOBS.labels("remove-front").inc()
+
+        metrics.remove_camera("remove-front")
+        text = generate_latest(metrics.REGISTRY).decode()
+        self.assertNotIn('camera="remove-front"', text)
+        self.assertEqual(
+            get_sample("opensec_frames_captured_total", camera="remove-back"), 1
+        )
+        # Metrics without a camera label are left alone
+        self.assertEqual(
+            get_sample("opensec_analysis_jobs_total", result="remove-front"), 1
+        )
+
+        metrics.remove_camera("remove-back")
+        metrics.ANALYSIS_JOBS.remove("remove-front")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+
+import cv2 as cv
+import numpy as np
+from camera.motion import BatchedMotionEngine, find_blobs
+from camera.zones import DetectionZones
+
+
+def make_frame(step: int, moving: bool) -> np.ndarray:
+    frame = np.full((180, 320), 40, dtype=np.uint8)
+    if moving and step >= 5:
+        x_coord = (step - 5) * 8
+        frame[50:125, x_coord : x_coord + 40] = 255
+    return frame
+
+
+class TestBatchedMotionEngine(unittest.TestCase):
+    def test_only_moving_cameras_get_a_mask(self):
+        engine = BatchedMotionEngine()
+        names = [f"cam-{i}" for i in range(12)]
+        for step in range(10):
+            fractions = engine.process(
+                {name: make_frame(step, name == "cam-3") for name in names}
+            )
+
+        self.assertEqual(engine.sources, names)
+        self.assertGreater(fractions["cam-3"], engine.gate_threshold)
+        self.assertTrue(engine.has_motion("cam-3"))
+        for name in names:
+            if name != "cam-3":
+                self.assertEqual(fractions[name], 0)
+                self.assertFalse(engine.has_motion(name))
+
+        frame = make_frame(10, True)
+        engine.process({"cam-3": frame, "cam-4": make_frame(10, False)})
+        mask = engine.get_foreground_mask("cam-3", frame)
+        self.assertEqual(mask.shape, (180, 320))
+        # The object is at x 40 to 80, the slow background leaves a trail
+        x_coord, y_coord, width, height = cv.boundingRect(mask)
+        self.assertLessEqual(x_coord, 40)
+        self.assertGreaterEqual(x_coord + width, 80)
+        self.assertAlmostEqual(y_coord, 50, delta=4)
+        self.assertAlmostEqual(height, 75, delta=8)
+
+    def test_frames_outside_a_batch(self):
+        engine = BatchedMotionEngine()
+        for step in range(10):
+            frame = make_frame(step, True)
+            mask = engine.get_foreground_mask("cam", frame)
+        self.assertGreater(cv.countNonZero(mask), 0)
+
+    def test_zones_apply_before_the_gate(self):
+        engine = BatchedMotionEngine()
+        # The object moves through the left of the frame only
+        right_half = DetectionZones(
+            [{"kind": "include", "points": [[0.5, 0], [1, 0], [1, 1], [0.5, 1]]}]
+        )
+        for step in range(10):
+            frame = make_frame(step, True)
+            fractions = engine.process(
+                {"zoned": frame, "open": frame}, {"zoned": right_half}
+            )
+
+        self.assertEqual(fractions["zoned"], 0)
+        self.assertFalse(engine.has_motion("zoned"))
+        self.assertEqual(cv.countNonZero(engine.get_foreground_mask("zoned", frame)), 0)
+        self.assertTrue(engine.has_motion("open"))
+
+    def test_sources(self):
+        engine = BatchedMotionEngine()
+        engine.process({"a": make_frame(0, False), "b": make_frame(0, False)})
+        engine.rename_source("a", "c")
+        engine.remove_source("b")
+        self.assertEqual(engine.sources, ["c"])
+        with self.assertRaises(ValueError):
+            engine.process({"d": np.zeros((90, 160), dtype=np.uint8)})
+
+
+class TestFindBlobs(unittest.TestCase):
+    def test_blob_table(self):
+        mask = np.zeros((180, 320), dtype=np.uint8)
+        mask[10:20, 10:20] = 255
+        mask[100:150, 200:260] = 255
+        mask[50:80, 50:70] = 255
+        # Single pixels of noise
+        mask[170, ::4] = 255
+
+        blobs = find_blobs(mask, min_area=50)
+        self.assertEqual(len(blobs), 3)
+        self.assertEqual(blobs.areas.tolist(), [3000, 600, 100])
+        self.assertEqual(blobs.box_list()[0], (200, 100, 60, 50))
+        np.testing.assert_allclose(blobs.centroids[1], (59.5, 64.5))
+
+        scaled = blobs.scaled((2.0, 2.0))
+        self.assertEqual(scaled.box_list()[0], (400, 200, 120, 100))
+        self.assertEqual(scaled.areas[0], 12000)
+        self.assertEqual(len(find_blobs(mask, min_area=5000)), 0)
+        self.assertEqual(len(find_blobs(np.zeros_like(mask), min_area=0)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
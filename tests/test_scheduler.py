@@ -0,0 +1,59 @@
+import unittest
+
+from camera.scheduler import DetectionScheduler
+
+
+class TestDetectionScheduler(unittest.TestCase):
+    def run_camera(self, scheduler, name, start, seconds, motion=lambda now: False):
+        """
+        Feeds a 15 fps camera to the scheduler, returns the number of
+        frames processed
+        """
+        processed = 0
+        for frame in range(int(seconds * 15)):
+            now = start + frame / 15
+            if scheduler.should_process(name, now):
+                scheduler.mark_processed(name, now)
+                scheduler.update_activity(name, motion(now), now)
+                processed += 1
+        return processed
+
+    def test_idle_cameras_run_at_idle_rate(self):
+        scheduler = DetectionScheduler(idle_fps=3, cooldown=2)
+        processed = self.run_camera(scheduler, "cam", 0, 10)
+        self.assertLessEqual(processed, 31)
+        self.assertGreaterEqual(processed, 29)
+        self.assertAlmostEqual(scheduler.get_rates(10)["cam"], 3, delta=0.6)
+
+    def test_motion_switches_to_full_rate_until_cooldown(self):
+        scheduler = DetectionScheduler(idle_fps=2, cooldown=2, rate_window=1)
+        # Motion between 1 and 3 seconds
+        processed = self.run_camera(
+            scheduler, "cam", 0, 4, motion=lambda now: 1 <= now < 3
+        )
+        self.assertTrue(scheduler.is_active("cam", 4))
+        self.assertAlmostEqual(scheduler.get_rates(4)["cam"], 15, delta=1)
+        # The first motion frame is only seen at the idle rate
+        self.assertGreaterEqual(processed, 2 + 15 * 3 - 8)
+
+        self.run_camera(scheduler, "cam", 4, 6)
+        self.assertFalse(scheduler.is_active("cam", 10))
+        self.assertLess(scheduler.get_rates(10)["cam"], 3)
+
+    def test_disabled(self):
+        scheduler = DetectionScheduler(idle_fps=0)
+        self.assertEqual(self.run_camera(scheduler, "cam", 0, 2), 30)
+
+    def test_sources(self):
+        scheduler = DetectionScheduler(idle_fps=2, cooldown=2)
+        scheduler.update_activity("a", True, 0)
+        scheduler.mark_processed("a", 0)
+        scheduler.rename_source("a", "b")
+        self.assertTrue(scheduler.is_active("b", 1))
+        scheduler.remove_source("b")
+        self.assertFalse(scheduler.is_active("b", 1))
+        self.assertEqual(scheduler.get_rates(1), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
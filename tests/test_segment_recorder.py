@@ -0,0 +1,86 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+import cv2 as cv
+from camera.segment_recorder import SEGMENT_NAME_FORMAT, SegmentRecorder
+
+
+class TestSegmentRecorder(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # H.264 stream with a keyframe every second, standing in for a camera
+        self.stream_path = f"{self.directory}/stream.mp4"
+        subprocess.run(
+            [
+                shutil.which("ffmpeg"),
+                "-y",
+                "-f",
+                "lavfi",
+                "-i",
+                "testsrc=size=640x360:rate=15:duration=20",
+                "-c:v",
+                "libx264",
+                "-g",
+                "15",
+                "-pix_fmt",
+                "yuv420p",
+                self.stream_path,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_clip_is_cut_without_reencoding(self):
+        recorder = SegmentRecorder(
+            self.stream_path,
+            f"{self.directory}/segments",
+            segment_seconds=2,
+            buffer_seconds=60,
+            # Read the file at the speed of a live camera
+            input_args=["-re"],
+        ).start()
+
+        time.sleep(3)
+        start = time.time()
+        time.sleep(2)
+        clip_path = f"{self.directory}/clip.mp4"
+        clip = recorder.save_clip(start, time.time(), clip_path)
+        recorder.stop()
+        self.assertEqual(clip.result(), clip_path)
+
+        self.assertTrue(os.path.exists(clip_path))
+        clip = cv.VideoCapture(clip_path)
+        num_frames = int(clip.get(cv.CAP_PROP_FRAME_COUNT))
+        clip.release()
+        # The clip covers whole segments around the 2 seconds that were asked for
+        self.assertGreaterEqual(num_frames, 2 * 15)
+        self.assertFalse(os.path.exists(f"{self.directory}/segments"))
+
+    def test_missing_video(self):
+        # Segments written by another process, none of them of the clip
+        segment_directory = f"{self.directory}/segments"
+        os.makedirs(segment_directory)
+        for offset in (60, 62):
+            name = datetime.fromtimestamp(time.time() + offset).strftime(
+                SEGMENT_NAME_FORMAT
+            )
+            open(f"{segment_directory}/{name}.mkv", "wb").close()
+        recorder = SegmentRecorder(None, segment_directory)
+
+        clip_path = f"{self.directory}/clip.mp4"
+        clip = recorder.save_clip(time.time() - 10, time.time(), clip_path)
+        self.assertIsNone(clip.result(timeout=10))
+        self.assertFalse(os.path.exists(clip_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import queue
+import time
+import unittest
+from threading import Event
+
+from camera import CameraSource
+from camera.simulated import SimulatedStream, SimulationSettings
+from camera.supervisor import ConnectionSupervisor
+
+
+class TestSimulatedCamera(unittest.TestCase):
+    def test_settings(self):
+        settings = SimulationSettings(
+            "sim://cam?size=320x180&fps=10&motion=2/10&stall=5/1&seed=0"
+        )
+        self.assertEqual(settings.frame_size, (320, 180))
+        self.assertEqual(settings.fps, 10)
+        self.assertTrue(settings.has_motion(21))
+        self.assertFalse(settings.has_motion(23))
+        self.assertTrue(settings.is_stalled(4.5))
+        self.assertFalse(settings.is_stalled(3))
+        with self.assertRaises(ValueError):
+            SimulationSettings("sim://cam?motion=a/b")
+        with self.assertRaises(ValueError):
+            SimulationSettings("rtsp://cam")
+
+    def test_motion_schedule(self):
+        stream = SimulatedStream(SimulationSettings("sim://cam?motion=2/10&seed=0"))
+        still = stream.make_frame(0, 5)
+        moving = stream.make_frame(0, 11)
+        self.assertEqual(still.shape, (360, 640, 3))
+        self.assertEqual(still.tolist(), stream.make_frame(0, 6).tolist())
+        self.assertNotEqual(still.tolist(), moving.tolist())
+
+    def test_stall_and_disconnect(self):
+        stream = SimulatedStream(
+            SimulationSettings("sim://cam?fps=20&stall=1/0.6&disconnect=1.5"),
+            read_timeout=0.4,
+        ).start()
+        self.assertIsNotNone(stream.read())
+        with self.assertRaises(queue.Empty):
+            while True:
+                stream.read()
+        # The stream ends after 1.5 seconds
+        time.sleep(1.2)
+        while stream.read() is not None:
+            pass
+        stream.stop()
+
+    def test_camera_source(self):
+        self.assertEqual(
+            CameraSource.validate_source_url("sim://cam?fps=5"), "sim://cam?fps=5"
+        )
+        with self.assertRaises(ValueError):
+            CameraSource.validate_source_url("http://cam")
+
+        camera = CameraSource("sim-cam", "sim://cam?size=320x180&fps=20").start()
+        time.sleep(0.5)
+        # Frames are scaled to the working resolution
+        self.assertEqual(camera.read().shape, (360, 640, 3))
+        self.assertTrue(camera.hls_directory.endswith("sim-cam"))
+        camera.stop()
+
+    def test_reconnects_through_supervisor(self):
+        supervisor = ConnectionSupervisor(base_delay=0.1, max_delay=0.2)
+        camera = CameraSource(
+            "sim-cam", "sim://cam?fps=20&disconnect=0.5&fail=0.3", connect=False
+        )
+        connected = Event()
+        connections = []
+
+        def on_connected(source):
+            connections.append(time.monotonic())
+            source.start()
+            if len(connections) == 3:
+                connected.set()
+
+        supervisor.watch("cam", camera, on_connected)
+        self.assertTrue(connected.wait(timeout=10))
+        supervisor.shutdown()
+        camera.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import time
+import unittest
+from threading import Event, Lock
+
+from camera.supervisor import ConnectionSupervisor
+
+
+class FakeCamera:
+    """
+    Stands in for a CameraSource whose connection takes `delay` seconds and
+    fails `failures` times before succeeding
+    """
+
+    def __init__(self, name: str, delay: float = 0.0, failures: int = 0):
+        self.name = name
+        self.delay = delay
+        self.failures = failures
+        self.attempts = 0
+        self.is_connected = False
+        self.on_disconnect = None
+        self.connected = Event()
+
+    def connect(self):
+        self.attempts += 1
+        time.sleep(self.delay)
+        if self.attempts <= self.failures:
+            raise RuntimeError(f"ERROR: Could not connect to camera {self.name}.")
+        self.is_connected = True
+
+    def stop(self):
+        self.is_connected = False
+
+    def disconnect(self):
+        self.is_connected = False
+        self.on_disconnect(self)
+
+
+class TestConnectionSupervisor(unittest.TestCase):
+    def test_cameras_connect_concurrently(self):
+        supervisor = ConnectionSupervisor(max_concurrent=8)
+        cameras = [FakeCamera(f"cam-{i}", delay=0.5) for i in range(8)]
+
+        start = time.monotonic()
+        for camera in cameras:
+            supervisor.watch(camera.name, camera, lambda cam: cam.connected.set())
+        for camera in cameras:
+            self.assertTrue(camera.connected.wait(timeout=5))
+
+        # Connecting one after the other would take 4 seconds
+        self.assertLess(time.monotonic() - start, 2)
+        supervisor.shutdown()
+
+    def test_concurrency_limit(self):
+        supervisor = ConnectionSupervisor(max_concurrent=2)
+        running = []
+        lock = Lock()
+
+        class CountingCamera(FakeCamera):
+            def connect(self):
+                with lock:
+                    running.append(1)
+                    self.max_running = len(running)
+                time.sleep(0.1)
+                with lock:
+                    running.pop()
+                self.is_connected = True
+
+        cameras = [CountingCamera(f"cam-{i}") for i in range(6)]
+        for camera in cameras:
+            supervisor.watch(camera.name, camera, lambda cam: cam.connected.set())
+        for camera in cameras:
+            self.assertTrue(camera.connected.wait(timeout=5))
+        self.assertLessEqual(max(camera.max_running for camera in cameras), 2)
+        supervisor.shutdown()
+
+    def test_offline_camera_does_not_block_others(self):
+        supervisor = ConnectionSupervisor(base_delay=0.05, max_delay=0.2)
+        offline = FakeCamera("offline", failures=3)
+        online = FakeCamera("online")
+
+        supervisor.watch(offline.name, offline, lambda cam: cam.connected.set())
+        supervisor.watch(online.name, online, lambda cam: cam.connected.set())
+
+        self.assertTrue(online.connected.wait(timeout=1))
+        self.assertTrue(offline.connected.wait(timeout=5))
+        self.assertEqual(offline.attempts, 4)
+        self.assertEqual(supervisor.get_status()["offline"]["failed_attempts"], 0)
+        supervisor.shutdown()
+
+    def test_unexpected_errors_are_retried(self):
+        supervisor = ConnectionSupervisor(base_delay=0.05, max_delay=0.1)
+
+        class BrokenCamera(FakeCamera):
+            def connect(self):
+                if self.attempts < 2:
+                    self.attempts += 1
+                    raise OSError("Network is unreachable")
+                super().connect()
+
+        camera = BrokenCamera("broken")
+        supervisor.watch(camera.name, camera, lambda cam: cam.connected.set())
+        self.assertTrue(camera.connected.wait(timeout=5))
+        self.assertEqual(camera.attempts, 3)
+        self.assertFalse(supervisor.get_status()["broken"]["connecting"])
+        supervisor.shutdown()
+
+    def test_reconnect_after_disconnect(self):
+        supervisor = ConnectionSupervisor(base_delay=0.05)
+        camera = FakeCamera("cam")
+        disconnected = Event()
+        supervisor.watch(
+            camera.name,
+            camera,
+            lambda cam: cam.connected.set(),
+            lambda cam: disconnected.set(),
+        )
+        self.assertTrue(camera.connected.wait(timeout=1))
+
+        camera.connected.clear()
+        camera.disconnect()
+        self.assertTrue(disconnected.is_set())
+        self.assertTrue(camera.connected.wait(timeout=2))
+        self.assertEqual(camera.attempts, 2)
+        supervisor.shutdown()
+
+    def test_unwatch_stops_retries(self):
+        supervisor = ConnectionSupervisor(base_delay=0.05, max_delay=0.05)
+        camera = FakeCamera("cam", failures=1000)
+        supervisor.watch(camera.name, camera, lambda cam: cam.connected.set())
+        time.sleep(0.2)
+        supervisor.unwatch(camera.name)
+        attempts = camera.attempts
+        time.sleep(0.3)
+        self.assertFalse(supervisor.is_watching(camera.name))
+        self.assertLessEqual(camera.attempts, attempts + 1)
+        supervisor.shutdown()
+
+    def test_backoff_grows_with_jitter(self):
+        supervisor = ConnectionSupervisor(base_delay=1, max_delay=16)
+        for attempts, delay in [(0, 1), (1, 2), (3, 8), (10, 16)]:
+            backoff = supervisor.get_backoff(attempts)
+            self.assertGreaterEqual(backoff, delay / 2)
+            self.assertLessEqual(backoff, delay)
+        supervisor.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import unittest
+from threading import Thread
+from time import sleep
+
+from camera import DetectionSource, IntruderDetector, VideoSource
+from camera.tracing import TRACER, Tracer
+from config import TEST_VID_DIRECTORY, TEST_VIDEO_OUTPUT_DIRECTORY
+
+
+class TestTracing(unittest.TestCase):
+    def test_disabled(self):
+        tracer = Tracer(sample_rate=0)
+        with tracer.tick():
+            with tracer.span("motion", "cam"):
+                pass
+        self.assertEqual(tracer.get_spans(), [])
+
+    def test_ticks(self):
+        tracer = Tracer(sample_rate=1)
+        for _ in range(2):
+            with tracer.tick():
+                with tracer.span("motion", "cam"):
+                    pass
+                with tracer.span("record", "cam"):
+                    pass
+
+        spans = tracer.get_spans()
+        self.assertEqual(
+            [(span.name, span.tick) for span in spans],
+            [
+                ("motion", 1),
+                ("record", 1),
+                ("tick", 1),
+                ("motion", 2),
+                ("record", 2),
+                ("tick", 2),
+            ],
+        )
+        # The tick contains its spans
+        tick = spans[2]
+        for span in spans[:2]:
+            self.assertGreaterEqual(span.start, tick.start)
+            self.assertLessEqual(span.start + span.duration, tick.start + tick.duration)
+
+    def test_sampling(self):
+        tracer = Tracer(sample_rate=0.5)
+        for _ in range(200):
+            with tracer.tick():
+                with tracer.span("motion", "cam"):
+                    pass
+
+        spans = tracer.get_spans()
+        ticks = [span.tick for span in spans if span.name == "tick"]
+        self.assertTrue(50 < len(ticks) < 150)
+        # Sampled ticks have all of their spans, the others none of them
+        self.assertEqual(ticks, [span.tick for span in spans if span.name == "motion"])
+
+        with self.assertRaises(ValueError):
+            tracer.set_sample_rate(2)
+
+    def test_ring(self):
+        tracer = Tracer(sample_rate=1, capacity=3)
+        for index in range(5):
+            with tracer.span(f"span-{index}"):
+                pass
+        self.assertEqual(
+            [span.name for span in tracer.get_spans()], ["span-2", "span-3", "span-4"]
+        )
+
+    def test_chrome_trace(self):
+        tracer = Tracer(sample_rate=1)
+        with tracer.tick():
+            with tracer.span("find_blobs", "cam"):
+                pass
+
+        trace = json.loads(json.dumps(tracer.to_chrome_trace()))
+        events = trace["traceEvents"]
+        self.assertEqual(events[0]["ph"], "M")
+        span = next(event for event in events if event["name"] == "find_blobs")
+        self.assertEqual(span["ph"], "X")
+        self.assertEqual(span["args"], {"camera": "cam", "tick": 1})
+        self.assertGreaterEqual(span["dur"], 0)
+
+    def test_detection_loop(self):
+        vid_name = os.listdir(TEST_VID_DIRECTORY)[0]
+        source = DetectionSource(
+            "traced", VideoSource(f"{TEST_VID_DIRECTORY}/{vid_name}")
+        )
+        detector = IntruderDetector(
+            [source],
+            f"{TEST_VIDEO_OUTPUT_DIRECTORY}/tracing_test",
+            None,
+            None,
+            stop_when_inactive=False,
+            idle_fps=0,
+        )
+        TRACER.clear()
+        TRACER.set_sample_rate(1)
+        try:
+            detect_thread = Thread(target=detector.detect, args=(5,))
+            detect_thread.start()
+            sleep(1)
+            detector.stop_detection()
+            detect_thread.join()
+        finally:
+            TRACER.set_sample_rate(0)
+            source.stop()
+
+        names = {span.name for span in TRACER.get_spans() if span.camera == "traced"}
+        self.assertTrue(
+            {"read", "get_foreground_mask", "find_blobs", "check_for_intruders"}
+            <= names
+        )
+        TRACER.clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
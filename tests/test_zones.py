@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+from camera.zones import DetectionZones, parse_zones
+
+TRIANGLE = [[0.0, 0.0], [0.5, 0.0], [0.0, 0.5]]
+RIGHT_HALF = [[0.5, 0.0], [1.0, 0.0], [1.0, 1.0], [0.5, 1.0]]
+
+
+class TestDetectionZones(unittest.TestCase):
+    def test_parse_errors(self):
+        for data in (
+            {"kind": "exclude"},
+            [{"kind": "ignore", "points": TRIANGLE}],
+            [{"kind": "exclude", "points": TRIANGLE[:2]}],
+            [{"kind": "exclude", "points": [[0, 0], [1, 0], ["a", 1]]}],
+            [{"kind": "exclude", "points": [[0, 0], [1, 0], [1, 2]]}],
+        ):
+            with self.assertRaises(ValueError):
+                parse_zones(data)
+        self.assertEqual(parse_zones(None), [])
+
+    def test_no_zones(self):
+        zones = DetectionZones([])
+        self.assertFalse(zones)
+        self.assertIsNone(zones.get_mask((320, 180)))
+        mask = np.full((180, 320), 255, np.uint8)
+        self.assertIs(zones.apply(mask), mask)
+
+    def test_exclude_zone(self):
+        zones = DetectionZones([{"kind": "exclude", "points": TRIANGLE}])
+        mask = zones.get_mask((320, 180))
+        self.assertEqual(mask.shape, (180, 320))
+        self.assertEqual(mask[10, 10], 0)
+        self.assertEqual(mask[170, 310], 255)
+
+    def test_include_and_exclude_zones(self):
+        zones = DetectionZones(
+            [
+                {"kind": "include", "points": RIGHT_HALF},
+                {"kind": "exclude", "points": [[0.9, 0.9], [1, 0.9], [1, 1]]},
+            ]
+        )
+        mask = zones.get_mask((320, 180))
+        self.assertEqual(mask[90, 50], 0)
+        self.assertEqual(mask[90, 250], 255)
+        self.assertEqual(mask[179, 319], 0)
+
+    def test_mask_cached_per_size(self):
+        zones = DetectionZones([{"kind": "exclude", "points": TRIANGLE}])
+        mask = zones.get_mask((320, 180))
+        self.assertIs(zones.get_mask((320, 180)), mask)
+        self.assertEqual(zones.get_mask((160, 90)).shape, (90, 160))
+
+    def test_apply(self):
+        zones = DetectionZones([{"kind": "include", "points": RIGHT_HALF}])
+        foreground_mask = np.full((180, 320), 255, np.uint8)
+        masked = zones.apply(foreground_mask)
+        self.assertEqual(masked[:, :150].max(), 0)
+        self.assertEqual(masked[:, 170:].min(), 255)
+        self.assertEqual(zones.data[0]["kind"], "include")
+
+
+if __name__ == "__main__":
+    unittest.main()